@@ -0,0 +1,174 @@
+"""Compare reading tags with one parse per file (metadata.read_tags) to the
+previous approach, which parsed ID3 and MP4 files twice. Builds a corpus of
+tagged MP3, M4A, FLAC and WAV files with embedded cover art, checks both
+give the same tags and pictures, and reports the time per file.
+
+    python benchmarks/metadata_parse.py --files 200 --cover-size 500
+"""
+import argparse
+import os
+import posixpath
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, posixpath.dirname(posixpath.dirname(os.path.abspath(__file__))))
+
+import mutagen
+from mutagen.easyid3 import EasyID3
+from mutagen.flac import Picture
+from mutagen.id3 import APIC, COMM, TALB, TIT2, TMCL, TPE1, TRCK, WOAF
+from mutagen.mp4 import MP4Cover
+
+from songs_to_youtube.metadata import read_tags
+from songs_to_youtube.utils import make_value_qt_safe
+
+FORMATS = {
+    "mp3": ["-c:a", "libmp3lame", "-b:a", "128k"],
+    "m4a": ["-c:a", "aac", "-b:a", "128k"],
+    "flac": ["-c:a", "flac"],
+    "wav": ["-c:a", "pcm_s16le"],
+}
+
+
+def two_pass_read_tags(path):
+    """How tags were read before: easy=True first, then the file was
+    opened again for the ID3 frames and MP4 cover art"""
+    tags = {}
+    pictures = []
+    f = mutagen.File(path, easy=True)
+    if f.tags:
+        for key, value in f.tags.items():
+            tags[key] = make_value_qt_safe(value)
+
+        if isinstance(f.tags, mutagen.easyid3.EasyID3) or isinstance(
+            f.tags, mutagen.id3.ID3
+        ):
+            if isinstance(f.tags, mutagen.easyid3.EasyID3):
+                f = mutagen.File(path)
+            for key in f:
+                if key.startswith("WOAF") or key.startswith("WAF"):
+                    tags["website"] = make_value_qt_safe(f[key])
+                if key.startswith("COM"):
+                    tags["comment"] = make_value_qt_safe(f[key])
+                if key.startswith("APIC") or key.startswith("PIC"):
+                    pictures.append(f[key].data)
+            if isinstance(f.tags, mutagen.id3.ID3):
+                for key, getter in EasyID3.Get.items():
+                    try:
+                        value = getter(f.tags, key)
+                        tags[key] = make_value_qt_safe(value)
+                    except:
+                        pass
+        elif isinstance(f.tags, mutagen.easymp4.EasyMP4Tags):
+            f = mutagen.File(path)
+            if "covr" in f:
+                for art in f["covr"]:
+                    pictures.append(bytes(art))
+        elif isinstance(f, mutagen.flac.FLAC):
+            for picture in f.pictures:
+                pictures.append(picture.data)
+    if f.info:
+        for key, value in vars(f.info).items():
+            tags[key] = make_value_qt_safe(value)
+    return tags, pictures
+
+
+def create_source(directory, ext, seconds):
+    path = posixpath.join(directory, f"source.{ext}")
+    subprocess.run(
+        ["ffmpeg", "-loglevel", "error", "-y", "-f", "lavfi"]
+        + ["-i", f"sine=frequency=440:duration={seconds}"]
+        + FORMATS[ext]
+        + [path],
+        check=True,
+    )
+    return path
+
+
+def add_id3(tags, i, cover):
+    tags.add(TIT2(encoding=3, text=f"Song {i}"))
+    tags.add(TPE1(encoding=3, text="Artist"))
+    tags.add(TALB(encoding=3, text="Album"))
+    tags.add(TRCK(encoding=3, text=f"{i}/99"))
+    tags.add(TMCL(encoding=3, people=[["guitar", "Someone"]]))
+    tags.add(COMM(encoding=3, lang="eng", desc="", text="A comment"))
+    tags.add(WOAF(url="https://example.com"))
+    tags.add(APIC(encoding=3, mime="image/jpeg", type=3, desc="", data=cover))
+
+
+def tag_file(path, i, cover):
+    f = mutagen.File(path)
+    if path.endswith((".mp3", ".wav")):
+        if f.tags is None:
+            f.add_tags()
+        add_id3(f.tags, i, cover)
+    elif path.endswith(".m4a"):
+        f["\xa9nam"] = f"Song {i}"
+        f["\xa9ART"] = "Artist"
+        f["\xa9alb"] = "Album"
+        f["trkn"] = [(i, 99)]
+        f["purl"] = "https://example.com"
+        f["covr"] = [MP4Cover(cover, MP4Cover.FORMAT_JPEG)]
+    else:
+        f["title"] = f"Song {i}"
+        f["artist"] = "Artist"
+        f["album"] = "Album"
+        f["tracknumber"] = str(i)
+        picture = Picture()
+        picture.type = 3
+        picture.mime = "image/jpeg"
+        picture.data = cover
+        f.add_picture(picture)
+    f.save()
+
+
+def create_corpus(directory, files, cover_size, seconds):
+    cover = os.urandom(cover_size * 1024)
+    sources = {ext: create_source(directory, ext, seconds) for ext in FORMATS}
+    paths = []
+    for i in range(files):
+        ext = list(FORMATS)[i % len(FORMATS)]
+        path = posixpath.join(directory, f"{i}.{ext}")
+        with open(sources[ext], "rb") as src, open(path, "wb") as dst:
+            dst.write(src.read())
+        tag_file(path, i + 1, cover)
+        paths.append(path)
+    return paths
+
+
+def time_per_file(read, paths, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for path in paths:
+            read(path)
+        elapsed = (time.perf_counter() - start) / len(paths)
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--cover-size", type=int, default=500, help="cover art size in KB")
+    parser.add_argument("--seconds", type=int, default=5, help="audio length")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = create_corpus(directory, args.files, args.cover_size, args.seconds)
+        for path in paths:
+            assert read_tags(path) == two_pass_read_tags(path), f"{path} differs"
+        print(f"{len(paths)} files, both ways give the same tags and pictures\n")
+        print("Format   two parses (ms)   one parse (ms)   speedup")
+        for ext in FORMATS:
+            subset = [path for path in paths if path.endswith(ext)]
+            before = time_per_file(two_pass_read_tags, subset, args.repeat) * 1000
+            after = time_per_file(read_tags, subset, args.repeat) * 1000
+            print(f"{ext:<8} {before:>15.3f} {after:>16.3f} {before / after:>8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
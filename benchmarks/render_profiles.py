@@ -0,0 +1,85 @@
+"""Compare the speed and output size of the render profiles in
+songs_to_youtube/commands/render by rendering the same song with each one.
+
+    python benchmarks/render_profiles.py song.flac cover.jpg
+"""
+import argparse
+import os
+import posixpath
+import subprocess
+import tempfile
+import time
+
+COMMANDS_DIR = posixpath.join(
+    posixpath.dirname(posixpath.dirname(os.path.abspath(__file__)).replace("\\", "/")),
+    "songs_to_youtube",
+    "commands",
+    "render",
+)
+
+
+def get_duration(song_path):
+    output = subprocess.run(
+        [
+            "ffprobe",
+            "-v",
+            "error",
+            "-show_entries",
+            "format=duration",
+            "-of",
+            "default=noprint_wrappers=1:nokey=1",
+            song_path,
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return float(output.strip())
+
+
+def get_profiles(names):
+    for file in sorted(os.listdir(COMMANDS_DIR)):
+        name = file[: -len(".command")]
+        if file.endswith(".command") and (not names or name in names):
+            with open(posixpath.join(COMMANDS_DIR, file), "r") as f:
+                yield name, f.read().strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("song")
+    parser.add_argument("cover")
+    parser.add_argument("--duration", type=float, help="song duration in seconds")
+    parser.add_argument("--width", default="1920")
+    parser.add_argument("--height", default="1080")
+    parser.add_argument("--profiles", nargs="*", help="profiles to compare")
+    args = parser.parse_args()
+
+    duration = args.duration or get_duration(args.song)
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{'profile':40} {'seconds':>8} {'x realtime':>10} {'MB':>8}")
+        for name, command in get_profiles(args.profiles):
+            output = posixpath.join(tmp.replace("\\", "/"), f"{name}.mkv")
+            command = command.format(
+                coverArt=args.cover,
+                song_path=args.song,
+                songDuration=duration,
+                videoWidth=args.width,
+                videoHeight=args.height,
+                backgroundColor="black",
+                audioCodec="copy",
+                fileOutput=output,
+            )
+            start = time.perf_counter()
+            result = subprocess.run(command, shell=True, capture_output=True)
+            elapsed = time.perf_counter() - start
+            if result.returncode != 0:
+                print(f"{name:40} failed: {result.stderr.decode().strip()}")
+                continue
+            size = os.path.getsize(output) / 1e6
+            print(f"{name:40} {elapsed:8.2f} {duration / elapsed:10.1f} {size:8.2f}")
+            os.remove(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Upload a file to the fake YouTube server while it drops connections, stop
+the upload half way as if the app was closed, and finish it with a new
+session. Checks the server ended up with the exact file, and reports how
+much data had to be sent again.
+
+    python benchmarks/resumable_upload.py --size 64 --drop-rate 0.2
+"""
+import argparse
+import os
+import posixpath
+import sys
+import tempfile
+import time
+from http.cookiejar import Cookie, MozillaCookieJar
+from types import SimpleNamespace
+
+sys.path.insert(0, posixpath.dirname(posixpath.dirname(os.path.abspath(__file__))))
+
+from songs_to_youtube.journal import JobJournal
+from songs_to_youtube.upload import PlaylistRegistry, UploadSession
+from tests.fake_youtube import FakeYouTube, install
+
+
+class Stopped(Exception):
+    pass
+
+
+def write_cookies(path):
+    cj = MozillaCookieJar(path)
+    cj.set_cookie(
+        Cookie(
+            0, "SAPISID", "fake", None, False, ".youtube.com", True, True,
+            "/", True, True, None, False, None, None, {},
+        )
+    )
+    cj.save(ignore_discard=True, ignore_expires=True)
+
+
+def create_session(cookies_path, journal, server, chunk_size):
+    session = UploadSession(MozillaCookieJar(cookies_path), PlaylistRegistry(), journal)
+    session.CHUNK_SIZE = chunk_size
+    # don't wait between retries, the server is local
+    session.MAX_BACKOFF = 0
+    install(session._session, server)
+    return session
+
+
+def upload(session, file_path, stop_at=None):
+    def progress_callback(step, percent):
+        if stop_at is not None and percent >= stop_at:
+            raise Stopped()
+
+    session.file_path = file_path
+    data = SimpleNamespace(authuser="0")
+    url = session._get_video_upload_url(data)
+    return session._upload_file(
+        url, file_path, progress_callback, "get_upload_url", "upload_video"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=64, help="file size in MB")
+    parser.add_argument("--chunk-size", type=int, default=4, help="chunk size in MB")
+    parser.add_argument("--drop-rate", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    server = FakeYouTube(drop_rate=args.drop_rate, seed=args.seed).start()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        file_path = posixpath.join(temp_dir, "video.mp4")
+        with open(file_path, "wb") as f:
+            f.write(os.urandom(args.size * 1024 * 1024))
+        cookies_path = posixpath.join(temp_dir, "cookies.txt")
+        write_cookies(cookies_path)
+        journal = JobJournal(posixpath.join(temp_dir, "journal.sqlite3"))
+        chunk_size = args.chunk_size * 1024 * 1024
+
+        start = time.perf_counter()
+        try:
+            # the video upload is 20% to 70% of the progress
+            upload(create_session(cookies_path, journal, server, chunk_size), file_path, 45)
+        except Stopped:
+            pass
+        saved = journal.get_upload(file_path)
+        print(f"Stopped at byte {saved[2]} of {os.path.getsize(file_path)}")
+        resource_id = upload(
+            create_session(cookies_path, journal, server, chunk_size), file_path
+        )
+        elapsed = time.perf_counter() - start
+
+        (uploaded,) = server.uploads.values()
+        with open(file_path, "rb") as f:
+            assert uploaded.data == f.read(), "uploaded data differs from the file"
+        size = os.path.getsize(file_path)
+        print(f"Finished {resource_id} in {elapsed:.2f}s")
+        print(f"Dropped connections: {server.dropped}")
+        print(
+            f"Sent {server.received} bytes for a {size} byte file "
+            f"({100 * (server.received - size) / size:.1f}% resent)"
+        )
+        journal.connection.close()
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
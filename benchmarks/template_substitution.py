@@ -0,0 +1,131 @@
+"""Compare substituting the templates in config/default.ini with the compiled
+templates in songs_to_youtube/template.py to the previous approach, which
+ran the placeholder regex and parsed every placeholder on each call. Checks
+both give the same results, including for edge cases, and reports the time
+per substitution.
+
+    python benchmarks/template_substitution.py --repeat 20000
+"""
+import argparse
+import os
+import posixpath
+import sys
+import time
+
+sys.path.insert(0, posixpath.dirname(posixpath.dirname(os.path.abspath(__file__))))
+
+from pathvalidate import sanitize_filename
+from PySide6.QtCore import QSettings
+
+from songs_to_youtube.template import SettingTemplate, compile_template
+from songs_to_youtube.utils import resource_path
+
+EDGE_CASES = [
+    "",
+    "no placeholders",
+    "~~{escaped} ~",
+    "~{missing}",
+    "~{missing|\"literal\"}",
+    "~{<missing>|title}",
+    "~{missing|<title>}",
+    "~{\"title\"}",
+    "~none ~None ~{}",
+    "~{title}~{artist}~~~{album}",
+    "~{a|b|c|d|\"\"}",
+]
+
+# tags and fields like those of a song item
+MAPPING = {
+    "song_dir": "/music/Artist/Album",
+    "song_file": "01 - Song: Title?.flac",
+    "song_path": "/music/Artist/Album/01 - Song: Title?.flac",
+    "album_dir": "/music/Artist/Album",
+    "title": "Song: Title?",
+    "artist": "Artist",
+    "album": "Album",
+    "albumartist": "Artist",
+    "date": "2020",
+    "comment": "A comment",
+    "song.album": "Album",
+    "song.albumartist": "Artist",
+    "song.date": "2020",
+    "song.website": "https://example.com",
+    "timestamps": "00:00:00 Song",
+    "%H": "0",
+    "%0M": "00",
+    "%0S": "00",
+    "videoTitle": "Artist - Song: Title?",
+    **{f"tag{i}": f"value {i}" for i in range(40)},
+}
+
+
+def regex_safe_substitute(template, mapping):
+    """How templates were substituted before"""
+
+    def convert(mo):
+        named = mo.group("named") or mo.group("braced")
+        if named is not None:
+            for arg in named.split("|"):
+                if arg in mapping:
+                    return str(mapping[arg])
+                elif len(arg) >= 2 and arg[0] == '"' and arg[-1] == '"':
+                    return arg[1:-1]
+                elif len(arg) >= 2 and arg[0] == "<" and arg[-1] == ">":
+                    arg = arg[1:-1]
+                    if arg in mapping:
+                        return sanitize_filename(str(mapping[arg]))
+                    else:
+                        return "INVALID"
+            return mo.group()
+        if mo.group("escaped") is not None:
+            return SettingTemplate.delimiter
+        if mo.group("invalid") is not None:
+            return mo.group()
+
+    return SettingTemplate.pattern.sub(convert, template)
+
+
+def default_templates():
+    defaults = QSettings(resource_path("config/default.ini"), QSettings.IniFormat)
+    return {
+        key: defaults.value(key)
+        for key in defaults.allKeys()
+        if "~" in str(defaults.value(key))
+    }
+
+
+def time_per_call(substitute, templates, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for template in templates:
+            substitute(template)
+    return (time.perf_counter() - start) / (repeat * len(templates))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=20000)
+    args = parser.parse_args()
+
+    templates = default_templates()
+    for template in [*templates.values(), *EDGE_CASES]:
+        expected = regex_safe_substitute(template, MAPPING)
+        actual = compile_template(template).substitute(MAPPING)
+        assert actual == expected, f"{template!r}: {actual!r} != {expected!r}"
+    print(f"{len(templates)} default templates and {len(EDGE_CASES)} edge cases agree\n")
+
+    print("Template               regex (us)   compiled (us)   speedup")
+    for key, template in templates.items():
+        before = time_per_call(
+            lambda t: regex_safe_substitute(t, MAPPING), [template], args.repeat
+        )
+        after = time_per_call(
+            lambda t: compile_template(t).substitute(MAPPING), [template], args.repeat
+        )
+        print(
+            f"{key:<22} {before * 1e6:>10.2f} {after * 1e6:>15.2f} {before / after:>8.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
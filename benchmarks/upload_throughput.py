@@ -0,0 +1,184 @@
+"""Measure how fast Uploader gets videos through to the fake YouTube server
+in tests/fake_youtube.py. Reports the throughput, the time spent in
+each upload step and the time each job spends on anything but sending the
+video, so changes to the upload orchestration can be compared.
+
+    python benchmarks/upload_throughput.py --videos 8 --size 32 --latency 0.05
+"""
+import argparse
+import os
+import posixpath
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from http.cookiejar import Cookie, MozillaCookieJar
+
+sys.path.insert(0, posixpath.dirname(posixpath.dirname(os.path.abspath(__file__))))
+
+from PySide6.QtCore import QCoreApplication
+from youtube_up import Metadata, Playlist
+
+import songs_to_youtube.upload as upload_module
+from songs_to_youtube.journal import JobJournal
+from songs_to_youtube.upload import Uploader, UploadSession, UploadWorker
+from tests.fake_youtube import FakeYouTube, install
+
+
+def write_cookies(path):
+    cj = MozillaCookieJar(path)
+    cj.set_cookie(
+        Cookie(
+            0, "SAPISID", "fake", None, False, ".youtube.com", True, True,
+            "/", True, True, None, False, None, None, {},
+        )
+    )
+    cj.save(ignore_discard=True, ignore_expires=True)
+
+
+class StepTimes:
+    """Records when each job reached each upload step"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # file -> [(step, time)]
+        self.steps = {}
+
+    def add(self, file, step):
+        with self.lock:
+            self.steps.setdefault(file, []).append((step, time.perf_counter()))
+
+    def durations(self):
+        """Returns {file: {step: seconds from the step before until it finished}}"""
+        durations = {}
+        for file, steps in self.steps.items():
+            # a step is reported again as it makes progress, keep its last report
+            finished = []
+            for step, at in steps:
+                if finished and finished[-1][0] == step:
+                    finished[-1] = (step, at)
+                else:
+                    finished.append((step, at))
+            durations[file] = {
+                step: end - start
+                for (_, start), (step, end) in zip(finished, finished[1:])
+            }
+        return durations
+
+
+def patch_upload_module(server, cookies_path, journal_path, settings, step_times):
+    """Points the upload sessions Uploader creates at the fake server"""
+
+    class BenchmarkUploadSession(UploadSession):
+        def __init__(self, cookie_jar, playlists):
+            super().__init__(cookie_jar, playlists, JobJournal(journal_path))
+            install(self._session, server)
+            # a session token is normally fetched with a browser
+            self._session_token = "fake-session-token"
+
+        def upload(self, file_path, metadata, progress_callback=lambda step, percent: None):
+            def callback(step, percent):
+                step_times.add(file_path, step)
+                progress_callback(step, percent)
+
+            return super().upload(file_path, metadata, callback)
+
+    get_setting = upload_module.get_setting
+    upload_module.UploadSession = BenchmarkUploadSession
+    upload_module.get_setting = lambda setting: settings.get(setting) or get_setting(
+        setting
+    )
+    upload_module.get_cookie_jar_for_username = lambda username: MozillaCookieJar(
+        cookies_path
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--videos", type=int, default=8)
+    parser.add_argument("--size", type=int, default=16, help="video size in MB")
+    parser.add_argument("--concurrency", type=int, default=2, help="uploadConcurrency")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds per request")
+    parser.add_argument(
+        "--bandwidth", type=float, default=None, help="MB/s per connection, default no limit"
+    )
+    parser.add_argument("--drop-rate", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--playlist", default="Benchmark", help="empty for no playlist")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    app = QCoreApplication(sys.argv)
+    server = FakeYouTube(
+        latency=args.latency,
+        bandwidth=args.bandwidth and args.bandwidth * 1024 * 1024,
+        drop_rate=args.drop_rate,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    ).start()
+    # retry straight away, the failures are injected
+    UploadSession.MAX_BACKOFF = 0
+    step_times = StepTimes()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cookies_path = posixpath.join(temp_dir, "cookies.txt")
+        write_cookies(cookies_path)
+        settings = {"uploadConcurrency": str(args.concurrency)}
+        patch_upload_module(
+            server,
+            cookies_path,
+            posixpath.join(temp_dir, "journal.sqlite3"),
+            settings,
+            step_times,
+        )
+
+        files = []
+        for i in range(args.videos):
+            file = posixpath.join(temp_dir, f"video{i}.mkv")
+            with open(file, "wb") as f:
+                f.write(os.urandom(args.size * 1024 * 1024))
+            files.append(file)
+
+        uploader = Uploader({file: True for file in files}, username="benchmark")
+        uploader.finished.connect(lambda results: app.quit())
+        playlists = [Playlist(args.playlist)] if args.playlist else []
+        for i, file in enumerate(files):
+            uploader.add_job(
+                file, Metadata(f"Video {i}", "Benchmark", "PRIVATE", playlists=playlists)
+            )
+
+        start = time.perf_counter()
+        uploader.upload()
+        if not uploader.done:
+            app.exec()
+        elapsed = time.perf_counter() - start
+        server.stop()
+
+    uploaded = sum(1 for success in uploader.results.values() if success)
+    total_mb = uploaded * args.size
+    print(
+        f"{uploaded}/{len(files)} videos, {total_mb} MB in {elapsed:.2f}s: "
+        f"{total_mb / elapsed:.2f} MB/s with {args.concurrency} at once"
+    )
+    print(f"Dropped connections: {server.dropped}, injected errors: {server.errors}")
+
+    durations = step_times.durations()
+    print("\nStep                      mean (s)   max (s)")
+    for step, message in UploadWorker.UPLOAD_STEP_MESSAGES.items():
+        times = [steps[step] for steps in durations.values() if step in steps]
+        if times:
+            print(f"{message:<25} {statistics.mean(times):>8.3f} {max(times):>9.3f}")
+    overheads = [
+        sum(steps.values()) - steps.get("upload_video", 0)
+        for steps in durations.values()
+    ]
+    if overheads:
+        print(
+            f"\nOverhead per job (everything but sending the video): "
+            f"{statistics.mean(overheads):.3f}s mean, {max(overheads):.3f}s max"
+        )
+
+
+if __name__ == "__main__":
+    main()
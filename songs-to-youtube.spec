@@ -11,6 +11,7 @@ a = Analysis(['songs_to_youtube/main.py'],
                     ('songs_to_youtube/config/*.ini', 'config'),
                     ('songs_to_youtube/commands/concat/*.command', 'commands/concat'),
                     ('songs_to_youtube/commands/render/*.command', 'commands/render'),
+                    ('songs_to_youtube/commands/album/*.command', 'commands/album'),
                     ('songs_to_youtube/image/*', 'image')],
              hookspath=['pyinstaller_hooks'],
              hooksconfig={},
@@ -0,0 +1,212 @@
+import hashlib
+import logging
+import os
+import posixpath
+import subprocess
+import threading
+from collections.abc import Mapping
+
+from PySide6.QtCore import QByteArray, QDir, QIODevice, QSize, Qt, QTemporaryFile
+
+from songs_to_youtube.cache import DiskCache, file_digest, get_cache_dir
+from songs_to_youtube.const import *
+from songs_to_youtube.cover_art import ensure_cover_art, get_scaled_cover
+from songs_to_youtube.settings import get_setting
+
+logger = logging.getLogger(APPLICATION)
+
+# ffmpeg filter graphs which turn the cover art (input 0)
+# into a videoWidth x videoHeight background frame
+BACKGROUND_STYLES = {
+    "blurred": (
+        "[0:v]scale={videoWidth}:{videoHeight}:force_original_aspect_ratio=increase,gblur=sigma=10[bg];"
+        "[0:v]scale={videoWidth}:{videoHeight}:force_original_aspect_ratio=decrease[ov];"
+        "[bg][ov]overlay=(W-w)/2:(H-h)/2,crop=w={videoWidth}:h={videoHeight}"
+    ),
+    "vertical blurred": (
+        "[0:v]scale={videoWidth}:{videoHeight}:force_original_aspect_ratio=increase,dblur=angle=90:radius=25[bg];"
+        "[0:v]scale={videoWidth}:{videoHeight}:force_original_aspect_ratio=decrease[ov];"
+        "[bg][ov]overlay=(W-w)/2:(H-h)/2,crop=w={videoWidth}:h={videoHeight}"
+    ),
+    "solid color": (
+        "[0:v]scale={videoWidth}:{videoHeight}:force_original_aspect_ratio=decrease,"
+        "pad={videoWidth}:{videoHeight}:-1:-1:color={backgroundColor}"
+    ),
+}
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_background_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            max_size = int(get_setting("backgroundCacheSize")) * 1024 * 1024
+            _cache = DiskCache(get_cache_dir("backgrounds"), max_size)
+        return _cache
+
+
+def prepare_cover_art(values: dict, cache=None):
+    """Makes sure the item's cover art file exists and, if it is larger than
+    needed to fill a videoWidth x videoHeight frame, points values["coverArt"]
+    at a copy scaled down to that, so ffmpeg does not decode and scale the
+    full size image on every render"""
+    if ensure_cover_art(values["coverArt"]) is None:
+        return
+    size = QSize(int(values["videoWidth"]), int(values["videoHeight"]))
+    try:
+        values["coverArt"] = get_scaled_cover(
+            values["coverArt"],
+            size,
+            # keep enough of the image to fill the frame once cropped
+            Qt.KeepAspectRatioByExpanding,
+            cache or get_background_cache(),
+        )
+    except Exception as e:
+        logger.warning(f"Could not scale down {values['coverArt']}: {e}")
+
+
+def compose_background(cover_path, style, output_path, **values):
+    """Renders a single background frame for the cover with ffmpeg"""
+    graph = BACKGROUND_STYLES[style].format(**values)
+    command = [
+        "ffmpeg",
+        "-loglevel",
+        "error",
+        "-y",
+        "-i",
+        cover_path,
+        "-lavfi",
+        graph,
+        "-frames:v",
+        "1",
+        output_path,
+    ]
+    kwargs = {"creationflags": subprocess.CREATE_NO_WINDOW} if os.name == "nt" else {}
+    result = subprocess.run(
+        command, stdin=subprocess.DEVNULL, capture_output=True, **kwargs
+    )
+    if result.returncode != 0:
+        raise RuntimeError(
+            f"Could not compose {style} background for {cover_path}: "
+            + result.stderr.decode("utf-8", "replace").strip()
+        )
+
+
+def get_background_frame(
+    cover_path, style, videoWidth, videoHeight, backgroundColor, cache=None
+):
+    """Returns the path of a PNG of the cover composed onto a background
+    of the given style, composing it only if it is not cached yet"""
+    if style not in BACKGROUND_STYLES:
+        raise KeyError(f"Unknown background style '{style}'")
+    cache = cache or get_background_cache()
+    key_source = "\0".join(
+        (
+            file_digest(cover_path),
+            str(videoWidth),
+            str(videoHeight),
+            style,
+            str(backgroundColor),
+        )
+    )
+    key = hashlib.sha256(key_source.encode("utf-8")).hexdigest()
+
+    def create(path):
+        logger.debug(f"Composing {style} background for {cover_path}")
+        compose_background(
+            cover_path,
+            style,
+            path,
+            videoWidth=videoWidth,
+            videoHeight=videoHeight,
+            backgroundColor=backgroundColor,
+        )
+
+    return cache.get_or_create(key, ".png", create)
+
+
+class BackgroundFrames(Mapping):
+    """Background frames for an item, composed on first access. Render
+    commands use it as {background[style]} in place of the cover art,
+    e.g. {background[blurred]}"""
+
+    def __init__(self, values: dict, cache=None):
+        self.values = values
+        self.cache = cache or get_background_cache()
+
+    def __getitem__(self, style):
+        return get_background_frame(
+            self.values["coverArt"],
+            style,
+            self.values["videoWidth"],
+            self.values["videoHeight"],
+            self.values["backgroundColor"],
+            self.cache,
+        )
+
+    def __iter__(self):
+        return iter(BACKGROUND_STYLES)
+
+    def __len__(self):
+        return len(BACKGROUND_STYLES)
+
+
+class BackgroundConcatLists(Mapping):
+    """ffmpeg concat demuxer lists which show each song's background frame
+    for the length of the song, written on first access. Album commands use
+    it as {cover_list[style]}, e.g. {cover_list[blurred]}"""
+
+    def __init__(self, segments, videoWidth, videoHeight, cache=None):
+        # list of (song values, duration in seconds)
+        self.segments = segments
+        self.videoWidth = videoWidth
+        self.videoHeight = videoHeight
+        self.cache = cache or get_background_cache()
+        # keep the list files alive until we are done with them
+        self.files = {}
+
+    def __getitem__(self, style):
+        if style in self.files:
+            return self.files[style].fileName()
+        # merge consecutive songs with the same frame into one entry
+        entries = []
+        for values, duration in self.segments:
+            frame = get_background_frame(
+                values["coverArt"],
+                style,
+                self.videoWidth,
+                self.videoHeight,
+                values["backgroundColor"],
+                self.cache,
+            )
+            if entries and entries[-1][0] == frame:
+                entries[-1][1] += duration
+            else:
+                entries.append([frame, duration])
+        list_file = QTemporaryFile(
+            posixpath.join(QDir().tempPath(), APPLICATION, "XXXXXX.txt")
+        )
+        list_file.open(QIODevice.WriteOnly | QIODevice.Text)
+        for frame, duration in entries:
+            list_file.write(
+                QByteArray(
+                    "file 'file:{}'\nduration {:.6f}\n".format(
+                        frame.replace("'", "'\\''"), duration
+                    )
+                )
+            )
+        # the last duration is only respected if the last file is repeated
+        list_file.write(
+            QByteArray("file 'file:{}'\n".format(entries[-1][0].replace("'", "'\\''")))
+        )
+        list_file.close()
+        self.files[style] = list_file
+        return list_file.fileName()
+
+    def __iter__(self):
+        return iter(BACKGROUND_STYLES)
+
+    def __len__(self):
+        return len(BACKGROUND_STYLES)
@@ -0,0 +1,332 @@
+import argparse
+import json
+import logging
+import os
+import sys
+
+from PySide6.QtCore import *
+
+from songs_to_youtube.const import *
+from songs_to_youtube.field import SETTINGS_VALUES
+from songs_to_youtube.journal import BATCH_RUN, JobJournal
+from songs_to_youtube.log import convert_log_level
+from songs_to_youtube.pipeline import RenderUploadPipeline
+from songs_to_youtube.settings import get_setting
+from songs_to_youtube.song_tree_widget_item import *
+from songs_to_youtube.utils import *
+
+logger = logging.getLogger(APPLICATION)
+
+EXIT_SUCCESS = 0
+EXIT_FAILURE = 1
+EXIT_USAGE = 2
+
+
+def create_song_item(file_path: str, settings=None):
+    """Returns a SongTreeWidgetItem for the given file with settings applied"""
+    item = SongTreeWidgetItem(file_path)
+    item.setText(QFileInfo(file_path).fileName())
+    apply_settings(item, settings)
+    return item
+
+
+def create_album_items(dir_path: str, settings=None):
+    """Generates an AlbumTreeWidgetItem for the given directory
+    and each of its subdirectories which contain audio files"""
+    songs = []
+    for file_path in files_in_directory(dir_path):
+        if os.name == "nt" and len(file_path) > 255:
+            file_path = get_short_path_name(file_path)
+        info = QFileInfo(file_path)
+        if not info.isReadable():
+            logger.warning("File {} is not readable".format(file_path))
+            continue
+        if info.isDir():
+            yield from create_album_items(file_path, settings)
+        elif file_is_audio(file_path):
+            songs.append(create_song_item(file_path, settings))
+    if len(songs) > 0:
+        album = AlbumTreeWidgetItem(dir_path, songs)
+        album.setText(dir_path)
+        apply_settings(album, settings)
+        yield album
+
+
+def apply_settings(item, settings):
+    """Overrides the item's field values with the given settings"""
+    if not settings:
+        return
+    for field, value in settings.items():
+        item.set(field, str(value))
+    item.data(CustomDataRole.ITEMDATA).update_fields()
+
+
+def load_manifest(path: str):
+    """Loads a JSON manifest. The manifest is a list whose entries are either
+    paths or objects of the form {"path": ..., "type": "album" | "song", "settings": {...}}"""
+    with open(path, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+    if not isinstance(entries, list):
+        raise ValueError(f"Manifest {path} must contain a list of entries")
+    manifest_dir = os.path.dirname(os.path.abspath(path))
+    for i, entry in enumerate(entries):
+        if isinstance(entry, str):
+            entry = {"path": entry}
+        if not isinstance(entry, dict):
+            raise ValueError(
+                f"Entry {i} of manifest {path} must be a path or an object, "
+                f"not {json.dumps(entry)}"
+            )
+        if not isinstance(entry.get("path"), str):
+            raise ValueError(f"Entry {i} of manifest {path} must have a path")
+        if entry.get("type") not in (None, "album", "song"):
+            raise ValueError(
+                f'The type of entry {i} of manifest {path} must be "album" or "song"'
+            )
+        if not isinstance(entry.get("settings", {}), dict):
+            raise ValueError(
+                f"The settings of entry {i} of manifest {path} must be an object"
+            )
+        entry_path = os.path.join(manifest_dir, os.path.expanduser(entry["path"]))
+        yield entry_path, entry.get("type"), entry.get("settings", {})
+
+
+def collect_items(inputs, settings, song_mode=False):
+    """Creates tree items for each (path, type, settings) input"""
+    items = []
+    for path, item_type, item_settings in inputs:
+        path = QDir.fromNativeSeparators(os.path.abspath(path))
+        merged_settings = {**settings, **item_settings}
+        if not os.path.exists(path):
+            logger.error(f"Input {path} does not exist")
+            continue
+        if os.path.isdir(path):
+            if item_type == "song" or (item_type is None and song_mode):
+                for file_path in files_in_directory_and_subdirectories(path):
+                    if os.path.isfile(file_path) and file_is_audio(file_path):
+                        items.append(create_song_item(file_path, merged_settings))
+            else:
+                items.extend(create_album_items(path, merged_settings))
+        elif file_is_audio(path):
+            items.append(create_song_item(path, merged_settings))
+        else:
+            logger.warning(f"File {path} is not audio")
+    return items
+
+
+class BatchRunner(QObject):
+    """Renders and uploads items without any widgets,
+    then exits the event loop with an exit code"""
+
+    def __init__(
+        self, items, upload=True, username=None, results_path="-", resume=False
+    ):
+        super().__init__()
+        self.items = items
+        self.upload = upload
+        self.username = username
+        self.results_path = results_path
+        self.resume = resume
+        self.pipeline = None
+        self.render_results = {}
+        self.upload_results = {}
+        self.error = False
+
+    def start(self):
+        self.pipeline = RenderUploadPipeline(
+            self.items, self.upload, self.username, self.resume, BATCH_RUN
+        )
+        self.pipeline.renderer.worker_error.connect(
+            lambda worker_name, error: logger.error(f"{worker_name} - {error}")
+        )
+        self.pipeline.renderer.worker_done.connect(
+            lambda worker_name, success: self.log_done(worker_name, success, "rendering")
+        )
+        self.pipeline.uploader.worker_done.connect(
+            lambda worker_name, success: self.log_done(worker_name, success, "uploading")
+        )
+        self.pipeline.render_finished.connect(self.on_render_finished)
+        self.pipeline.finished.connect(self.on_finished)
+        try:
+            self.pipeline.start()
+        except Exception as e:
+            logger.error(f"Could not queue render jobs: {e}")
+            self.error = True
+            self.pipeline.cancel()
+
+    def log_done(self, worker_name, success, obj_type):
+        if success:
+            logger.success(f"{worker_name} - Done {obj_type}")
+        else:
+            logger.error(f"{worker_name} - Error while {obj_type}")
+
+    def on_render_finished(self, results):
+        logger.success(
+            "{}/{} renders successful".format(
+                sum(int(s) for s in results.values()), len(results)
+            )
+        )
+
+    def on_finished(self, render_results, upload_results):
+        self.render_results = render_results
+        self.upload_results = upload_results
+        if self.upload:
+            logger.success(
+                "{}/{} uploads successful".format(
+                    sum(int(s) for s in upload_results.values()), len(upload_results)
+                )
+            )
+        if get_setting("deleteAfterUploading") == SETTINGS_VALUES.CheckBox.CHECKED:
+            for path, success in upload_results.items():
+                if success:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        logger.warning(f"Could not delete {path}")
+        self.finish()
+
+    def succeeded(self):
+        return (
+            not self.error
+            and (self.pipeline is None or len(self.pipeline.skipped) == 0)
+            and all(self.render_results.values())
+            and all(self.upload_results.values())
+        )
+
+    def finish(self):
+        output = json.dumps(
+            {
+                "render": self.render_results,
+                "upload": self.upload_results,
+                "skipped": self.pipeline.skipped if self.pipeline else [],
+                "success": self.succeeded(),
+            },
+            indent=2,
+        )
+        if self.results_path == "-":
+            print(output)
+        else:
+            with open(self.results_path, "w", encoding="utf-8") as f:
+                f.write(output)
+        QCoreApplication.exit(EXIT_SUCCESS if self.succeeded() else EXIT_FAILURE)
+
+
+def parse_setting(text: str):
+    if "=" not in text:
+        raise argparse.ArgumentTypeError(f"Setting '{text}' must be of the form key=value")
+    key, value = text.split("=", 1)
+    return key, value
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        prog=f"{APPLICATION} batch",
+        description="Render and upload songs without opening the main window",
+    )
+    parser.add_argument(
+        "paths",
+        nargs="*",
+        help="album directories or audio files to process",
+    )
+    parser.add_argument(
+        "-m",
+        "--manifest",
+        action="append",
+        default=[],
+        help="JSON file listing paths to process, with optional per-entry settings",
+    )
+    parser.add_argument(
+        "-s",
+        "--set",
+        dest="settings",
+        action="append",
+        type=parse_setting,
+        default=[],
+        metavar="KEY=VALUE",
+        help="override a setting for every item, e.g. commandName='no background'",
+    )
+    parser.add_argument(
+        "-c",
+        "--config",
+        help="settings preset (.ini) whose values override the saved settings",
+    )
+    parser.add_argument(
+        "--song-mode",
+        action="store_true",
+        help="treat directories as loose songs instead of albums",
+    )
+    parser.add_argument(
+        "--no-upload", action="store_true", help="only render, never upload"
+    )
+    parser.add_argument("-u", "--username", help="user to upload videos as")
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="resume the last interrupted run instead of processing paths",
+    )
+    parser.add_argument(
+        "-r",
+        "--results",
+        default="-",
+        help="file to write JSON results to (default: stdout)",
+    )
+    parser.add_argument(
+        "--log-level",
+        choices=[level.value for level in SETTINGS_VALUES.LogLevel],
+        help="log level for messages written to stderr",
+    )
+    return parser
+
+
+def run_batch(argv):
+    """Entry point for `songs-to-youtube batch`. Returns the process exit code"""
+    args = get_parser().parse_args(argv)
+
+    app = QCoreApplication([sys.argv[0]])
+    app.setOrganizationName(ORGANIZATION)
+    app.setApplicationName(APPLICATION)
+
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(
+        logging.Formatter("[%(asctime)s] [%(levelname)s] %(message)s", "%H:%M:%S")
+    )
+    logger.addHandler(handler)
+    try:
+        logger.setLevel(convert_log_level(args.log_level or get_setting("logLevel")))
+    except Exception:
+        logger.setLevel(logging.INFO)
+
+    settings = {}
+    if args.config:
+        preset = QSettings(args.config, QSettings.IniFormat)
+        for key in preset.allKeys():
+            settings[key] = preset.value(key)
+    settings.update(dict(args.settings))
+
+    if args.resume:
+        items = JobJournal(run=BATCH_RUN).load_items()
+        if len(items) == 0:
+            logger.error("No interrupted run to resume")
+            return EXIT_USAGE
+    else:
+        inputs = [(path, None, {}) for path in args.paths]
+        try:
+            for manifest in args.manifest:
+                inputs.extend(load_manifest(manifest))
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"Could not load manifest: {e}")
+            return EXIT_USAGE
+        if len(inputs) == 0:
+            get_parser().print_usage(sys.stderr)
+            return EXIT_USAGE
+
+        items = collect_items(inputs, settings, args.song_mode)
+        if len(items) == 0:
+            logger.error("No audio files found")
+            return EXIT_USAGE
+
+    runner = BatchRunner(
+        items, not args.no_upload, args.username, args.results, args.resume
+    )
+    QTimer.singleShot(0, runner.start)
+    return app.exec()
@@ -0,0 +1,195 @@
+import atexit
+import hashlib
+import json
+import logging
+import os
+import posixpath
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+from PySide6.QtCore import QStandardPaths
+
+from songs_to_youtube.const import *
+
+logger = logging.getLogger(APPLICATION)
+
+# path -> (size, mtime, sha256 of file contents), least recently used first
+_digests = OrderedDict()
+_digests_lock = threading.Lock()
+# files whose digests are remembered
+MAX_DIGESTS = 4096
+
+# caches whose index is saved on exit
+_caches = weakref.WeakSet()
+
+
+def get_cache_dir(name: str):
+    """Returns the directory for the cache with the given name, creating it if needed"""
+    cache_path = QStandardPaths.writableLocation(QStandardPaths.CacheLocation)
+    cache_dir = posixpath.join(cache_path, name)
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def file_digest(path: str):
+    """Returns the sha256 hex digest of the file, remembering it
+    for as long as the file's size and modification time don't change"""
+    stat = os.stat(path)
+    with _digests_lock:
+        cached = _digests.get(path)
+        if cached is not None and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+            _digests.move_to_end(path)
+            return cached[2]
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            sha.update(chunk)
+    with _digests_lock:
+        _digests[path] = (stat.st_size, stat.st_mtime_ns, sha.hexdigest())
+        _digests.move_to_end(path)
+        while len(_digests) > MAX_DIGESTS:
+            _digests.popitem(last=False)
+    return sha.hexdigest()
+
+
+class DiskCache:
+    """Directory of files addressed by key. An index records the size and
+    last use time of each file so the least recently used files can be
+    evicted once the cache grows past max_size bytes. Using a file only
+    updates the index in memory, it is written when files are added or
+    evicted and when the cache is closed"""
+
+    INDEX_FILE = "index.json"
+    # locks shared by the keys whose hashes are equal modulo this
+    KEY_LOCKS = 64
+
+    def __init__(self, directory: str, max_size: int):
+        self.directory = directory
+        self.max_size = max_size
+        self.lock = threading.RLock()
+        # held while an entry is being created so the same entry is
+        # never created twice at once, see key_lock. create must not
+        # call get_or_create, another key may share the lock
+        self.key_locks = [threading.Lock() for _ in range(self.KEY_LOCKS)]
+        self.index = self._load_index()
+        # True if the index changed since it was saved
+        self.dirty = False
+        _caches.add(self)
+
+    def _index_path(self):
+        return posixpath.join(self.directory, self.INDEX_FILE)
+
+    def _load_index(self):
+        try:
+            with open(self._index_path(), "r") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        # forget entries whose files were deleted behind our back
+        return {
+            key: entry
+            for key, entry in index.items()
+            if os.path.exists(posixpath.join(self.directory, entry["file"]))
+        }
+
+    def _save_index(self):
+        temp_path = self._index_path() + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.index, f)
+        os.replace(temp_path, self._index_path())
+        self.dirty = False
+
+    def close(self):
+        """Saves the index if files were used since it was last saved"""
+        with self.lock:
+            if self.dirty:
+                try:
+                    self._save_index()
+                except OSError as e:
+                    logger.warning(
+                        f"Could not save the index of {self.directory}: {e}"
+                    )
+
+    def path_for(self, key: str, ext: str = ""):
+        return posixpath.join(self.directory, key + ext)
+
+    def get(self, key: str):
+        """Returns the path of the file stored under key, or None"""
+        with self.lock:
+            entry = self.index.get(key)
+            if entry is None:
+                return None
+            path = posixpath.join(self.directory, entry["file"])
+            if not os.path.exists(path):
+                del self.index[key]
+                self.dirty = True
+                return None
+            entry["last_used"] = time.time()
+            self.dirty = True
+            return path
+
+    def put(self, key: str, file_path: str, ext: str = ""):
+        """Moves file_path into the cache under key and returns its new path"""
+        path = self.path_for(key, ext)
+        os.replace(file_path, path)
+        return self.add(key, path)
+
+    def add(self, key: str, path: str):
+        """Records a file which is already in the cache directory under key"""
+        with self.lock:
+            self.index[key] = {
+                "file": posixpath.basename(path),
+                "size": os.path.getsize(path),
+                "last_used": time.time(),
+            }
+            self.evict(keep=key)
+            self._save_index()
+        return path
+
+    def key_lock(self, key: str):
+        return self.key_locks[hash(key) % len(self.key_locks)]
+
+    def get_or_create(self, key: str, ext: str, create):
+        """Returns the path of the file stored under key, calling
+        create(path) to write the file first if it is not cached"""
+        with self.key_lock(key):
+            if (path := self.get(key)) is not None:
+                return path
+            temp_path = self.path_for(key, ".part" + ext)
+            try:
+                create(temp_path)
+                return self.put(key, temp_path, ext)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+    def size(self):
+        return sum(entry["size"] for entry in self.index.values())
+
+    def evict(self, keep=None):
+        """Removes least recently used files (other than keep)
+        until the cache fits in max_size"""
+        with self.lock:
+            total = self.size()
+            by_last_use = sorted(self.index.items(), key=lambda e: e[1]["last_used"])
+            for key, entry in by_last_use:
+                if total <= self.max_size:
+                    break
+                if key == keep:
+                    continue
+                try:
+                    os.remove(posixpath.join(self.directory, entry["file"]))
+                except OSError:
+                    logger.warning(f"Could not remove cached file {entry['file']}")
+                    continue
+                logger.debug(f"Evicted {entry['file']} from {self.directory}")
+                total -= entry["size"]
+                del self.index[key]
+
+
+@atexit.register
+def close_caches():
+    for cache in list(_caches):
+        cache.close()
@@ -0,0 +1,162 @@
+import logging
+
+import psutil
+from PySide6.QtCore import *
+
+from songs_to_youtube.const import *
+
+logger = logging.getLogger(APPLICATION)
+
+
+def usable_cpu_count():
+    """Number of cores this process is allowed to run on"""
+    try:
+        return len(psutil.Process().cpu_affinity())
+    except (AttributeError, psutil.Error):
+        # cpu_affinity is not available on macOS
+        return psutil.cpu_count() or 1
+
+
+class ConcurrencyController(QObject):
+    """Picks how many renders run at once when maxProcesses is 0 (auto).
+    System load is sampled every few seconds: renders are added while the
+    CPU has headroom and there is work waiting, and removed when memory or
+    the disk is saturated or the CPU is oversubscribed"""
+
+    # new limit, reason for the change
+    limit_changed = Signal(int, str)
+
+    INTERVAL_MS = 3000
+
+    # samples to wait after a change before the next one,
+    # so the effect of the last change shows up first
+    SETTLE_SAMPLES = 2
+
+    CPU_HEADROOM = 75
+    MEMORY_HIGH = 90
+    MEMORY_HEADROOM = 80
+    DISK_BUSY_HIGH = 90
+    DISK_BUSY_HEADROOM = 70
+    # runnable processes per core before we call the CPU oversubscribed
+    OVERSUBSCRIBED_LOAD = 1.5
+
+    def __init__(self, has_waiting_work, *args):
+        super().__init__(*args)
+        # callable returning True if jobs are waiting for a free slot
+        self.has_waiting_work = has_waiting_work
+        self.cpu_count = usable_cpu_count()
+        self.max_limit = self.cpu_count
+        # start at one render per two cores and adjust from there
+        self.limit = max(1, self.cpu_count // 2)
+        self.settle = 0
+        self.last_disk = None
+        self.timer = QTimer(self)
+        self.timer.setInterval(self.INTERVAL_MS)
+        self.timer.timeout.connect(self.sample)
+
+    def start(self):
+        if self.timer.isActive():
+            return
+        # the first cpu_percent call only sets the starting point
+        psutil.cpu_percent(interval=None)
+        self.last_disk = self._disk_busy_ms()
+        logger.info(f"Running {self.limit} renders at once to start with (auto)")
+        self.timer.start()
+
+    def stop(self):
+        self.timer.stop()
+
+    @staticmethod
+    def _disk_busy_ms():
+        try:
+            counters = psutil.disk_io_counters()
+        except Exception:
+            return None
+        # busy_time is only reported on Linux and FreeBSD
+        return getattr(counters, "busy_time", None)
+
+    def _disk_busy_percent(self):
+        busy = self._disk_busy_ms()
+        last, self.last_disk = self.last_disk, busy
+        if busy is None or last is None:
+            return 0
+        return min(100, 100 * (busy - last) / self.INTERVAL_MS)
+
+    @staticmethod
+    def _load_per_core(cpu_count):
+        try:
+            return psutil.getloadavg()[0] / cpu_count
+        except (AttributeError, OSError):
+            return 0
+
+    def sample(self):
+        cpu = psutil.cpu_percent(interval=None)
+        memory = psutil.virtual_memory().percent
+        disk = self._disk_busy_percent()
+        load = self._load_per_core(self.cpu_count)
+        logger.debug(
+            f"Load: CPU {cpu:.0f}%, memory {memory:.0f}%, "
+            f"disk busy {disk:.0f}%, {load:.2f} runnable per core"
+        )
+        if self.settle > 0:
+            self.settle -= 1
+            return
+        if self.limit > 1 and memory >= self.MEMORY_HIGH:
+            self.set_limit(self.limit - 1, f"memory is {memory:.0f}% used")
+        elif self.limit > 1 and disk >= self.DISK_BUSY_HIGH:
+            self.set_limit(self.limit - 1, f"disk is {disk:.0f}% busy")
+        elif self.limit > 1 and load >= self.OVERSUBSCRIBED_LOAD:
+            self.set_limit(
+                self.limit - 1, f"CPU oversubscribed, {load:.2f} runnable per core"
+            )
+        elif (
+            self.limit < self.max_limit
+            and self.has_waiting_work()
+            and cpu < self.CPU_HEADROOM
+            and memory < self.MEMORY_HEADROOM
+            and disk < self.DISK_BUSY_HEADROOM
+        ):
+            self.set_limit(self.limit + 1, f"CPU is only {cpu:.0f}% used")
+
+    def set_limit(self, limit, reason):
+        self.limit = limit
+        self.settle = self.SETTLE_SAMPLES
+        logger.info(f"Running {limit} renders at once: {reason}")
+        self.limit_changed.emit(limit, reason)
+
+
+class CpuPartitioner:
+    """Gives each running render its own share of the cores. The share sets
+    the number of threads ffmpeg is told to use ({threads} in commands) and
+    the cores its processes may run on. On machines with enough cores one
+    is kept free of renders for the interface and uploads"""
+
+    # cores needed before one is reserved
+    RESERVE_FROM = 4
+
+    def __init__(self):
+        try:
+            cores = sorted(psutil.Process().cpu_affinity())
+        except (AttributeError, psutil.Error):
+            cores = list(range(psutil.cpu_count() or 1))
+        if len(cores) >= self.RESERVE_FROM:
+            cores = cores[1:]
+        self.cores = cores
+        # job name -> cores
+        self.assigned = {}
+
+    def acquire(self, name, max_running):
+        """Assigns cores to the job, splitting them evenly
+        between max_running jobs, and returns them"""
+        share = max(1, len(self.cores) // max(1, max_running))
+        usage = {core: 0 for core in self.cores}
+        for cores in self.assigned.values():
+            for core in cores:
+                usage[core] += 1
+        # least used cores first, neighbours together
+        cores = sorted(self.cores, key=lambda core: (usage[core], core))[:share]
+        self.assigned[name] = sorted(cores)
+        return self.assigned[name]
+
+    def release(self, name):
+        self.assigned.pop(name, None)
@@ -0,0 +1,181 @@
+import hashlib
+import logging
+import os
+import posixpath
+import threading
+import weakref
+
+from PySide6.QtCore import QDir, QSize, Qt
+from PySide6.QtGui import QImageReader
+
+from songs_to_youtube.cache import DiskCache, file_digest, get_cache_dir
+from songs_to_youtube.const import *
+from songs_to_youtube.metadata import read_tags
+from songs_to_youtube.metadata_cache import get_metadata_cache, picture_digest
+
+logger = logging.getLogger(APPLICATION)
+
+# Embedded cover art is only recorded by its digest while scanning and
+# written to the temp directory once per digest when something needs the
+# file, so songs which share a cover share one file, and the bytes are not
+# kept in memory in the meantime
+
+COVER_EXT = ".cover"
+
+# largest side of the cover art shown in the settings panel
+THUMBNAIL_SIZE = 512
+THUMBNAIL_CACHE_SIZE = 128 * 1024 * 1024
+
+# digest -> CoverSource of a song with that cover art embedded, to read
+# it from again if the metadata cache dropped it. An entry goes away
+# with the last song item which holds its CoverSource
+_sources = weakref.WeakValueDictionary()
+_lock = threading.Lock()
+
+_thumbnail_cache = None
+
+
+def get_cover_store_dir():
+    return posixpath.join(QDir().tempPath(), APPLICATION)
+
+
+def cover_art_path(digest):
+    """Returns where the embedded cover art with the given digest is
+    written to. The file may not exist yet, see ensure_cover_art"""
+    return posixpath.join(get_cover_store_dir(), digest + COVER_EXT)
+
+
+class CoverSource:
+    """A song with some cover art embedded"""
+
+    __slots__ = ("song_path", "__weakref__")
+
+    def __init__(self, song_path):
+        self.song_path = song_path
+
+
+def add_cover_source(digest, song_path):
+    """Remembers that the song has the cover art with the given digest
+    embedded. Returns the CoverSource to keep while the cover art is needed"""
+    with _lock:
+        if (source := _sources.get(digest)) is None:
+            source = _sources[digest] = CoverSource(song_path)
+        return source
+
+
+def _store_digest(path):
+    directory, file = posixpath.split(path)
+    name, ext = os.path.splitext(file)
+    if ext != COVER_EXT or directory != get_cover_store_dir():
+        return None
+    return name
+
+
+def _read_cover(digest):
+    cover = get_metadata_cache().get_cover(digest)
+    if cover is not None:
+        return cover
+    with _lock:
+        source = _sources.get(digest)
+    if source is None:
+        return None
+    song_path = source.song_path
+    # dropped from the metadata cache, read it from the song again
+    _, pictures = read_tags(song_path)
+    if len(pictures) == 0 or picture_digest(pictures[0]) != digest:
+        logger.warning(f"The cover art of {song_path} changed")
+        return None
+    return pictures[0]
+
+
+def ensure_cover_art(path):
+    """Writes embedded cover art to path if it is in the cover store and
+    was not written yet. Returns path if the file exists, otherwise None"""
+    if not path or os.path.exists(path):
+        return path or None
+    if (digest := _store_digest(path)) is None:
+        return None
+    try:
+        if (cover := _read_cover(digest)) is None:
+            logger.warning(f"Could not find the cover art for {path}")
+            return None
+        os.makedirs(posixpath.dirname(path), exist_ok=True)
+        # write under a name of our own first, another thread
+        # may be writing the same cover at the same time
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}"
+        with open(temp_path, "wb") as f:
+            f.write(cover)
+        os.replace(temp_path, path)
+        return path
+    except Exception as e:
+        logger.warning(f"Could not extract cover art to {path}: {e}")
+        return None
+
+
+def scaled_cover_size(path, size: QSize, mode: Qt.AspectRatioMode):
+    """Returns the size the image at path would be scaled down to so it fits
+    size with the given aspect ratio mode, or None if it is not larger than
+    that. Only the image's header is read"""
+    original = QImageReader(path).size()
+    if not original.isValid():
+        return None
+    scaled = original.scaled(size, mode)
+    if scaled.width() >= original.width() or scaled.height() >= original.height():
+        return None
+    return scaled
+
+
+def scale_cover(path, output_path, size: QSize):
+    """Decodes the image at path at the given size and saves it to output_path"""
+    reader = QImageReader(path)
+    # lets formats such as JPEG decode at a lower resolution
+    reader.setScaledSize(size)
+    image = reader.read()
+    if image.isNull():
+        raise ValueError(f"Could not read image {path}: {reader.errorString()}")
+    if not image.save(output_path, "PNG"):
+        raise OSError(f"Could not save image {output_path}")
+
+
+def get_scaled_cover(path, size: QSize, mode: Qt.AspectRatioMode, cache: DiskCache):
+    """Returns the path of a copy of the image scaled down to fit size, made
+    once per image contents and size, or path if it is not larger than that"""
+    if not os.path.isfile(path):
+        return path
+    if (scaled := scaled_cover_size(path, size, mode)) is None:
+        return path
+    key_source = "\0".join(
+        (file_digest(path), str(scaled.width()), str(scaled.height()))
+    )
+    key = hashlib.sha256(key_source.encode("utf-8")).hexdigest()
+
+    def create(output_path):
+        logger.debug(f"Scaling {path} to {scaled.width()}x{scaled.height()}")
+        scale_cover(path, output_path, scaled)
+
+    return cache.get_or_create(key, ".png", create)
+
+
+def get_thumbnail_cache():
+    global _thumbnail_cache
+    with _lock:
+        if _thumbnail_cache is None:
+            _thumbnail_cache = DiskCache(
+                get_cache_dir("thumbnails"), THUMBNAIL_CACHE_SIZE
+            )
+        return _thumbnail_cache
+
+
+def get_cover_thumbnail(path):
+    """Returns the path of a small copy of the cover art to show in the
+    settings panel, or path if it is small already or could not be read"""
+    try:
+        return get_scaled_cover(
+            path,
+            QSize(THUMBNAIL_SIZE, THUMBNAIL_SIZE),
+            Qt.KeepAspectRatio,
+            get_thumbnail_cache(),
+        )
+    except Exception as e:
+        logger.warning(f"Could not make a thumbnail of {path}: {e}")
+        return path
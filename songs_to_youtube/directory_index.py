@@ -0,0 +1,58 @@
+import logging
+import os
+import posixpath
+import threading
+
+from songs_to_youtube.const import *
+
+logger = logging.getLogger(APPLICATION)
+
+COVER_EXTS = {".jpg", ".jpeg", ".bmp", ".gif", ".png"}
+COVER_NAMES = ("cover", "folder", "front")
+
+# directory -> (modification time, DirectoryIndex)
+_indexes = {}
+_lock = threading.Lock()
+
+
+class DirectoryIndex:
+    """The images in a directory, read with one os.scandir so every song
+    in the directory can look up its cover file without listing it again"""
+
+    def __init__(self, dir_path):
+        self.dir_path = dir_path
+        # lower case name without extension -> (position in
+        # the listing, path) of the first image with that name
+        self.images = {}
+        with os.scandir(dir_path) as entries:
+            for i, entry in enumerate(entries):
+                name, ext = os.path.splitext(entry.name)
+                if ext.lower() not in COVER_EXTS or not entry.is_file():
+                    continue
+                self.images.setdefault(
+                    name.lower(), (i, posixpath.join(dir_path, entry.name))
+                )
+
+    def find_cover_file(self, song_file):
+        """Returns the path of the cover image for the song, an image named
+        cover, folder, front or the same as the song, or None"""
+        names = (*COVER_NAMES, os.path.splitext(song_file)[0].lower())
+        found = [self.images[name] for name in names if name in self.images]
+        if len(found) == 0:
+            return None
+        # the first one listed, as the directory was searched in order before
+        return min(found)[1]
+
+
+def get_directory_index(dir_path):
+    """Returns the DirectoryIndex of the directory, which is only read
+    again once the directory's modification time changes"""
+    mtime = os.stat(dir_path).st_mtime_ns
+    with _lock:
+        cached = _indexes.get(dir_path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    index = DirectoryIndex(dir_path)
+    with _lock:
+        _indexes[dir_path] = (mtime, index)
+    return index
@@ -36,6 +36,7 @@ class SETTINGS_VALUES:
     class AlbumPlaylist(str, Enum):
         MULTIPLE = "Multiple videos"
         SINGLE = "Single video"
+        SINGLE_PASS = "Single video (single pass)"
 
     class VideoVisibility(str, Enum):
         PUBLIC = "PUBLIC"
@@ -123,6 +124,7 @@ class InputField:
         "videoVisibilityAlbum",
         "notifySubsAlbum",
         "concatCommandName",
+        "albumCommandName",
     }
 
     # methods for various QWidgets
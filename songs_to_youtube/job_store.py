@@ -0,0 +1,198 @@
+import sys
+import threading
+from collections.abc import Mapping, MutableMapping
+
+# The values of the items in the queue are kept column by column instead of
+# in a dict per item. Every key is one list shared by all rows, so a value
+# costs one slot, and strings are interned so the many values which are the
+# same for every song (settings, tag values such as the artist) are stored
+# once. A row's keys are kept in a Shape shared by every row which was given
+# the same keys in the same order, so rows still iterate in insertion order
+
+# marks a row which does not have a value for a column
+MISSING = object()
+
+_stores = {}
+_lock = threading.Lock()
+
+
+class Shape:
+    """The keys of a row, in the order they were added"""
+
+    __slots__ = ("keys", "_next")
+
+    def __init__(self, keys=()):
+        self.keys = keys
+        # key -> shape of a row with this shape which is given the key
+        self._next = {}
+
+    def add(self, key):
+        shape = self._next.get(key)
+        if shape is None:
+            shape = self._next[key] = Shape((*self.keys, key))
+        return shape
+
+
+class ColumnStore:
+    """Rows of values stored as one list per key"""
+
+    def __init__(self):
+        # key -> list of values, MISSING for rows without the key
+        self.columns = {}
+        # row -> Shape, None for rows which are free
+        self.shapes = []
+        # rows which were removed and can be reused
+        self.free = []
+        self.empty = Shape()
+        # held while rows or columns are added or removed, items are also
+        # changed from the upload thread. Reentrant as rows are freed when
+        # the garbage collector runs, which can happen while it is held
+        self.lock = threading.RLock()
+
+    def add_row(self):
+        with self.lock:
+            if self.free:
+                row = self.free.pop()
+                self.shapes[row] = self.empty
+            else:
+                row = len(self.shapes)
+                self.shapes.append(self.empty)
+            return row
+
+    def remove_row(self, row):
+        with self.lock:
+            for key in self.shapes[row].keys:
+                self.columns[key][row] = MISSING
+            self.shapes[row] = None
+            self.free.append(row)
+
+    def keys(self, row):
+        return self.shapes[row].keys
+
+    def get(self, row, key, default=None):
+        column = self.columns.get(key)
+        if column is None or row >= len(column):
+            return default
+        value = column[row]
+        return default if value is MISSING else value
+
+    def set(self, row, key, value):
+        if type(value) is str:
+            value = sys.intern(value)
+        column = self.columns.get(key)
+        if column is not None and row < len(column) and column[row] is not MISSING:
+            column[row] = value
+            return
+        with self.lock:
+            column = self.columns.setdefault(key, [])
+            if row >= len(column):
+                column.extend([MISSING] * (len(self.shapes) - len(column)))
+            column[row] = value
+            self.shapes[row] = self.shapes[row].add(key)
+
+    def delete(self, row, key):
+        with self.lock:
+            keys = self.shapes[row].keys
+            if key not in keys:
+                raise KeyError(key)
+            self.columns[key][row] = MISSING
+            shape = self.empty
+            for other in keys:
+                if other != key:
+                    shape = shape.add(other)
+            self.shapes[row] = shape
+
+    def __len__(self):
+        return len(self.shapes) - len(self.free)
+
+
+class StoreRow(MutableMapping):
+    """A row of a ColumnStore used like a dict. The row is freed once
+    the StoreRow is garbage collected"""
+
+    __slots__ = ("store", "row")
+
+    def __init__(self, store: ColumnStore, values=()):
+        self.store = store
+        self.row = store.add_row()
+        for key, value in dict(values).items():
+            store.set(self.row, key, value)
+
+    def __del__(self):
+        try:
+            self.store.remove_row(self.row)
+        except Exception:
+            # the store may be gone already when the interpreter exits
+            pass
+
+    def __getitem__(self, key):
+        value = self.store.get(self.row, key, MISSING)
+        if value is MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.store.get(self.row, key, MISSING) is not MISSING
+
+    def get(self, key, default=None):
+        return self.store.get(self.row, key, default)
+
+    def __setitem__(self, key, value):
+        self.store.set(self.row, key, value)
+
+    def __delitem__(self, key):
+        self.store.delete(self.row, key)
+
+    def __iter__(self):
+        return iter(self.store.keys(self.row))
+
+    def __len__(self):
+        return len(self.store.keys(self.row))
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class MergedValues(Mapping):
+    """The fields of an item and its metadata tags as one mapping, tags win
+    if a field has the same name. A view, so it always has the latest values"""
+
+    __slots__ = ("fields", "tags")
+
+    def __init__(self, fields: Mapping, tags: Mapping = None):
+        self.fields = fields
+        self.tags = tags
+
+    def __getitem__(self, key):
+        if self.tags is not None:
+            value = self.tags.get(key, MISSING)
+            if value is not MISSING:
+                return value
+        return self.fields[key]
+
+    def __contains__(self, key):
+        return key in self.fields or (self.tags is not None and key in self.tags)
+
+    def __iter__(self):
+        yield from self.fields
+        if self.tags is not None:
+            for key in self.tags:
+                if key not in self.fields:
+                    yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def to_dict(self):
+        if self.tags is None:
+            return dict(self.fields)
+        return {**self.fields, **self.tags}
+
+
+def get_store(name):
+    """Returns the ColumnStore with the given name, e.g. "song fields",
+    creating it the first time"""
+    with _lock:
+        if name not in _stores:
+            _stores[name] = ColumnStore()
+        return _stores[name]
@@ -0,0 +1,254 @@
+import json
+import logging
+import os
+import posixpath
+import sqlite3
+import threading
+
+from PySide6.QtCore import QFileInfo, QStandardPaths
+
+from songs_to_youtube.const import *
+from songs_to_youtube.cover_art import ensure_cover_art
+from songs_to_youtube.field import SETTINGS_VALUES, InputField
+from songs_to_youtube.song_tree_widget_item import *
+
+logger = logging.getLogger(APPLICATION)
+
+
+# runs which are journaled separately, so starting a batch
+# run does not clear an interrupted run of the main window
+GUI_RUN = "gui"
+BATCH_RUN = "batch"
+
+
+def get_journal_path():
+    appdata_path = QStandardPaths.writableLocation(QStandardPaths.AppDataLocation)
+    os.makedirs(appdata_path, exist_ok=True)
+    return posixpath.join(appdata_path, "journal.sqlite3")
+
+
+class JobJournal:
+    """Records the queue of a run and the render and upload status of each
+    output in an SQLite database, committing after every change, so a run
+    interrupted by a crash can be rebuilt and resumed where it stopped.
+    The queue is cleared once a run finishes. Each kind of run (GUI_RUN,
+    BATCH_RUN) has its own queue, so one does not clear the other's. The
+    journal also keeps the resumable upload URL and confirmed offset of
+    every unfinished upload"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS items (
+            run TEXT NOT NULL,
+            output TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            parent TEXT,
+            item_type INTEGER NOT NULL,
+            path TEXT NOT NULL,
+            fields TEXT NOT NULL,
+            upload INTEGER NOT NULL DEFAULT 0,
+            rendered INTEGER NOT NULL DEFAULT 0,
+            uploaded INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (run, output)
+        );
+        CREATE TABLE IF NOT EXISTS uploads (
+            file TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            upload_url TEXT NOT NULL,
+            front_end_upload_id TEXT,
+            offset INTEGER NOT NULL DEFAULT 0
+        )
+    """
+
+    def __init__(self, path=None, run=GUI_RUN):
+        self.path = path or get_journal_path()
+        self.run = run
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        with self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self._add_run_column()
+            self.connection.executescript(self.SCHEMA)
+
+    def _add_run_column(self):
+        """Journals written before runs were kept apart only had GUI runs"""
+        columns = [
+            row["name"] for row in self.connection.execute("PRAGMA table_info(items)")
+        ]
+        if len(columns) == 0 or "run" in columns:
+            return
+        self.connection.execute("ALTER TABLE items RENAME TO old_items")
+        self.connection.executescript(self.SCHEMA)
+        self.connection.execute(
+            f"""
+            INSERT INTO items (run, {", ".join(columns)})
+            SELECT ?, {", ".join(columns)} FROM old_items
+            """,
+            (GUI_RUN,),
+        )
+        self.connection.execute("DROP TABLE old_items")
+
+    def _execute(self, query, parameters=()):
+        with self.lock, self.connection:
+            return self.connection.execute(query, parameters).fetchall()
+
+    def clear(self):
+        """Forgets the queue. Unfinished uploads are kept so they can still
+        be resumed if the same file is uploaded again"""
+        self._execute("DELETE FROM items WHERE run=?", (self.run,))
+
+    def has_unfinished(self):
+        """True if a run was interrupted before all of its jobs were done"""
+        rows = self._execute(
+            "SELECT output FROM items WHERE run=? LIMIT 1", (self.run,)
+        )
+        return len(rows) > 0
+
+    def record_item(self, item, upload=True, parent=None):
+        """Records the item (and an album's songs) so it can be rebuilt later.
+        The item's output paths must be set, i.e. before_render was called.
+        Statuses of outputs which are already recorded are kept"""
+        fields = (
+            InputField.SONG_FIELDS
+            if item.item_type() == TreeWidgetType.SONG
+            else InputField.ALBUM_FIELDS
+        )
+        data = item.data(CustomDataRole.ITEMDATA)
+        path = data.get_value(
+            "song_path" if item.item_type() == TreeWidgetType.SONG else "album_dir"
+        )
+        will_upload = (
+            upload and item.get("uploadYouTube") == SETTINGS_VALUES.CheckBox.CHECKED
+        )
+        self._execute(
+            """
+            INSERT INTO items
+            (run, output, position, parent, item_type, path, fields, upload)
+            VALUES (?, ?, (SELECT COUNT(*) FROM items WHERE run=?), ?, ?, ?, ?, ?)
+            ON CONFLICT(run, output) DO UPDATE SET
+                parent=excluded.parent, fields=excluded.fields, upload=excluded.upload
+            """,
+            (
+                self.run,
+                item.get("fileOutput"),
+                self.run,
+                parent,
+                int(item.item_type()),
+                path,
+                json.dumps({field: data.get_value(field) for field in fields}),
+                int(will_upload),
+            ),
+        )
+        if item.item_type() == TreeWidgetType.ALBUM:
+            for song in item.getChildren():
+                self.record_item(song, upload, item.get("fileOutput"))
+
+    def set_rendered(self, output, success):
+        self._execute(
+            "UPDATE items SET rendered=? WHERE run=? AND output=?",
+            (int(success), self.run, output),
+        )
+
+    def set_uploaded(self, output, success):
+        self._execute(
+            "UPDATE items SET uploaded=? WHERE run=? AND output=?",
+            (int(success), self.run, output),
+        )
+
+    def is_rendered(self, output):
+        """True if output was rendered by the interrupted run and still exists"""
+        rows = self._execute(
+            "SELECT rendered FROM items WHERE run=? AND output=?", (self.run, output)
+        )
+        return len(rows) > 0 and rows[0]["rendered"] and os.path.exists(output)
+
+    def get_upload(self, file):
+        """Returns the (upload_url, front_end_upload_id, offset) of an unfinished
+        upload of the file, or None if there is none or the file changed"""
+        stat = os.stat(file)
+        rows = self._execute(
+            "SELECT * FROM uploads WHERE file=? AND size=? AND mtime_ns=?",
+            (file, stat.st_size, stat.st_mtime_ns),
+        )
+        if len(rows) == 0:
+            return None
+        return rows[0]["upload_url"], rows[0]["front_end_upload_id"], rows[0]["offset"]
+
+    def save_upload(self, file, upload_url, front_end_upload_id=None, offset=0):
+        stat = os.stat(file)
+        self._execute(
+            """
+            INSERT OR REPLACE INTO uploads
+            (file, size, mtime_ns, upload_url, front_end_upload_id, offset)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (
+                file,
+                stat.st_size,
+                stat.st_mtime_ns,
+                upload_url,
+                front_end_upload_id,
+                offset,
+            ),
+        )
+
+    def set_upload_offset(self, file, offset):
+        self._execute("UPDATE uploads SET offset=? WHERE file=?", (offset, file))
+
+    def forget_upload(self, file):
+        self._execute("DELETE FROM uploads WHERE file=?", (file,))
+
+    @staticmethod
+    def _is_done(row):
+        return row["uploaded"] or (row["rendered"] and not row["upload"])
+
+    def load_items(self):
+        """Rebuilds the tree items whose jobs are not done yet"""
+        rows = self._execute(
+            "SELECT * FROM items WHERE run=? ORDER BY position", (self.run,)
+        )
+        children = {}
+        for row in rows:
+            if row["parent"] is not None:
+                children.setdefault(row["parent"], []).append(row)
+        items = []
+        for row in rows:
+            if row["parent"] is not None or self._is_done(row):
+                continue
+            try:
+                if row["item_type"] == TreeWidgetType.SONG:
+                    items.append(self._create_song_item(row))
+                    continue
+                song_rows = children.get(row["output"], [])
+                album_fields = json.loads(row["fields"])
+                if album_fields["albumPlaylist"] == SETTINGS_VALUES.AlbumPlaylist.MULTIPLE:
+                    # songs which were already uploaded are left out
+                    song_rows = [r for r in song_rows if not self._is_done(r)]
+                if len(song_rows) == 0:
+                    continue
+                songs = [self._create_song_item(r) for r in song_rows]
+                album = AlbumTreeWidgetItem(row["path"], songs)
+                album.setText(row["path"])
+                self._apply_fields(album, album_fields)
+                items.append(album)
+            except Exception as e:
+                logger.error(f"Could not restore {row['path']}: {e}")
+        return items
+
+    def _create_song_item(self, row):
+        item = SongTreeWidgetItem(row["path"])
+        item.setText(QFileInfo(row["path"]).fileName())
+        self._apply_fields(item, json.loads(row["fields"]))
+        return item
+
+    @staticmethod
+    def _apply_fields(item, fields):
+        for field, value in fields.items():
+            if field == "coverArt" and ensure_cover_art(value) is None:
+                # extracted cover art is deleted on exit and can only be
+                # extracted again if it is still embedded in one of the
+                # songs, otherwise keep the cover art found for the item
+                continue
+            item.set(field, value)
+        item.data(CustomDataRole.ITEMDATA).update_fields()
@@ -0,0 +1,228 @@
+import logging
+import multiprocessing
+import os
+import posixpath
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from queue import Empty, Queue
+
+from PySide6.QtCore import *
+
+from songs_to_youtube.concurrency import usable_cpu_count
+from songs_to_youtube.const import *
+from songs_to_youtube.song_tree_widget_item import SongInfo
+from songs_to_youtube.utils import *
+
+logger = logging.getLogger(APPLICATION)
+
+
+def init_worker():
+    # so the worker processes find the same cache
+    # and data directories as the application
+    QCoreApplication.setOrganizationName(ORGANIZATION)
+    QCoreApplication.setApplicationName(APPLICATION)
+
+
+def load_song_info(path):
+    """Returns the SongInfo of the file, or None if it is not audio.
+    Runs in the scanner's worker processes"""
+    try:
+        if not file_is_audio(path):
+            return None
+        return SongInfo(path)
+    except Exception as e:
+        # the exception may not be picklable, and one
+        # bad file should not stop the rest of the scan
+        return f"Could not load {path}: {e.__class__.__name__}: {e}"
+
+
+class ScanGroup:
+    """Files which end up as one album, or as top level songs if dir_path is None"""
+
+    def __init__(self, dir_path, files):
+        self.dir_path = dir_path
+        self.files = files
+
+
+class LibraryScanner(QObject):
+    """Finds the songs in the given albums, directories and files and loads
+    their metadata and cover art on a pool of worker processes, one per
+    core, so adding a large library neither freezes the window nor is
+    limited to one core. Loaded songs are handed back in the order they
+    were found, a batch at a time, for the GUI thread to create items from.
+    A few songs are loaded on the scanner's own thread, starting processes
+    for them would take longer than loading them"""
+
+    # ScanGroups with the SongInfo of each of their files, in order
+    loaded = Signal(list)
+
+    # songs loaded, songs found so far
+    progress = Signal(int, int)
+
+    finished = Signal()
+
+    # fewer songs than this are loaded without starting worker processes
+    PARALLEL_FROM = 16
+    CHUNK_SIZE = 8
+    # how often loaded songs are handed to the GUI thread,
+    # and about how many at a time so it stays responsive
+    INTERVAL_MS = 100
+    BATCH_SIZE = 100
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.cancelled = False
+        self.found = 0
+        self.done = 0
+        # (ScanGroup, [(path, SongInfo)]), None once the scan is over
+        self.results = Queue()
+        # (level, message), logged on the GUI thread
+        self.messages = Queue()
+        self.finished_loading = False
+        self.executor = None
+        self.thread = None
+        self.timer = QTimer(self)
+        self.timer.setInterval(self.INTERVAL_MS)
+        self.timer.timeout.connect(self.deliver)
+
+    def scan(self, albums=(), directories=(), files=()):
+        """Scans albums (a directory and each subdirectory becomes an album),
+        directories (every song in them and their subdirectories is added on
+        its own) and files in the background"""
+        requests = (list(albums), list(directories), list(files))
+        self.thread = threading.Thread(target=self.run, args=requests, daemon=True)
+        self.thread.start()
+        self.timer.start()
+
+    def cancel(self):
+        self.cancelled = True
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def run(self, albums, directories, files):
+        try:
+            groups = []
+            for dir_path in albums:
+                self.find_albums(dir_path, groups)
+            for dir_path in directories:
+                groups.append(ScanGroup(None, self.find_songs(dir_path)))
+            files = [self.short_path(path) for path in files]
+            self.found += len(files)
+            groups.append(ScanGroup(None, files))
+            self.load(groups)
+        except Exception as e:
+            if not self.cancelled:
+                self.log(logging.ERROR, f"Error while adding songs: {e}")
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False, cancel_futures=True)
+            self.results.put(None)
+
+    def log(self, level, message):
+        self.messages.put((level, message))
+
+    @staticmethod
+    def short_path(path):
+        if os.name == "nt" and len(path) > 255:
+            return get_short_path_name(path)
+        return path
+
+    def entries(self, dir_path):
+        try:
+            with os.scandir(dir_path) as entries:
+                return sorted(entries, key=lambda entry: entry.name)
+        except OSError as e:
+            self.log(logging.WARNING, f"Could not read directory {dir_path}: {e}")
+            return []
+
+    def find_albums(self, dir_path, groups):
+        """Adds a group for the directory and each subdirectory, subdirectories first"""
+        files = []
+        for entry in self.entries(dir_path):
+            if self.cancelled:
+                return
+            path = self.short_path(posixpath.join(dir_path, entry.name))
+            if not os.access(path, os.R_OK):
+                self.log(logging.WARNING, "File {} is not readable".format(path))
+            elif entry.is_dir():
+                self.find_albums(path, groups)
+            else:
+                files.append(path)
+        self.found += len(files)
+        groups.append(ScanGroup(dir_path, files))
+
+    def find_songs(self, dir_path):
+        files = []
+        for root, dirs, names in os.walk(dir_path, followlinks=True):
+            if self.cancelled:
+                break
+            dirs.sort()
+            root = QDir.fromNativeSeparators(root)
+            files.extend(self.short_path(posixpath.join(root, name)) for name in sorted(names))
+        self.found += len(files)
+        return files
+
+    def load(self, groups):
+        paths = [path for group in groups for path in group.files]
+        if len(paths) < self.PARALLEL_FROM:
+            self.load_here(groups)
+            return
+        workers = max(1, min(usable_cpu_count(), len(paths) // self.CHUNK_SIZE))
+        # spawn rather than fork, forking a process which runs Qt is not safe
+        self.executor = ProcessPoolExecutor(
+            workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+        )
+        infos = self.executor.map(load_song_info, paths, chunksize=self.CHUNK_SIZE)
+        for group in groups:
+            songs = []
+            for path in group.files:
+                if self.cancelled:
+                    return
+                info = next(infos)
+                self.done += 1
+                if isinstance(info, str):
+                    self.log(logging.WARNING, info)
+                elif info is not None:
+                    songs.append((path, info))
+            self.results.put((group, songs))
+
+    def load_here(self, groups):
+        for group in groups:
+            songs = []
+            for path in group.files:
+                if self.cancelled:
+                    return
+                info = load_song_info(path)
+                self.done += 1
+                if isinstance(info, str):
+                    self.log(logging.WARNING, info)
+                elif info is not None:
+                    songs.append((path, info))
+            self.results.put((group, songs))
+
+    def deliver(self):
+        """Hands the next batch of loaded songs to the GUI thread"""
+        batch = []
+        size = 0
+        while size < self.BATCH_SIZE and not self.finished_loading:
+            try:
+                result = self.results.get_nowait()
+            except Empty:
+                break
+            if result is None:
+                self.finished_loading = True
+                break
+            group, songs = result
+            if len(songs) > 0:
+                batch.append((group, songs))
+            size += len(songs)
+        while not self.messages.empty():
+            logger.log(*self.messages.get_nowait())
+        if len(batch) > 0 and not self.cancelled:
+            self.loaded.emit(batch)
+        self.progress.emit(self.done, self.found)
+        if self.finished_loading and (self.cancelled or self.results.empty()):
+            self.timer.stop()
+            self.finished.emit()
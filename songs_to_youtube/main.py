@@ -1,6 +1,7 @@
 import atexit
 import glob
 import logging
+import multiprocessing
 import os
 import posixpath
 import shutil
@@ -10,8 +11,10 @@ from PySide6.QtGui import QIcon
 from PySide6.QtUiTools import QUiLoader
 from PySide6.QtWidgets import *
 
+from songs_to_youtube.batch import run_batch
 from songs_to_youtube.const import *
 from songs_to_youtube.field import *
+from songs_to_youtube.journal import JobJournal
 from songs_to_youtube.log import *
 from songs_to_youtube.progress_window import ProgressWindow
 from songs_to_youtube.settings import *
@@ -33,8 +36,7 @@ class MainWindow(QMainWindow):
         self.ui.cancelButton.setVisible(False)
         self.connect_actions()
         self.setAcceptDrops(True)
-        self.renderer = None
-        self.uploader = None
+        self.pipeline = None
         self.cancelled = False
 
     def load_albums(self):
@@ -51,9 +53,7 @@ class MainWindow(QMainWindow):
             f_tree_view.setSelectionMode(QAbstractItemView.ExtendedSelection)
 
         if file_dialog.exec() == QDialog.Accepted:
-            paths = file_dialog.selectedFiles()
-            for album in paths:
-                self.ui.treeWidget.addAlbum(album)
+            self.ui.treeWidget.addAlbums(file_dialog.selectedFiles())
 
     def on_upload_finished(self, results):
         self.ui.treeWidget.setEnabled(True)
@@ -74,7 +74,6 @@ class MainWindow(QMainWindow):
                     sum(int(s) for s in results.values()), len(results)
                 )
             )
-            self.uploader = None
             if get_setting("deleteAfterUploading") == SETTINGS_VALUES.CheckBox.CHECKED:
                 for path, success in results.items():
                     if success:
@@ -87,7 +86,6 @@ class MainWindow(QMainWindow):
     def on_render_finished(self, results):
         if self.cancelled:
             logger.error("Render cancelled")
-            self.on_upload_finished(results)
         else:
             logger.success(
                 "{}/{} renders successful".format(
@@ -98,36 +96,34 @@ class MainWindow(QMainWindow):
             self.ui.treeWidget.remove_by_file_paths(
                 {path for path in results if results[path]}, False
             )
-            # upload to youtube;
-            self.uploader = self.ui.treeWidget.get_uploader(results)
-            self.uploader.finished.connect(self.on_upload_finished)
-            self.ui.progressWindow.on_upload_start(self.uploader)
-            self.uploader.upload()
-        self.renderer = None
-
-    def render(self):
+
+    def on_pipeline_finished(self, render_results, upload_results):
+        if self.cancelled:
+            self.on_upload_finished({**render_results, **upload_results})
+        else:
+            self.on_upload_finished(upload_results)
+        self.pipeline = None
+
+    def render(self, resume=False):
         self.ui.treeWidget.setEnabled(False)
         self.ui.cancelButton.setVisible(True)
         self.ui.renderButton.setVisible(False)
-        self.renderer = self.ui.treeWidget.get_renderer()
-        self.renderer.finished.connect(self.on_render_finished)
-        self.ui.progressWindow.on_render_start(self.renderer)
-        self.renderer.render()
+        # videos are uploaded while the rest are still rendering
+        self.pipeline = self.ui.treeWidget.get_pipeline(resume)
+        self.pipeline.render_finished.connect(self.on_render_finished)
+        self.pipeline.finished.connect(self.on_pipeline_finished)
+        self.ui.progressWindow.on_render_start(self.pipeline.renderer)
+        self.ui.progressWindow.on_upload_start(self.pipeline.uploader)
+        self.pipeline.start()
 
     def cancel(self):
         self.cancelled = True
-        if self.renderer:
-            self.renderer.cancel()
-            self.ui.treeWidget.setEnabled(True)
-            self.ui.cancelButton.setVisible(False)
-            self.ui.renderButton.setVisible(True)
-        if self.uploader:
-            self.uploader.cancel()
+        if self.pipeline:
+            self.pipeline.cancel()
 
     def load_songs(self):
         file_names = QFileDialog.getOpenFileNames(self, "Import Songs")[0]
-        for file in file_names:
-            self.ui.treeWidget.addSong(file)
+        self.ui.treeWidget.addSongs(file_names)
 
     def open_settings(self):
         window = SettingsWindow(self)
@@ -152,6 +148,25 @@ class MainWindow(QMainWindow):
             if msg_box == QMessageBox.Ok:
                 self.msg_box = AddUserWindow()
                 self.msg_box.show()
+        self.resume_interrupted_run()
+
+    def resume_interrupted_run(self):
+        journal = JobJournal()
+        if not journal.has_unfinished():
+            return
+        answer = QMessageBox.question(
+            self,
+            "Resume",
+            "The last render was interrupted before it finished. Resume it?",
+            QMessageBox.Yes | QMessageBox.No,
+        )
+        items = journal.load_items() if answer == QMessageBox.Yes else []
+        if len(items) == 0:
+            journal.clear()
+            return
+        for item in items:
+            self.ui.treeWidget.addTopLevelItem(item)
+        self.render(resume=True)
 
     def connect_actions(self):
         self.ui.actionAbout.triggered.connect(self.about)
@@ -161,11 +176,11 @@ class MainWindow(QMainWindow):
         self.ui.treeWidget.selectionModel().selectionChanged.connect(
             self.ui.songSettingsWindow.song_tree_selection_changed
         )
-        self.ui.renderButton.clicked.connect(self.render)
+        self.ui.renderButton.clicked.connect(lambda: self.render())
         self.ui.cancelButton.clicked.connect(self.cancel)
 
 
-def main():
+def init_environment():
     # no idea why this is necessary but it is... otherwise
     # future calls to QUiLoader completely freeze the app
     _ = QUiLoader()
@@ -183,6 +198,15 @@ def main():
             os.remove(file)
 
     atexit.register(clean_up)
+
+
+def main():
+    # the library scanner's worker processes start from this executable when frozen
+    multiprocessing.freeze_support()
+    init_environment()
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        # headless mode, no QApplication or widgets
+        sys.exit(run_batch(sys.argv[2:]))
     app = QApplication([])
     app.setWindowIcon(QIcon(APPLICATION_IMAGES[":/image/icon.ico"]))
     app.setOrganizationName(ORGANIZATION)
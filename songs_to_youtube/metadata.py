@@ -1,12 +1,17 @@
 import logging
-import posixpath
+from fnmatch import fnmatchcase
 
 import mutagen
 from mutagen.easyid3 import EasyID3
-from mutagen.easymp4 import EasyMP4
+from mutagen.easymp4 import EasyMP4, EasyMP4Tags
+from mutagen.id3 import ID3
+from mutagen.mp3 import MP3
+from mutagen.mp4 import MP4Tags
+from mutagen.trueaudio import TrueAudio
 from PySide6.QtCore import *
 
 from songs_to_youtube.const import *
+from songs_to_youtube.metadata_cache import get_metadata_cache, picture_digest
 from songs_to_youtube.utils import *
 
 # can expand these if wanted
@@ -15,73 +20,123 @@ EasyMP4.RegisterTextKey("url", "purl")
 logger = logging.getLogger(APPLICATION)
 
 
+def easy_items(tags):
+    """Returns the items the easy interface (EasyID3 or EasyMP4Tags) gives for
+    ID3 or MP4 tags which were already parsed. Calls the getters the easy
+    interface registers on the tags themselves, the way its keys() and
+    __getitem__ do, so the file is not parsed again"""
+    easy = EasyID3 if isinstance(tags, ID3) else EasyMP4Tags
+    get_fallback = getattr(easy, "GetFallback", None)
+    list_fallback = getattr(easy, "ListFallback", None)
+    keys = []
+    for key in easy.Get:
+        if key in easy.List:
+            keys.extend(easy.List[key](tags, key))
+        else:
+            keys.append(key)
+    if list_fallback is not None:
+        keys.extend(list_fallback(tags, ""))
+    items = {}
+    for key in keys:
+        getter = easy.Get.get(key)
+        if getter is None:
+            # keys listed for patterns such as replaygain_*_gain
+            getter = next(
+                (get for pattern, get in easy.Get.items() if fnmatchcase(key, pattern)),
+                get_fallback,
+            )
+        try:
+            items[key] = getter(tags, key)
+        except KeyError:
+            pass
+    return items
+
+
+def read_tags(path):
+    """Returns the (tags, pictures) of the file from a single parse. ID3 and
+    MP4 tags are read with the easy interface's getters, so keys are the
+    same as mutagen.File(path, easy=True) would give, while the frames the
+    easy interface hides (comments, website, cover art) come from the same
+    parse instead of opening the file again"""
+    tags = {}
+    pictures = []
+    f = mutagen.File(path)
+    logger.debug(f)
+    if f.tags:
+        logger.debug(f"Tags: {f.keys()}")
+        if isinstance(f.tags, ID3):
+            # mutagen.File(path, easy=True) only gives MP3 and TrueAudio files
+            # easy tags, other formats with ID3 tags keep their raw frames
+            items = easy_items(f.tags) if isinstance(f, (MP3, TrueAudio)) else f.tags
+            for key, value in items.items():
+                tags[key] = make_value_qt_safe(value)
+            for key, frame in f.tags.items():
+                if key.startswith("WOAF") or key.startswith("WAF"):
+                    tags["website"] = make_value_qt_safe(frame)
+                if key.startswith("COM"):
+                    # load comment data here since comment frame keys have
+                    # language suffix we can't just register text key COMM
+                    tags["comment"] = make_value_qt_safe(frame)
+                if key.startswith("APIC") or key.startswith("PIC"):
+                    # get cover art
+                    pictures.append(frame.data)
+            for key, getter in EasyID3.Get.items():
+                try:
+                    tags[key] = make_value_qt_safe(getter(f.tags, key))
+                except:
+                    pass
+        elif isinstance(f.tags, MP4Tags):
+            for key, value in easy_items(f.tags).items():
+                tags[key] = make_value_qt_safe(value)
+            for art in f.tags.get("covr", []):
+                pictures.append(bytes(art))
+        else:
+            for key, value in f.tags.items():
+                tags[key] = make_value_qt_safe(value)
+            if isinstance(f, mutagen.flac.FLAC):
+                for picture in f.pictures:
+                    pictures.append(picture.data)
+    if f.info:
+        for key, value in vars(f.info).items():
+            tags[key] = make_value_qt_safe(value)
+    return tags, pictures
+
+
 class Metadata:
     def __init__(self, song_path):
-        self.pictures = []
         self.path = song_path
         self.tags = {}
+        # digest of the embedded cover art, the picture itself is not kept,
+        # see cover_art.ensure_cover_art
+        self.cover_digest = None
         try:
-            self.load_song(song_path)
+            cache = get_metadata_cache()
+            if (cached := cache.get(song_path)) is not None:
+                self.tags, self.cover_digest = cached
+                return
+        except Exception as err:
+            cache = None
+            logger.warning(f"Could not read the metadata cache: {err}")
+        try:
+            cover = self.load_song(song_path)
         except Exception as err:
             logger.error(
                 f"Could not load metadata for {song_path}: {err.__class__}: {err}"
             )
+            return
+        if cover is not None:
+            self.cover_digest = picture_digest(cover)
+        if cache is not None:
+            try:
+                cache.put(song_path, self.tags, cover)
+            except Exception as err:
+                logger.warning(f"Could not cache metadata for {song_path}: {err}")
 
     def load_song(self, path):
-        f = mutagen.File(path, easy=True)
-        logger.debug(f)
-        if f.tags:
-            logger.debug(f"Tags: {f.keys()}")
-            for key, value in f.tags.items():
-                self.tags[key] = make_value_qt_safe(value)
-
-            if isinstance(f.tags, mutagen.easyid3.EasyID3) or isinstance(
-                f.tags, mutagen.id3.ID3
-            ):
-                if isinstance(f.tags, mutagen.easyid3.EasyID3):
-                    f = mutagen.File(path)
-                for key in f:
-                    if key.startswith("WOAF") or key.startswith("WAF"):
-                        self.tags["website"] = make_value_qt_safe(f[key])
-                    if key.startswith("COM"):
-                        # load comment data here since comment frame keys have
-                        # language suffix we can't just register text key COMM
-                        self.tags["comment"] = make_value_qt_safe(f[key])
-                    if key.startswith("APIC") or key.startswith("PIC"):
-                        # get cover art
-                        self.pictures.append(f[key].data)
-                if isinstance(f.tags, mutagen.id3.ID3):
-                    for key, getter in EasyID3.Get.items():
-                        try:
-                            value = getter(f.tags, key)
-                            self.tags[key] = make_value_qt_safe(value)
-                        except:
-                            pass
-            elif isinstance(f.tags, mutagen.easymp4.EasyMP4Tags):
-                f = mutagen.File(path)
-                if "covr" in f:
-                    for art in f["covr"]:
-                        self.pictures.append(bytes(art))
-            elif isinstance(f, mutagen.flac.FLAC):
-                for picture in f.pictures:
-                    self.pictures.append(picture.data)
-        if f.info:
-            for key, value in vars(f.info).items():
-                self.tags[key] = make_value_qt_safe(value)
-
-    def get_cover_art(self):
-        # extract cover art if it exists
-        if len(self.pictures) > 0:
-            bytes = QByteArray(self.pictures[0])
-            cover = QTemporaryFile(
-                posixpath.join(QDir().tempPath(), APPLICATION, "XXXXXX.cover")
-            )
-            cover.setAutoRemove(False)
-            cover.open(QIODevice.WriteOnly)
-            cover.write(bytes)
-            cover.close()
-            return cover.fileName()
-        return None
+        """Reads the song's tags, returns the bytes of its embedded cover art or None"""
+        tags, pictures = read_tags(path)
+        self.tags.update(tags)
+        return pictures[0] if pictures else None
 
     def get_tags(self):
         return self.tags
@@ -0,0 +1,140 @@
+import hashlib
+import json
+import logging
+import os
+import posixpath
+import sqlite3
+import threading
+import time
+
+from songs_to_youtube.cache import get_cache_dir
+from songs_to_youtube.const import *
+
+logger = logging.getLogger(APPLICATION)
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_metadata_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = MetadataCache(
+                posixpath.join(get_cache_dir("metadata"), "metadata.sqlite3")
+            )
+        return _cache
+
+
+def picture_digest(data: bytes):
+    return hashlib.sha256(data).hexdigest()
+
+
+class MetadataCache:
+    """Remembers the tags (including stream info such as length) read from
+    each song, and its embedded cover art, in an SQLite database so adding
+    a song again does not parse it again. Entries are only used while the
+    file's size and modification time are unchanged. Cover art is stored
+    once per digest, and the least recently used covers are removed once
+    they take up more than MAX_COVER_SIZE bytes. The database may be used
+    by several processes at once"""
+
+    # bump when the tags read from files change, to drop old entries
+    VERSION = 1
+    MAX_COVER_SIZE = 512 * 1024 * 1024
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS songs (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            tags TEXT NOT NULL,
+            cover_digest TEXT
+        );
+        CREATE TABLE IF NOT EXISTS covers (
+            digest TEXT PRIMARY KEY,
+            data BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            last_used REAL NOT NULL
+        );
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        with self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            if self.connection.execute("PRAGMA user_version").fetchone()[0] != self.VERSION:
+                self.connection.executescript(
+                    "DROP TABLE IF EXISTS songs; DROP TABLE IF EXISTS covers;"
+                )
+                self.connection.execute(f"PRAGMA user_version={self.VERSION}")
+            self.connection.executescript(self.SCHEMA)
+
+    def _execute(self, query, parameters=()):
+        with self.lock, self.connection:
+            return self.connection.execute(query, parameters).fetchall()
+
+    def get(self, path):
+        """Returns the (tags, cover_digest) of the song,
+        or None if it is not cached or the file changed"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        rows = self._execute(
+            "SELECT tags, cover_digest FROM songs WHERE path=? AND size=? AND mtime_ns=?",
+            (path, stat.st_size, stat.st_mtime_ns),
+        )
+        if len(rows) == 0:
+            return None
+        return json.loads(rows[0]["tags"]), rows[0]["cover_digest"]
+
+    def put(self, path, tags, cover=None):
+        """Records the song's tags and its cover art bytes, if it has
+        any. Returns the digest of the cover art"""
+        stat = os.stat(path)
+        digest = None
+        if cover is not None:
+            digest = picture_digest(cover)
+            self._execute(
+                """
+                INSERT INTO covers (digest, data, size, last_used) VALUES (?, ?, ?, ?)
+                ON CONFLICT(digest) DO UPDATE SET last_used=excluded.last_used
+                """,
+                (digest, cover, len(cover), time.time()),
+            )
+            self.evict_covers(keep=digest)
+        self._execute(
+            """
+            INSERT OR REPLACE INTO songs (path, size, mtime_ns, tags, cover_digest)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            (path, stat.st_size, stat.st_mtime_ns, json.dumps(tags), digest),
+        )
+        return digest
+
+    def get_cover(self, digest):
+        """Returns the cover art bytes with the given digest, or None if they were evicted"""
+        rows = self._execute("SELECT data FROM covers WHERE digest=?", (digest,))
+        if len(rows) == 0:
+            return None
+        self._execute(
+            "UPDATE covers SET last_used=? WHERE digest=?", (time.time(), digest)
+        )
+        return bytes(rows[0]["data"])
+
+    def evict_covers(self, keep=None):
+        total = self._execute("SELECT COALESCE(SUM(size), 0) FROM covers")[0][0]
+        if total <= self.MAX_COVER_SIZE:
+            return
+        rows = self._execute("SELECT digest, size FROM covers ORDER BY last_used")
+        for row in rows:
+            if total <= self.MAX_COVER_SIZE:
+                break
+            if row["digest"] == keep:
+                continue
+            self._execute("DELETE FROM covers WHERE digest=?", (row["digest"],))
+            total -= row["size"]
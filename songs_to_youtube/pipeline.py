@@ -0,0 +1,172 @@
+import logging
+
+from PySide6.QtCore import *
+
+from songs_to_youtube.const import *
+from songs_to_youtube.field import SETTINGS_VALUES
+from songs_to_youtube.journal import GUI_RUN, JobJournal
+from songs_to_youtube.render import Renderer
+from songs_to_youtube.settings import get_setting
+from songs_to_youtube.song_tree_widget_item import *
+from songs_to_youtube.upload import Uploader
+
+logger = logging.getLogger(APPLICATION)
+
+
+class RenderUploadPipeline(QObject):
+    """Renders items and uploads each video as soon as it is rendered,
+    instead of waiting for every render to finish. Rendering is paused
+    while maxPendingUploads videos are waiting to be uploaded, so the
+    renderer can't get too far ahead of the uploader. Progress is recorded
+    in a JobJournal so an interrupted run can be resumed, in which case
+    videos which were already rendered are not rendered again"""
+
+    # render results, emitted once every render is done
+    render_finished = Signal(dict)
+
+    # render results, upload results
+    finished = Signal(dict, dict)
+
+    def __init__(self, items, upload=True, username=None, resume=False, run=GUI_RUN):
+        super().__init__()
+        self.items = list(items)
+        self.upload = upload
+        self.journal = JobJournal(run=run)
+        if not resume:
+            self.journal.clear()
+        self.max_pending_uploads = int(get_setting("maxPendingUploads"))
+        self.renderer = Renderer()
+        # share the render results so the uploader can
+        # see each render as soon as it finishes
+        self.uploader = Uploader(self.renderer.results, username=username)
+        # output file -> item whose video it is
+        self.upload_items = {}
+        # items which were not rendered because another
+        # item has the same output file
+        self.skipped = []
+        self.rendered = False
+        self.cancelled = False
+        self.done = False
+
+        self.renderer.worker_done.connect(self.on_render_done)
+        self.renderer.finished.connect(self.on_render_finished)
+        self.uploader.worker_done.connect(self.on_upload_done)
+        self.uploader.finished.connect(self.on_upload_finished)
+
+    def add_jobs(self):
+        """Queues a render for every item. Rendering starts once all of
+        them are queued"""
+        with self.renderer.add_jobs():
+            for item in self.items:
+                self.add_item_jobs(item)
+
+    def add_item_jobs(self, item):
+        if item.item_type() == TreeWidgetType.ALBUM:
+            if item.childCount() == 0:
+                return
+            # output paths have to be known before recording the album
+            item.before_render()
+            for song in item.getChildren():
+                song.before_render()
+            multiple = item.get("albumPlaylist") == SETTINGS_VALUES.AlbumPlaylist.MULTIPLE
+            if not multiple and self.is_duplicate(item):
+                return
+            self.journal.record_item(item, self.upload)
+            if multiple:
+                for song in item.getChildren():
+                    if not self.is_duplicate(song):
+                        self.add_song_job(song)
+                return
+            file = item.get("fileOutput")
+            self.upload_items[file] = item
+            if self.journal.is_rendered(file):
+                self.renderer.add_rendered_job(file)
+            else:
+                self.renderer.add_render_album_job(item)
+        else:
+            item.before_render()
+            if self.is_duplicate(item):
+                return
+            self.journal.record_item(item, self.upload)
+            self.add_song_job(item)
+
+    def is_duplicate(self, item):
+        """True if another item was already queued with the same output file,
+        in which case the item is skipped and recorded in self.skipped"""
+        file = item.get("fileOutput")
+        if file not in self.upload_items:
+            return False
+        path = item.get(
+            "song_path" if item.item_type() == TreeWidgetType.SONG else "album_dir"
+        )
+        logger.error(f"{path} has the same output file as another item: {file}")
+        self.skipped.append(path)
+        return True
+
+    def add_song_job(self, song: SongTreeWidgetItem):
+        file = song.get("fileOutput")
+        self.upload_items[file] = song
+        if self.journal.is_rendered(file):
+            self.renderer.add_rendered_job(file)
+        else:
+            self.renderer.add_render_song_job(song)
+
+    def start(self):
+        self.add_jobs()
+        self.renderer.render()
+
+    def on_render_done(self, file, success):
+        if not self.cancelled:
+            self.journal.set_rendered(file, success)
+        item = self.upload_items.get(file)
+        if not success or item is None or not self.upload or self.cancelled:
+            return
+        try:
+            if item.item_type() == TreeWidgetType.ALBUM:
+                self.uploader.add_upload_album_job(item)
+            else:
+                self.uploader.add_upload_song_job(item)
+            if self.uploader.pending_count() > 0:
+                self.uploader.start()
+        except Exception as e:
+            logger.error(e)
+            self.uploader.cancel()
+        self.update_throttle()
+
+    def on_upload_done(self, file, success):
+        if not self.cancelled:
+            self.journal.set_uploaded(file, success)
+        self.update_throttle()
+
+    def update_throttle(self):
+        if self.uploader.done or self.uploader.pending_count() < self.max_pending_uploads:
+            self.renderer.resume()
+        else:
+            logger.debug(
+                f"{self.uploader.pending_count()} videos waiting to upload, pausing rendering"
+            )
+            self.renderer.pause()
+
+    def on_render_finished(self, results):
+        self.rendered = True
+        self.render_finished.emit(results)
+        self.uploader.close()
+        self.check_finished()
+
+    def on_upload_finished(self, results):
+        self.update_throttle()
+        self.check_finished()
+
+    def check_finished(self):
+        if self.done or not self.rendered or not self.uploader.done:
+            return
+        self.done = True
+        # nothing left to resume
+        self.journal.clear()
+        self.finished.emit(dict(self.renderer.results), dict(self.uploader.results))
+
+    def cancel(self):
+        self.cancelled = True
+        self.renderer.cancel()
+        if not self.uploader.done:
+            self.uploader.cancel()
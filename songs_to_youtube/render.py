@@ -1,17 +1,37 @@
+import asyncio
 import atexit
 import logging
 import os
+import shutil
 import subprocess
-import time
 import traceback
-from queue import Queue
-from threading import Thread
+from contextlib import contextmanager
+from threading import Lock, Thread
 
 import psutil
 from PySide6.QtCore import *
 
+from songs_to_youtube.background import (
+    BackgroundConcatLists,
+    BackgroundFrames,
+    get_background_cache,
+    prepare_cover_art,
+)
+from songs_to_youtube.concurrency import (
+    ConcurrencyController,
+    CpuPartitioner,
+    usable_cpu_count,
+)
 from songs_to_youtube.const import *
+from songs_to_youtube.cover_art import ensure_cover_art
 from songs_to_youtube.field import SETTINGS_VALUES
+from songs_to_youtube.render_cache import (
+    get_render_cache,
+    render_key,
+    restore_render,
+    store_render,
+)
+from songs_to_youtube.scheduler import JobScheduler
 from songs_to_youtube.song_tree_widget_item import *
 
 logger = logging.getLogger(APPLICATION)
@@ -35,57 +55,175 @@ def clean_up():
 atexit.register(clean_up)
 
 
-class ProcessHandler(QObject):
-    stdout = Signal(str)
-    stderr = Signal(str)
+# priority renders run at, below the interface and uploads
+RENDER_NICENESS = 10
+
+
+TASKSET = shutil.which("taskset")
+NICE = shutil.which("nice")
+
+
+def limit_process(pid, cpus=None):
+    """Pins the process to the given cores and lowers its priority so renders
+    never starve the interface or uploads. Processes it starts afterwards
+    inherit both, on Linux only the process' main thread is limited"""
+    try:
+        process = psutil.Process(pid)
+        if cpus and hasattr(process, "cpu_affinity"):
+            process.cpu_affinity(cpus)
+        process.nice(
+            psutil.BELOW_NORMAL_PRIORITY_CLASS if os.name == "nt" else RENDER_NICENESS
+        )
+    except psutil.Error as e:
+        logger.debug(f"Could not limit process {pid}: {e}")
+
+
+def limited_command(command, cpus=None):
+    """Returns the arguments which run command in a shell pinned to the given
+    cores at a lower priority. taskset and nice set the limits before the
+    shell starts, so ffmpeg and all of its threads inherit them"""
+    args = ["/bin/sh", "-c", command]
+    if NICE:
+        args = [NICE, "-n", str(RENDER_NICENESS), *args]
+    if cpus and TASKSET:
+        args = [TASKSET, "--cpu-list", ",".join(map(str, cpus)), *args]
+    return args
+
+
+def _pidfd_supported():
+    try:
+        os.close(os.pidfd_open(os.getpid()))
+        return True
+    except (AttributeError, OSError):
+        return False
+
+
+class ProcessReactor:
+    """Runs every child process on one asyncio event loop in a background
+    thread. Output lines are delivered to callbacks as soon as they are
+    read, without a reader thread per pipe or any polling"""
+
+    _instance = None
+    _instance_lock = Lock()
+
+    # longest stdout/stderr line we accept from a process
+    LINE_LIMIT = 1024 * 1024
 
     def __init__(self):
-        super().__init__()
+        self.loop = asyncio.new_event_loop()
+        # wait for child processes through pidfds on our own loop. asyncio's
+        # child watcher is shared by the whole process, and before python
+        # 3.12 it waits for each child process on its own thread
+        self.use_pidfd = os.name != "nt" and _pidfd_supported()
+        self.thread = Thread(
+            target=self.loop.run_forever, name="ProcessReactor", daemon=True
+        )
+        self.thread.start()
+
+    @classmethod
+    def instance(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def start(self, command, on_stdout, on_stderr, cpus=None):
+        """Runs command in a shell, calling on_stdout and on_stderr with
+        each line it writes. The process is limited to the cores in cpus.
+        Returns a concurrent.futures.Future which resolves to the exit
+        code of the process"""
+        return asyncio.run_coroutine_threadsafe(
+            self._run(command, on_stdout, on_stderr, cpus), self.loop
+        )
+
+    async def _read(self, stream, callback):
+        while line := await stream.readline():
+            callback(line.decode("utf-8", "replace"))
 
-    def read_pipe(self, pipe, queue):
+    async def _open_reader(self, pipe):
+        reader = asyncio.StreamReader(limit=self.LINE_LIMIT, loop=self.loop)
+        await self.loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader, loop=self.loop), pipe
+        )
+        return reader
+
+    async def _wait_pidfd(self, p):
+        pidfd = os.pidfd_open(p.pid)
+        exited = self.loop.create_future()
+        # the pidfd becomes readable once the process exits
+        self.loop.add_reader(pidfd, lambda: exited.done() or exited.set_result(None))
         try:
-            with pipe:
-                for line in iter(pipe.readline, b""):
-                    queue.put((pipe, line.decode("utf-8")))
+            await exited
         finally:
-            queue.put((None, None))
+            self.loop.remove_reader(pidfd)
+            os.close(pidfd)
+        return p.wait()
+
+    async def _create_subprocess(self, command, cpus):
+        pipes = {
+            "stdin": subprocess.DEVNULL,
+            "stdout": subprocess.PIPE,
+            "stderr": subprocess.PIPE,
+            "limit": self.LINE_LIMIT,
+        }
+        if os.name != "nt":
+            return await asyncio.create_subprocess_exec(
+                *limited_command(command, cpus), **pipes
+            )
+        p = await asyncio.create_subprocess_shell(
+            command, creationflags=subprocess.CREATE_NO_WINDOW, **pipes
+        )
+        # processes the shell starts from now on inherit the limits
+        limit_process(p.pid, cpus)
+        return p
 
-    def run(self, command):
-        if os.name == "nt":
+    async def _run(self, command, on_stdout, on_stderr, cpus):
+        if self.use_pidfd:
             p = subprocess.Popen(
-                command,
+                limited_command(command, cpus),
                 stdin=subprocess.DEVNULL,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
-                creationflags=subprocess.CREATE_NO_WINDOW,
-                shell=True,
             )
+            stdout = await self._open_reader(p.stdout)
+            stderr = await self._open_reader(p.stderr)
+            wait = lambda: self._wait_pidfd(p)
         else:
-            p = subprocess.Popen(
-                command,
-                stdin=subprocess.DEVNULL,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                shell=True,
+            p = await self._create_subprocess(command, cpus)
+            stdout, stderr, wait = p.stdout, p.stderr, p.wait
+        PROCESSES.append(p)
+        if cpus and os.name != "nt" and not TASKSET:
+            # too late for anything the shell started already
+            limit_process(p.pid, cpus)
+        try:
+            await asyncio.gather(
+                self._read(stdout, on_stdout), self._read(stderr, on_stderr)
             )
+            return await wait()
+        finally:
+            PROCESSES.remove(p)
 
-        PROCESSES.append(p)
-        q = Queue()
-        Thread(target=self.read_pipe, args=[p.stdout, q]).start()
-        Thread(target=self.read_pipe, args=[p.stderr, q]).start()
-        while True:
-            while q.empty() or (item := q.get_nowait()) is None:
-                time.sleep(0.01)
-            pipe, line = item
-            if pipe is None:
-                break
-            if pipe == p.stdout:
-                self.stdout.emit(line)
-            else:
-                self.stderr.emit(line)
-        error = p.wait() != 0
-        PROCESSES.remove(p)
-        return error
+
+def start_process(command, signals, cpus, on_exit):
+    """Starts command without waiting for it, so a render does not hold a
+    thread while its process runs. Output lines are emitted through the
+    worker's signals, and on_exit is called with True if the process failed
+    once it exits. Both happen on the reactor thread, so on_exit must not
+    block"""
+
+    def exited(future):
+        try:
+            if future.exception() is not None:
+                signals.error.emit(str(future.exception()))
+            on_exit(future.exception() is not None or future.result() != 0)
+        except Exception:
+            signals.error.emit(traceback.format_exc())
+            signals.finished.emit(False)
+
+    future = ProcessReactor.instance().start(
+        command, signals.progress.emit, signals.error.emit, cpus
+    )
+    future.add_done_callback(exited)
 
 
 class WorkerSignals(QObject):
@@ -104,20 +242,69 @@ class RenderSongWorker(QRunnable):
         self.song = song
         self.name = self.song.get("fileOutput")
         self.signals = WorkerSignals()
+        # cores to run on, assigned by the renderer
+        self.cpus = None
+        self.background_cache = get_background_cache()
+        self.render_cache = get_render_cache()
         self.setAutoDelete(False)
 
     def run(self):
         try:
-            command_str = (self.song.get("commandString")).format(**self.song.to_dict())
-            handler = ProcessHandler()
-            handler.stderr.connect(self.signals.error.emit)
-            handler.stdout.connect(self.signals.progress.emit)
-            errors = handler.run(command_str)
-            self.signals.finished.emit(not errors)
+            values = self.song.to_dict()
+            values["threads"] = len(self.cpus) if self.cpus else usable_cpu_count()
+            command_string = self.song.get("commandString")
+            # None if the render is not cached
+            key = None
+            if self.render_cache is not None:
+                key = self.cache_key(values, command_string)
+            if key is not None and restore_render(self.render_cache, key, self.name):
+                self.signals.finished.emit(True)
+                return
+            # the old output may be a hard link to a cached render,
+            # which ffmpeg would overwrite in place
+            if os.path.exists(self.name):
+                os.remove(self.name)
+            # only done once the render has to run, composing the
+            # background frames can take as long as a short render
+            prepare_cover_art(values, self.background_cache)
+            values["background"] = BackgroundFrames(values, self.background_cache)
+            command_str = command_string.format(**values)
+            start_process(
+                command_str,
+                self.signals,
+                self.cpus,
+                lambda errors: self.rendered(errors, key),
+            )
         except Exception as e:
             self.signals.error.emit(traceback.format_exc())
             self.signals.finished.emit(False)
 
+    def cache_key(self, values, command_string):
+        """Returns the render's key in the render cache, or None if
+        its inputs can't be read, in which case it is not cached"""
+        # the key hashes the cover art, which may not be extracted yet
+        if ensure_cover_art(values["coverArt"]) is None:
+            logger.warning(f"Not caching {self.name}, its cover art is missing")
+            return None
+        try:
+            return render_key(values, command_string)
+        except OSError as e:
+            logger.warning(f"Not caching {self.name}: {e}")
+            return None
+
+    def rendered(self, errors, key):
+        if errors or key is None:
+            self.signals.finished.emit(not errors)
+            return
+
+        def store():
+            store_render(self.render_cache, key, self.name)
+            self.signals.finished.emit(True)
+
+        # the render is copied if the cache is on another drive,
+        # which is too slow for the reactor thread
+        QThreadPool.globalInstance().start(store)
+
     def get_duration_ms(self):
         return self.song.get_duration_ms()
 
@@ -132,11 +319,16 @@ class CombineSongWorker(QRunnable):
         self.album = album
         self.name = self.album.get("fileOutput")
         self.signals = WorkerSignals()
+        # cores to run on, assigned by the renderer
+        self.cpus = None
+        # concat list of the rendered songs
+        self.song_list = None
         self.setAutoDelete(False)
 
     def run(self):
         try:
-            song_list = QTemporaryFile()
+            # kept until ffmpeg is done, the file is deleted with the object
+            self.song_list = song_list = QTemporaryFile()
             song_list.open(QIODevice.WriteOnly | QIODevice.Append | QIODevice.Text)
             for song in self.album.getChildren():
                 song_list.write(
@@ -151,20 +343,20 @@ class CombineSongWorker(QRunnable):
                 input_file_list=song_list.fileName(),
                 fileOutputPath=self.album.get("fileOutput"),
             )
-            handler = ProcessHandler()
-            handler.stderr.connect(self.signals.error.emit)
-            handler.stdout.connect(self.signals.progress.emit)
-            errors = handler.run(command_str)
-            for song in self.album.getChildren():
-                try:
-                    os.remove(song.get("fileOutput"))
-                except:
-                    pass
-            self.signals.finished.emit(not errors)
+            start_process(command_str, self.signals, self.cpus, self.combined)
         except Exception as e:
             self.signals.error.emit(traceback.format_exc())
             self.signals.finished.emit(False)
 
+    def combined(self, errors):
+        self.song_list = None
+        for song in self.album.getChildren():
+            try:
+                os.remove(song.get("fileOutput"))
+            except:
+                pass
+        self.signals.finished.emit(not errors)
+
     def get_duration_ms(self):
         return self.album.get_duration_ms()
 
@@ -172,34 +364,64 @@ class CombineSongWorker(QRunnable):
         return self.name
 
 
-class AlbumRenderHelper:
-    def __init__(self, album: AlbumTreeWidgetItem, *args):
+class RenderAlbumWorker(QRunnable):
+    """Renders a whole album with a single ffmpeg process. The songs are
+    concatenated as they are decoded and the video shows each song's
+    background frame, so no per-song videos are written"""
+
+    def __init__(self, album: AlbumTreeWidgetItem):
+        super().__init__()
+        self.auto_delete = True
         self.album = album
-        self.workers = set()
-        self.renderer = None
-        self.combine_worker = ""
-        self.error = False
-
-    def worker_done(self, worker, success):
-        if worker in self.workers:
-            self.workers.discard(worker)
-            if not success:
-                self.error = True
-                self.renderer.cancel_worker(self.combine_worker)
-        if len(self.workers) == 0 and not self.error:
-            # done rendering songs,
-            # begin concatenation
-            self.renderer.start_worker(self.combine_worker)
-
-    def render(self, renderer):
-        renderer.worker_done.connect(self.worker_done)
-        for song in self.album.getChildren():
-            song.before_render()
-            worker = renderer.add_render_song_job(song, auto_delete=False)
-            self.workers.add(worker)
-        self.combine_worker = renderer.combine_songs_into_album(self.album)
-        self.renderer = renderer
-        return self
+        self.name = self.album.get("fileOutput")
+        self.signals = WorkerSignals()
+        # cores to run on, assigned by the renderer
+        self.cpus = None
+        self.background_cache = get_background_cache()
+        # background lists of the songs
+        self.cover_list = None
+        self.setAutoDelete(False)
+
+    def run(self):
+        try:
+            songs = list(self.album.getChildren())
+            song_values = [song.to_dict() for song in songs]
+            for song_dict in song_values:
+                prepare_cover_art(song_dict, self.background_cache)
+            values = self.album.to_dict()
+            # kept until ffmpeg is done, the list files are deleted with it
+            self.cover_list = values["cover_list"] = BackgroundConcatLists(
+                [
+                    (song_dict, song.get_duration_ms() / 1000)
+                    for song, song_dict in zip(songs, song_values)
+                ],
+                song_values[0]["videoWidth"],
+                song_values[0]["videoHeight"],
+                self.background_cache,
+            )
+            # input 0 is the cover list, songs start at input 1
+            values["song_inputs"] = " ".join(
+                '-i "{}"'.format(song_dict["song_path"]) for song_dict in song_values
+            )
+            values["song_concat"] = "{}concat=n={}:v=0:a=1".format(
+                "".join(f"[{i + 1}:a]" for i in range(len(songs))), len(songs)
+            )
+            values["threads"] = len(self.cpus) if self.cpus else usable_cpu_count()
+            command_str = self.album.get("albumCommandString").format(**values)
+            start_process(command_str, self.signals, self.cpus, self.rendered)
+        except Exception as e:
+            self.signals.error.emit(traceback.format_exc())
+            self.signals.finished.emit(False)
+
+    def rendered(self, errors):
+        self.cover_list = None
+        self.signals.finished.emit(not errors)
+
+    def get_duration_ms(self):
+        return self.album.get_duration_ms()
+
+    def __str__(self):
+        return self.name
 
 
 class Renderer(QObject):
@@ -218,18 +440,29 @@ class Renderer(QObject):
     def __init__(self):
         super().__init__()
 
-        QThreadPool.globalInstance().setMaxThreadCount(int(get_setting("maxProcesses")))
-
-        # array of album helpers so they
-        # don't get garbage collected
-        self.helpers = []
-
         # worker name -> QRunnable
+        # workers which are running or waiting to run
         self.workers = {}
 
-        # worker name -> QRunnable
-        # workers which are not in the thread pool yet
-        self.queued_workers = {}
+        # decides which waiting worker runs next. Workers are only handed
+        # to the thread pool when it has a free thread, so that the order
+        # is ours and pause() can hold them back
+        self.scheduler = JobScheduler()
+        self.running = 0
+        self.paused = False
+        # True while jobs are being added, see add_jobs
+        self.adding = False
+        self.partitioner = CpuPartitioner()
+
+        max_processes = int(get_setting("maxProcesses"))
+        # 0 means pick the number of renders from the system load
+        self.concurrency = None
+        if max_processes == 0:
+            self.concurrency = ConcurrencyController(self.scheduler.has_ready, self)
+            self.concurrency.limit_changed.connect(lambda *args: self._start_pending())
+            self.finished.connect(self.concurrency.stop)
+            max_processes = self.concurrency.max_limit
+        QThreadPool.globalInstance().setMaxThreadCount(max_processes)
 
         # finished workers that still need to be held onto
         # so that resources don't go out of scope
@@ -258,34 +491,40 @@ class Renderer(QObject):
     def worker_finished(self, worker, success):
         self.results[str(worker)] = success
         self.workers.pop(str(worker), None)
+        self.running -= 1
+        self.partitioner.release(str(worker))
         if not self.cancelled:
             if not worker.auto_delete:
                 self.finished_workers.append(worker)
             self.worker_done.emit(str(worker), success)
             logger.debug("{} finished, success: {}".format(str(worker), success))
+            # workers which can't run because they needed this one
+            for worker_name in self.scheduler.finish(str(worker), success):
+                self.workers.pop(worker_name, None)
+                self.results[worker_name] = False
+                self.worker_done.emit(worker_name, False)
             if len(self.workers) == 0:
-                if len(self.queued_workers) == 0:
-                    # finished all jobs, send results
-                    self.finished.emit(self.results)
-                else:
-                    # still have combine jobs, move them to thread pool
-                    for worker_name, worker in self.queued_workers.items():
-                        self.add_worker(worker)
-                    self.queued_workers = {}
-
-    def start_worker(self, worker_name):
-        # manually start a worker that wasn't created
-        # with auto_start=True
-        if worker_name in self.queued_workers:
-            worker = self.queued_workers.pop(worker_name)
-            self.workers[worker_name] = worker
-            QThreadPool.globalInstance().start(worker)
-
-    def cancel_worker(self, worker_name):
-        # cancel a worker which is not in the thread pool yet
-        self.queued_workers.pop(worker_name, None)
-
-    def add_worker(self, worker, auto_start=True):
+                # finished all jobs, send results
+                self.finished.emit(self.results)
+        # after worker_done, so listeners get a chance to pause us first
+        self._start_pending()
+
+    def add_worker(self, worker, depends_on=()):
+        """Queues the worker to run once the workers named in depends_on have
+        finished successfully. A worker whose output is already being
+        rendered is not queued, the one which is already queued is returned"""
+        if not self.scheduler.add(
+            str(worker), worker, worker.get_duration_ms(), depends_on
+        ):
+            logger.error(f"{worker} is already being rendered")
+            return self.workers.get(str(worker), worker)
+        if self.scheduler.has_failed(str(worker)):
+            # a worker it needs failed before it was added
+            self.results[str(worker)] = False
+            self.worker_done.emit(str(worker), False)
+            if len(self.workers) == 0 and not self.adding:
+                self.finished.emit(self.results)
+            return worker
         worker.signals.finished.connect(
             lambda success, worker=worker: self.worker_finished(worker, success)
         )
@@ -295,20 +534,65 @@ class Renderer(QObject):
         worker.signals.progress.connect(
             lambda progress, worker=worker: self._worker_progress(worker, progress)
         )
-        if auto_start:
-            self.workers[str(worker)] = worker
-            QThreadPool.globalInstance().start(worker)
+        self.workers[str(worker)] = worker
+        self._start_pending()
+        return worker
+
+    def _start_pending(self):
+        # only hand the thread pool as many workers as it can run at once,
+        # the rest wait here so pause() can hold them back
+        if self.concurrency is not None:
+            max_running = self.concurrency.limit
         else:
-            self.queued_workers[str(worker)] = worker
+            max_running = QThreadPool.globalInstance().maxThreadCount()
+        while (
+            not self.paused
+            and not self.adding
+            and not self.cancelled
+            and self.running < max_running
+        ):
+            worker = self.scheduler.pop_ready()
+            if worker is None:
+                break
+            self.running += 1
+            worker.cpus = self.partitioner.acquire(str(worker), max_running)
+            QThreadPool.globalInstance().start(worker)
+            if self.concurrency is not None:
+                self.concurrency.start()
+
+    @contextmanager
+    def add_jobs(self):
+        """Holds back the workers added in the with block until all of them
+        are queued, so the longest jobs start first instead of the first
+        ones which were added"""
+        self.adding = True
+        try:
+            yield
+        finally:
+            self.adding = False
+            self._start_pending()
 
-        return worker
+    def pause(self):
+        """Stop starting new workers. Workers which are already running finish"""
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+        self._start_pending()
 
     def add_render_album_job(self, album: AlbumTreeWidgetItem):
         album.before_render()
         if album.childCount() == 0:
             return
         if album.get("albumPlaylist") == SETTINGS_VALUES.AlbumPlaylist.SINGLE:
-            self.helpers.append(AlbumRenderHelper(album).render(self))
+            # concatenate the songs as soon as all of them are rendered
+            song_workers = [
+                self.add_render_song_job(song, auto_delete=False)
+                for song in album.getChildren()
+            ]
+            self.add_worker(CombineSongWorker(album), song_workers)
+        elif album.get("albumPlaylist") == SETTINGS_VALUES.AlbumPlaylist.SINGLE_PASS:
+            self.add_worker(RenderAlbumWorker(album))
         elif album.get("albumPlaylist") == SETTINGS_VALUES.AlbumPlaylist.MULTIPLE:
             for song in album.getChildren():
                 self.add_render_song_job(song)
@@ -319,10 +603,10 @@ class Renderer(QObject):
         self.add_worker(worker)
         return str(worker)
 
-    def combine_songs_into_album(self, album: AlbumTreeWidgetItem):
-        worker = CombineSongWorker(album)
-        self.add_worker(worker, False)
-        return str(worker)
+    def add_rendered_job(self, file_path):
+        """Records a video which was already rendered as a successful render"""
+        self.results[file_path] = True
+        self.worker_done.emit(file_path, True)
 
     def render(self):
         if len(self.workers) == 0 and len(self.finished_workers) == 0:
@@ -331,6 +615,7 @@ class Renderer(QObject):
     def cancel(self):
         clean_up()
         self.cancelled = True
+        self.scheduler.clear()
         for worker in self.workers:
             if str(worker) not in self.results:
                 self.results[str(worker)] = False
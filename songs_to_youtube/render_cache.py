@@ -0,0 +1,114 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+from string import Formatter
+
+from songs_to_youtube.cache import DiskCache, file_digest, get_cache_dir
+from songs_to_youtube.const import *
+from songs_to_youtube.settings import get_setting
+
+logger = logging.getLogger(APPLICATION)
+
+_cache = None
+_cache_lock = threading.Lock()
+
+# values which are left out of the key: paths of inputs whose contents
+# are hashed separately, so renders of moved or renamed files still hit,
+# the output path, of which only the extension (the format) is part of the
+# key, and the thread count, which does not change the output
+IGNORED_VALUES = (
+    "song_path",
+    "song_dir",
+    "song_file",
+    "coverArt",
+    "fileOutput",
+    "threads",
+)
+
+# values the {background[style]} frames are composed from besides the cover
+BACKGROUND_VALUES = ("videoWidth", "videoHeight", "backgroundColor")
+
+
+def get_render_cache():
+    """Returns the render cache, or None if it is disabled"""
+    global _cache
+    with _cache_lock:
+        max_size = int(get_setting("renderCacheSize")) * 1024 * 1024
+        if max_size <= 0:
+            return None
+        if _cache is None:
+            _cache = DiskCache(get_cache_dir("renders"), max_size)
+        return _cache
+
+
+def command_value_names(command_string: str):
+    """Returns the names of the values the command string uses,
+    e.g. background for {background[blurred]}"""
+    names = set()
+    for _, field, _, _ in Formatter().parse(command_string):
+        if field:
+            names.add(re.split(r"[.\[]", field, maxsplit=1)[0])
+    if "background" in names:
+        names.update(BACKGROUND_VALUES)
+    return names
+
+
+def render_key(values: dict, command_string: str):
+    """Returns the cache key of a render: a hash of the input audio, the cover
+    art, the output format, the unformatted command and the values it uses.
+    Nothing is formatted, so the background frames are not composed unless
+    the render runs"""
+    used_values = {
+        name: str(values.get(name))
+        for name in sorted(command_value_names(command_string))
+        if name not in IGNORED_VALUES and name != "background"
+    }
+    key_source = "\0".join(
+        (
+            file_digest(values["song_path"]),
+            file_digest(values["coverArt"]),
+            os.path.splitext(values["fileOutput"])[1].lower(),
+            command_string,
+            json.dumps(used_values, sort_keys=True),
+        )
+    )
+    return hashlib.sha256(key_source.encode("utf-8")).hexdigest()
+
+
+def link_or_copy(src, dst):
+    """Hard links src to dst, copying it if they are on different drives"""
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def restore_render(cache: DiskCache, key, output):
+    """Writes the cached render with the given key to output.
+    Returns False if there is no such render"""
+    if (path := cache.get(key)) is None:
+        return False
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    link_or_copy(path, output)
+    logger.debug(f"Reused cached render {path} for {output}")
+    return True
+
+
+def store_render(cache: DiskCache, key, output):
+    """Adds the rendered output to the cache under key"""
+    ext = os.path.splitext(output)[1]
+    temp_path = cache.path_for(key, ".part" + ext)
+    try:
+        link_or_copy(output, temp_path)
+        cache.put(key, temp_path, ext)
+    except OSError as e:
+        logger.warning(f"Could not cache render {output}: {e}")
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
@@ -0,0 +1,137 @@
+import heapq
+import itertools
+import logging
+
+from songs_to_youtube.const import *
+
+logger = logging.getLogger(APPLICATION)
+
+
+class Job:
+    def __init__(self, name, worker, cost, depends_on):
+        self.name = name
+        self.worker = worker
+        # estimated run time, e.g. the duration of the audio
+        self.cost = cost
+        # names of jobs which have to finish first
+        self.waiting_on = set(depends_on)
+        self.dependents = []
+        self.done = False
+        # True if the job, or a job it needed, failed
+        self.failed = False
+        # rank and order of the job's entry in the ready heap, None if
+        # it has none. Entries with another rank are outdated
+        self.queued_rank = None
+        self.order = None
+
+    def rank(self):
+        """Estimated time from starting this job until every
+        job which depends on it is done (its critical path)"""
+        return self.cost + max((job.rank() for job in self.dependents), default=0)
+
+
+class JobScheduler:
+    """Orders jobs which depend on each other, e.g. an album's song renders
+    and the concatenation which needs all of them. A job becomes ready the
+    moment its own dependencies finish, and ready jobs are handed out
+    longest critical path first so long jobs don't end up running last"""
+
+    def __init__(self):
+        # name -> Job
+        self.jobs = {}
+        # (-rank, order, name)
+        self.ready = []
+        self.order = itertools.count()
+
+    def add(self, name, worker, cost=0, depends_on=()):
+        """Adds the job. Returns False, leaving the job which is already
+        there as it is, if a job with the same name was added before.
+        A job which depends on a job that failed already is added as
+        failed, see has_failed"""
+        if name in self.jobs:
+            logger.warning(f"Job {name} was already added")
+            return False
+        unknown = [dep for dep in depends_on if dep not in self.jobs]
+        if unknown:
+            raise ValueError(
+                f"Job {name} depends on jobs which were not added: {', '.join(unknown)}"
+            )
+        failed = [dep for dep in depends_on if self.jobs[dep].failed]
+        depends_on = [dep for dep in depends_on if not self.jobs[dep].done]
+        job = Job(name, worker, cost, depends_on)
+        self.jobs[name] = job
+        if failed:
+            logger.debug(f"Dropping {name}, {', '.join(failed)} failed")
+            job.done = job.failed = True
+            return True
+        for dep in depends_on:
+            self.jobs[dep].dependents.append(job)
+        if len(job.waiting_on) == 0:
+            self._push(job)
+        for dep in depends_on:
+            self._update_rank(self.jobs[dep])
+        return True
+
+    def _push(self, job):
+        rank = job.rank()
+        if rank == job.queued_rank:
+            return
+        if job.order is None:
+            # jobs keep their place among jobs of the same rank
+            job.order = next(self.order)
+        job.queued_rank = rank
+        heapq.heappush(self.ready, (-rank, job.order, job.name))
+
+    def _update_rank(self, job):
+        """Requeues the job and the jobs it waits on, which are usually
+        added first, as a job which depends on them was added"""
+        if job.queued_rank is not None:
+            self._push(job)
+        for dep in job.waiting_on:
+            self._update_rank(self.jobs[dep])
+
+    def pop_ready(self):
+        """Returns the worker of the ready job to run next, or None"""
+        while self.ready:
+            rank, _, name = heapq.heappop(self.ready)
+            job = self.jobs.get(name)
+            if job is not None and not job.done and job.queued_rank == -rank:
+                job.queued_rank = None
+                return job.worker
+        return None
+
+    def has_ready(self):
+        return any(
+            (job := self.jobs.get(name)) is not None
+            and not job.done
+            and job.queued_rank == -rank
+            for rank, _, name in self.ready
+        )
+
+    def finish(self, name, success):
+        """Marks the job as done. Returns the names of the jobs which
+        were dropped because they depended on it and it failed"""
+        job = self.jobs.get(name)
+        if job is None or job.done:
+            return []
+        job.done = True
+        job.failed = not success
+        dropped = []
+        for dependent in job.dependents:
+            if success:
+                dependent.waiting_on.discard(name)
+                if len(dependent.waiting_on) == 0:
+                    self._push(dependent)
+            elif not dependent.done:
+                logger.debug(f"Dropping {dependent.name}, {name} failed")
+                dropped.append(dependent.name)
+                dropped.extend(self.finish(dependent.name, False))
+        return dropped
+
+    def has_failed(self, name):
+        job = self.jobs.get(name)
+        return job is not None and job.failed
+
+    def clear(self):
+        self.jobs = {}
+        self.ready = []
@@ -7,6 +7,7 @@ from PySide6.QtGui import QPixmap
 from PySide6.QtWidgets import *
 
 from songs_to_youtube.const import *
+from songs_to_youtube.cover_art import ensure_cover_art, get_cover_thumbnail
 from songs_to_youtube.field import *
 from songs_to_youtube.utils import *
 
@@ -50,6 +51,10 @@ class FileComboBox(QComboBox):
             concat_dir = posixpath.join(commands_dir, "concat")
             os.makedirs(concat_dir, exist_ok=True)
             self.dirs = [resource_path("commands/concat"), concat_dir]
+        elif object_name == "albumCommandName":
+            album_dir = posixpath.join(commands_dir, "album")
+            os.makedirs(album_dir, exist_ok=True)
+            self.dirs = [resource_path("commands/album"), album_dir]
         else:
             raise Exception(f"ComboBox has name {self.objectName()}")
         self.reload()
@@ -107,7 +112,9 @@ class CoverArtDisplay(QLabel):
             path = SETTINGS_VALUES.MULTIPLE_VALUES_IMG
         if path == self.image_path:
             return
-        if self.setPixmap(QPixmap(path)):
+        # embedded cover art is only written to a file when it is needed
+        ensure_cover_art(path)
+        if self.setPixmap(QPixmap(get_cover_thumbnail(path))):
             self.image_path = path
             self.imageChanged.emit(path)
         else:
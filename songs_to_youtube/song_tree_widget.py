@@ -1,41 +1,183 @@
-import os
+import json
 
 from PySide6.QtCore import *
 from PySide6.QtGui import *
 from PySide6.QtWidgets import *
 
 from songs_to_youtube.field import SETTINGS_VALUES
+from songs_to_youtube.library_scanner import LibraryScanner
 from songs_to_youtube.metadata_table_widget import MetadataTableWidget
-from songs_to_youtube.render import Renderer
+from songs_to_youtube.pipeline import RenderUploadPipeline
 from songs_to_youtube.settings import *
 from songs_to_youtube.song_tree_widget_item import *
-from songs_to_youtube.upload import Uploader
 from songs_to_youtube.utils import *
 
 
-class SongTreeModel(QStandardItemModel):
+class SongTreeModel(QAbstractItemModel):
+    """The songs and albums in the queue. Rows are TreeItems, which the
+    indexes point to, and the values of the items are kept in job_store"""
+
+    MIME_TYPE = "application/x-songs-to-youtube-rows"
+
     def __init__(self, *args):
         super().__init__(*args)
+        self.items = []
+
+    def top_level_items(self):
+        return self.items
+
+    def item(self, row):
+        return self.items[row]
+
+    def item_from_index(self, index: QModelIndex):
+        return index.internalPointer() if index.isValid() else None
+
+    def index_of(self, item: TreeItem):
+        return self.createIndex(item.row(), 0, item)
+
+    def _children(self, parent: TreeItem):
+        return self.items if parent is None else parent._children
+
+    def _parent_index(self, parent: TreeItem):
+        return QModelIndex() if parent is None else self.index_of(parent)
+
+    def index(self, row, column, parent=QModelIndex()):
+        children = self._children(self.item_from_index(parent))
+        if column != 0 or not 0 <= row < len(children):
+            return QModelIndex()
+        return self.createIndex(row, column, children[row])
+
+    def parent(self, index):
+        if not index.isValid():
+            return QModelIndex()
+        return self._parent_index(index.internalPointer()._parent)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.column() > 0:
+            return 0
+        return len(self._children(self.item_from_index(parent)))
+
+    def columnCount(self, parent=QModelIndex()):
+        return 1
+
+    def hasChildren(self, parent=QModelIndex()):
+        return self.rowCount(parent) > 0
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        return index.internalPointer().data(role)
+
+    def flags(self, index):
+        if not index.isValid():
+            # songs and albums can be dropped between the top level items
+            return Qt.ItemIsDropEnabled
+        return index.internalPointer().flags()
+
+    def item_changed(self, item: TreeItem):
+        index = self.index_of(item)
+        self.dataChanged.emit(index, index)
+
+    def _attach(self, item: TreeItem):
+        item._model = self
+        for child in item._children:
+            child._model = self
+
+    def insert_items(self, parent: TreeItem, row, items):
+        self.beginInsertRows(self._parent_index(parent), row, row + len(items) - 1)
+        children = self._children(parent)
+        children[row:row] = items
+        for item in items:
+            item._parent = parent
+            self._attach(item)
+        self.endInsertRows()
+
+    def appendRow(self, item: TreeItem):
+        self.insert_items(None, len(self.items), [item])
+
+    def removeRows(self, row, count, parent=QModelIndex()):
+        parent_item = self.item_from_index(parent)
+        children = self._children(parent_item)
+        if count <= 0 or row < 0 or row + count > len(children):
+            return False
+        self.beginRemoveRows(parent, row, row + count - 1)
+        for item in children[row : row + count]:
+            item._parent = None
+            item._model = None
+            for child in item._children:
+                child._model = None
+        del children[row : row + count]
+        self.endRemoveRows()
+        return True
+
+    def move_item(self, item: TreeItem, parent: TreeItem, row):
+        """Moves the item to the given row of parent, returns
+        the row after it. parent is None for the top level"""
+        source_parent = item._parent
+        source_row = item.row()
+        moved = self.beginMoveRows(
+            self._parent_index(source_parent),
+            source_row,
+            source_row,
+            self._parent_index(parent),
+            row,
+        )
+        if source_parent is parent and source_row < row:
+            # the rows after the item move up one
+            row -= 1
+        if moved:
+            del self._children(source_parent)[source_row]
+            self._children(parent).insert(row, item)
+            item._parent = parent
+            self.endMoveRows()
+        return row + 1
+
+    def supportedDropActions(self):
+        return Qt.MoveAction
+
+    def mimeTypes(self):
+        return [self.MIME_TYPE]
+
+    def mimeData(self, indexes):
+        # rows are only dragged within the tree, so
+        # the (album row, row) of each item is enough
+        rows = []
+        for index in indexes:
+            item = index.internalPointer()
+            parent_row = -1 if item._parent is None else item._parent.row()
+            rows.append([parent_row, item.row()])
+        data = QMimeData()
+        data.setData(self.MIME_TYPE, QByteArray(json.dumps(rows).encode("utf-8")))
+        return data
+
+    def _items_from_mime_data(self, data: QMimeData):
+        items = []
+        for parent_row, row in json.loads(bytes(data.data(self.MIME_TYPE)).decode()):
+            children = self._children(
+                None if parent_row < 0 else self.items[parent_row]
+            )
+            items.append(children[row])
+        # an album's songs move with it
+        selected = set(map(id, items))
+        return [item for item in items if id(item._parent) not in selected]
 
     def dropMimeData(self, data, action, row, column, parent):
-        # If album dropped onto another album, don't insert
-        if parent.isValid():
-            dummy_model = QStandardItemModel()
-            dummy_model.dropMimeData(data, action, 0, 0, QModelIndex())
-            indexes = []
-            for r in range(dummy_model.rowCount()):
-                for c in range(dummy_model.columnCount()):
-                    index = dummy_model.index(r, c)
-                    # QStandardItemModel doesn't recognize our items as our custom classes
-                    # so we have to treat them as QStandardItems
-                    item = dummy_model.item(r, c)
-                    if item.data(CustomDataRole.ITEMTYPE) == TreeWidgetType.ALBUM:
-                        pass
-                    elif item.data(CustomDataRole.ITEMTYPE) == TreeWidgetType.SONG:
-                        indexes.append(index)
-            data = dummy_model.mimeData(indexes)
-        ret = super().dropMimeData(data, action, row, column, parent)
-        return ret
+        if action != Qt.MoveAction or not data.hasFormat(self.MIME_TYPE):
+            return False
+        parent_item = self.item_from_index(parent)
+        if parent_item is not None and parent_item.item_type() != TreeWidgetType.ALBUM:
+            return False
+        items = self._items_from_mime_data(data)
+        if parent_item is not None:
+            # If album dropped onto another album, don't insert
+            items = [item for item in items if item.item_type() == TreeWidgetType.SONG]
+        if row < 0:
+            row = len(self._children(parent_item))
+        for item in items:
+            row = self.move_item(item, parent_item, row)
+        # the rows were moved here, so the view must not remove
+        # the dragged rows as it does after other move drops
+        return False
 
 
 class SongTreeSelectionModel(QItemSelectionModel):
@@ -94,6 +236,8 @@ class SongTreeWidget(QTreeView):
         self.setSelectionModel(SongTreeSelectionModel(self.model()))
         self.setSelectionMode(QAbstractItemView.ExtendedSelection)
         self.setSizeAdjustPolicy(QAbstractScrollArea.SizeAdjustPolicy.AdjustIgnored)
+        # lets the view lay out many rows without asking each one for its height
+        self.setUniformRowHeights(True)
 
         self.setContextMenuPolicy(Qt.CustomContextMenu)
         self.customContextMenuRequested.connect(self.on_context_menu)
@@ -107,18 +251,11 @@ class SongTreeWidget(QTreeView):
     def _create_album_item(self, dir_path, songs):
         return AlbumTreeWidgetItem(dir_path, songs)
 
-    def _create_song_item(self, file_path):
-        return SongTreeWidgetItem(file_path)
+    def _create_song_item(self, file_path, song_info=None):
+        return SongTreeWidgetItem(file_path, song_info=song_info)
 
     def _get_all_items(self):
-        for row in range(self.model().rowCount()):
-            item = self.model().item(row)
-            if item.data(CustomDataRole.ITEMTYPE) == TreeWidgetType.ALBUM:
-                item = AlbumTreeWidgetItem.from_standard_item(item)
-                yield item
-            elif item.data(CustomDataRole.ITEMTYPE) == TreeWidgetType.SONG:
-                item = SongTreeWidgetItem.from_standard_item(item)
-                yield item
+        yield from list(self.model().top_level_items())
 
     def _get_all_items_flat(self):
         for item in self._get_all_items():
@@ -197,6 +334,7 @@ class SongTreeWidget(QTreeView):
         if event.source():
             super().dropEvent(event)
         else:
+            albums, directories, files = [], [], []
             for url in event.mimeData().urls():
                 info = QFileInfo(url.toLocalFile())
                 if not info.isReadable():
@@ -207,62 +345,59 @@ class SongTreeWidget(QTreeView):
                         get_setting("dragAndDropBehavior")
                         == SETTINGS_VALUES.DragAndDrop.ALBUM_MODE
                     ):
-                        self.addAlbum(url.toLocalFile())
+                        albums.append(url.toLocalFile())
                     else:
-                        for file_path in files_in_directory_and_subdirectories(
-                            info.filePath()
-                        ):
-                            self.addSong(file_path)
+                        directories.append(info.filePath())
                 else:
-                    self.addSong(info.filePath())
+                    files.append(info.filePath())
+            self.scan(albums, directories, files)
+
+    def scan(self, albums=(), directories=(), files=()):
+        """Adds the songs in the given albums, directories and files,
+        loading them in the background"""
+        scanner = LibraryScanner(self)
+        dialog = QProgressDialog("Adding songs...", "Cancel", 0, 0, self)
+        dialog.setWindowTitle("Adding songs")
+        # only shown if adding the songs takes a while
+        dialog.setMinimumDuration(1000)
+        dialog.setValue(0)
+        dialog.canceled.connect(scanner.cancel)
+        scanner.loaded.connect(self.add_scanned)
+        scanner.progress.connect(
+            lambda done, found: (dialog.setMaximum(found), dialog.setValue(done))
+        )
+        scanner.finished.connect(dialog.reset)
+        scanner.finished.connect(scanner.deleteLater)
+        scanner.finished.connect(dialog.deleteLater)
+        scanner.scan(albums, directories, files)
+        return scanner
+
+    def add_scanned(self, groups):
+        for group, songs in groups:
+            items = []
+            for path, song_info in songs:
+                item = self._create_song_item(path, song_info)
+                item.setText(QFileInfo(path).fileName())
+                items.append(item)
+            if group.dir_path is None:
+                for item in items:
+                    self.addTopLevelItem(item)
+            else:
+                album_item = self._create_album_item(group.dir_path, items)
+                album_item.setText(group.dir_path)
+                self.addTopLevelItem(album_item)
+
+    def addAlbums(self, dir_paths):
+        self.scan(albums=dir_paths)
+
+    def addSongs(self, paths):
+        self.scan(files=paths)
 
     def addAlbum(self, dir_path: str):
-        songs = []
-        for file_path in files_in_directory(dir_path):
-            if os.name == "nt" and len(file_path) > 255:
-                file_path = get_short_path_name(file_path)
-            info = QFileInfo(file_path)
-            if not info.isReadable():
-                logger.warning("File {} is not readable".format(file_path))
-                continue
-            if info.isDir():
-                self.addAlbum(file_path)
-            elif file_is_audio(file_path):
-                item = self._create_song_item(file_path)
-                item.setText(info.fileName())
-                songs.append(item)
-        if len(songs) > 0:
-            album_item = self._create_album_item(dir_path, songs)
-            album_item.setText(dir_path)
-            self.addTopLevelItem(album_item)
+        self.addAlbums([dir_path])
 
     def addSong(self, path: str):
-        if os.name == "nt" and len(path) > 255:
-            path = get_short_path_name(path)
-        if not file_is_audio(path):
-            logger.info("File {} is not audio".format(path))
-            return
-        item = self._create_song_item(path)
-        item.setText(QFileInfo(path).fileName())
-        self.addTopLevelItem(item)
-
-    def get_renderer(self):
-        renderer = Renderer()
-        for item in self._get_all_items():
-            if item.data(CustomDataRole.ITEMTYPE) == TreeWidgetType.ALBUM:
-                renderer.add_render_album_job(item)
-            elif item.data(CustomDataRole.ITEMTYPE) == TreeWidgetType.SONG:
-                renderer.add_render_song_job(item)
-        return renderer
-
-    def get_uploader(self, render_results):
-        uploader = Uploader(render_results)
-        for row in range(self.model().rowCount()):
-            item = self.model().item(row)
-            if item.data(CustomDataRole.ITEMTYPE) == TreeWidgetType.ALBUM:
-                item = AlbumTreeWidgetItem.from_standard_item(item)
-                uploader.add_upload_album_job(item)
-            elif item.data(CustomDataRole.ITEMTYPE) == TreeWidgetType.SONG:
-                item = SongTreeWidgetItem.from_standard_item(item)
-                uploader.add_upload_song_job(item)
-        return uploader
+        self.addSongs([path])
+
+    def get_pipeline(self, resume=False):
+        return RenderUploadPipeline(self._get_all_items(), resume=resume)
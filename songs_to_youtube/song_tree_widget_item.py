@@ -2,27 +2,102 @@ import logging
 import os
 import posixpath
 
-from PySide6.QtCore import QFileInfo, QStandardPaths
-from PySide6.QtGui import QStandardItem
+from PySide6.QtCore import QFileInfo, QModelIndex, QStandardPaths, Qt
 
 from songs_to_youtube.const import *
+from songs_to_youtube.cover_art import add_cover_source, cover_art_path
+from songs_to_youtube.directory_index import get_directory_index
 from songs_to_youtube.field import *
+from songs_to_youtube.job_store import MergedValues, StoreRow, get_store
 from songs_to_youtube.metadata import Metadata
 from songs_to_youtube.settings import *
-from songs_to_youtube.template import SettingTemplate
+from songs_to_youtube.template import compile_template
 from songs_to_youtube.utils import *
 
 logger = logging.getLogger(APPLICATION)
 
 
+def read_command(command_type: str, command_name: str):
+    """Returns the contents of the given .command file, looking in
+    the bundled commands first and the user's commands second"""
+    command_path = resource_path(
+        posixpath.join("commands", command_type, command_name + ".command")
+    )
+    if not os.path.exists(command_path):
+        appdata_path = QStandardPaths.writableLocation(QStandardPaths.AppDataLocation)
+        command_path = posixpath.join(
+            appdata_path, "commands", command_type, command_name + ".command"
+        )
+    try:
+        with open(command_path, "r") as f:
+            return f.read().strip()
+    except:
+        raise Exception(f"Could not read command from {command_path}")
+
+
+def find_cover_art(metadata: Metadata, song_dir, song_file):
+    """Returns the path of the song's cover art, either a cover file next
+    to it or where its embedded art is extracted to when it is needed"""
+    try:
+        cover_file = get_directory_index(song_dir).find_cover_file(song_file)
+        if cover_file:
+            logger.info(f"Found cover file {cover_file}")
+
+        if (
+            get_setting("preferCoverArtFile") == SETTINGS_VALUES.CheckBox.CHECKED
+            and cover_file
+        ):
+            return cover_file
+        elif get_setting("extractCoverArt") == SETTINGS_VALUES.CheckBox.CHECKED:
+            if metadata.cover_digest is not None:
+                return cover_art_path(metadata.cover_digest)
+            elif cover_file:
+                return cover_file
+
+    except Exception as e:
+        logger.warning("Error while getting cover art")
+        logger.warning(e)
+        logger.warning(posixpath.join(song_dir, song_file))
+    return None
+
+
+class SongInfo:
+    """The metadata and cover art of a song. Loading it is the slow part of
+    creating a song item, so it can be done in another thread or process
+    and passed to SongTreeWidgetItem"""
+
+    def __init__(self, song_path):
+        info = QFileInfo(song_path)
+        self.metadata = Metadata(song_path)
+        self.cover_art = find_cover_art(self.metadata, info.path(), info.fileName())
+
+
 class TreeWidgetItemData:
-    def __init__(self, item_type, songs=None, **kwargs):
-        # metadata values
-        self.metadata = None
+    __slots__ = ("tags", "dict", "values", "references", "outdated", "cover_source")
+
+    def __init__(self, item_type, songs=None, song_info=None, **kwargs):
+        # metadata values, None for albums
+        self.tags = None
 
         # application values
         # always strings
-        self.dict = {}
+        self.dict = StoreRow(
+            get_store(
+                "song fields" if item_type == TreeWidgetType.SONG else "album fields"
+            )
+        )
+
+        # fields and metadata tags merged, tags win if a field has the same name
+        self.values = MergedValues(self.dict)
+
+        # field -> keys its value's placeholders reference
+        self.references = {}
+        # fields which reference a key that changed since
+        # they were last substituted, see update_fields
+        self.outdated = set()
+        # keeps the embedded cover art readable, see cover_art.add_cover_source
+        self.cover_source = None
+
         app_fields = (
             InputField.SONG_FIELDS
             if item_type == TreeWidgetType.SONG
@@ -44,45 +119,18 @@ class TreeWidgetItemData:
 
         # add song metadata
         if item_type == TreeWidgetType.SONG:
-            try:
-                self.metadata = Metadata(self.dict["song_path"])
-
-                cover_exts = {".jpg", ".jpeg", ".bmp", ".gif", ".png"}
-                cover_names = {
-                    "cover",
-                    "folder",
-                    "front",
-                    os.path.splitext(self.dict["song_file"])[0],
-                }
-                cover_file = None
-                for file in os.listdir(self.dict["song_dir"]):
-                    path = posixpath.join(self.dict["song_dir"], file)
-                    name, ext = os.path.splitext(file)
-                    if (
-                        os.path.isfile(path)
-                        and name.lower() in cover_names
-                        and ext.lower() in cover_exts
-                    ):
-                        logger.info(f"Found cover file {path}")
-                        cover_file = path
-                        break
-
-                if (
-                    get_setting("preferCoverArtFile")
-                    == SETTINGS_VALUES.CheckBox.CHECKED
-                    and cover_file
-                ):
-                    self.set_value("coverArt", cover_file)
-                elif get_setting("extractCoverArt") == SETTINGS_VALUES.CheckBox.CHECKED:
-                    if (cover_path := self.metadata.get_cover_art()) is not None:
-                        self.set_value("coverArt", cover_path)
-                    elif cover_file:
-                        self.set_value("coverArt", cover_file)
-
-            except Exception as e:
-                logger.warning("Error while getting cover art")
-                logger.warning(e)
-                logger.warning(self.dict["song_path"])
+            if song_info is None:
+                song_info = SongInfo(self.dict["song_path"])
+            metadata = song_info.metadata
+            self.tags = self.values.tags = StoreRow(
+                get_store("song tags"), metadata.get_tags()
+            )
+            if metadata.cover_digest is not None:
+                self.cover_source = add_cover_source(
+                    metadata.cover_digest, metadata.path
+                )
+            if song_info.cover_art is not None:
+                self.set_value("coverArt", song_info.cover_art)
         else:
             # album gets metadata from children
             # song metadata is stored as song.<key>
@@ -98,35 +146,58 @@ class TreeWidgetItemData:
                     self.dict[key] = value
                 break
 
+        self.outdated.update(self.dict)
         self.update_fields()
 
     def update_fields(self):
-        for field, value in self.dict.items():
-            self.set_value(field, value)
+        """Substitutes the fields which reference keys that changed since they
+        were last substituted, in order, so fields see the new values of the
+        fields before them"""
+        for field in list(self.dict):
+            if field in self.outdated:
+                self.set_value(field, self.dict[field])
 
     def to_dict(self):
-        dict = {
-            **self.dict,
-            **(self.metadata.get_tags() if self.metadata is not None else {}),
-        }
-        return dict
+        return self.values.to_dict()
 
     def get_value(self, field):
         return self.dict[field]
 
     def get_metadata_value(self, key):
-        if key in self.metadata.get_tags():
-            return self.metadata.get_tags()[key]
+        if key in self.tags:
+            return self.tags[key]
         return None
 
     def set_value(self, field, value):
         # replace {variable} with value from metadata
-        value = SettingTemplate(value).safe_substitute(**self.to_dict())
+        self._store(field, compile_template(value).substitute(self.values))
+
+    def set_values(self, values: dict):
+        """Sets the fields to the given values as they are, without substituting them"""
+        for field, value in values.items():
+            self._store(field, value)
+
+    def _store(self, field, value):
+        changed = self.dict.get(field) != value
         self.dict[field] = value
+        self.outdated.discard(field)
+        self._track_references(field, value)
+        if changed:
+            for dependent, keys in self.references.items():
+                if field in keys:
+                    self.outdated.add(dependent)
+
+    def _track_references(self, field, value):
+        # the keys are shared by all values with the same template
+        keys = () if "~" not in value else compile_template(value).keys
+        if keys:
+            self.references[field] = keys
+        else:
+            self.references.pop(field, None)
 
     def get_duration_ms(self):
-        if "length" in self.metadata.get_tags():
-            duration = float(self.metadata.get_tags()["length"]) * 1000
+        if "length" in self.tags:
+            duration = float(self.tags["length"]) * 1000
             logger.debug(f"Duration (ms): {duration}")
             return duration
         else:
@@ -135,18 +206,16 @@ class TreeWidgetItemData:
             )
 
     def get_track_number(self):
-        if "tracknumber" in self.metadata.get_tags():
+        if "tracknumber" in self.tags:
             try:
-                tracknumber = self.metadata.get_tags()["tracknumber"]
+                tracknumber = self.tags["tracknumber"]
                 if "/" in tracknumber:
                     # sometimes track number is represented as a fraction
                     tracknumber = tracknumber[: tracknumber.index("/")]
                 return int(tracknumber)
             except:
                 logger.warning(
-                    "Could not convert {} to int".format(
-                        self.metadata.get_tags()["tracknumber"]
-                    )
+                    "Could not convert {} to int".format(self.tags["tracknumber"])
                 )
                 return 0
         return 0
@@ -155,39 +224,159 @@ class TreeWidgetItemData:
         return str(self.dict)
 
 
-class SongTreeWidgetItem(QStandardItem):
-    def __init__(self, file_path, *args):
-        super().__init__(*args)
-        self.setFlags(Qt.ItemIsSelectable | Qt.ItemIsEnabled | Qt.ItemIsDragEnabled)
-        self.setData(TreeWidgetType.SONG, CustomDataRole.ITEMTYPE)
+def timestamp_values(start):
+    """Returns the timestamp keys of a song which starts start seconds in"""
+    hours, minutes, seconds = (
+        int(start // 3600),
+        int((start // 60) % 60),
+        int(start) % 60,
+    )
+    return {
+        r"%H": str(hours),
+        r"%M": str(minutes),
+        r"%S": str(seconds),
+        r"%0H": f"{hours:02}",
+        r"%0M": f"{minutes:02}",
+        r"%0S": f"{seconds:02}",
+    }
+
+
+def album_timestamps(songs, format_string):
+    """Returns the timestamps of an album's songs, one line per song. Each
+    song gets the timestamp keys for when it starts (%H, %0M, ...) and its
+    timestamp: format_string substituted with them and the song's values"""
+    template = compile_template(format_string)
+    lines = []
+    start = 0
+    for song in songs:
+        song.set_values(timestamp_values(start))
+        timestamp = template.substitute(song.values)
+        song.set_values({"timestamp": timestamp})
+        lines.append(timestamp + "\n")
+        start += song.get_duration_ms() / 1000
+    return "".join(lines)
+
+
+class TreeItem:
+    """A row of SongTreeModel. What the row shows is kept here, its values
+    in the TreeWidgetItemData returned for CustomDataRole.ITEMDATA"""
+
+    __slots__ = ("_text", "_flags", "_data", "_parent", "_children", "_row", "_model")
+
+    ITEM_TYPE = None
+
+    def __init__(self, data: TreeWidgetItemData, flags: Qt.ItemFlags):
+        self._text = ""
+        self._flags = flags
+        self._data = data
+        # album this item is in, None for top level items
+        self._parent = None
+        self._children = ()
+        # last known row, see row()
+        self._row = 0
+        # SongTreeModel this item was added to
+        self._model = None
+
+    def data(self, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole:
+            return self._text
+        if role == CustomDataRole.ITEMDATA:
+            return self._data
+        if role == CustomDataRole.ITEMTYPE:
+            return self.ITEM_TYPE
+        return None
+
+    def text(self):
+        return self._text
+
+    def setText(self, text):
+        self._text = text
+        if self._model is not None:
+            self._model.item_changed(self)
+
+    def flags(self):
+        return self._flags
+
+    def setFlags(self, flags):
+        self._flags = flags
+        if self._model is not None:
+            self._model.item_changed(self)
+
+    def item_type(self):
+        return self.ITEM_TYPE
+
+    def model(self):
+        return self._model
+
+    def parent(self):
+        return self._parent
+
+    def siblings(self):
+        if self._parent is not None:
+            return self._parent._children
+        if self._model is not None:
+            return self._model.top_level_items()
+        return None
+
+    def row(self):
+        """Returns the item's row in its album or model, or -1 if it is in neither"""
+        siblings = self.siblings()
+        if siblings is None:
+            return -1
+        if self._row >= len(siblings) or siblings[self._row] is not self:
+            # rows before this one were added or removed
+            # since, number all of the siblings again
+            for row, sibling in enumerate(siblings):
+                sibling._row = row
+        return self._row
+
+    def index(self):
+        if self._model is None:
+            return QModelIndex()
+        return self._model.index_of(self)
+
+    def rowCount(self):
+        return len(self._children)
+
+    def child(self, row):
+        return self._children[row]
+
+    def get(self, field):
+        return self._data.get_value(field)
+
+    def set(self, field, value):
+        self._data.set_value(field, value)
+
+    def to_dict(self):
+        return self._data.to_dict()
+
+
+class SongTreeWidgetItem(TreeItem):
+    __slots__ = ()
+
+    ITEM_TYPE = TreeWidgetType.SONG
+
+    def __init__(self, file_path, song_info: SongInfo = None):
         info = QFileInfo(file_path)
-        self.setData(
+        super().__init__(
             TreeWidgetItemData(
                 TreeWidgetType.SONG,
                 song_path=file_path,
                 song_dir=info.path(),
                 song_file=info.fileName(),
+                song_info=song_info,
             ),
-            CustomDataRole.ITEMDATA,
+            Qt.ItemIsSelectable
+            | Qt.ItemIsEnabled
+            | Qt.ItemIsDragEnabled
+            | Qt.ItemNeverHasChildren,
         )
         # set acodec to copy by default,
         # overridden when concatenating
         self.set("audioCodec", "copy")
 
-    def get(self, field):
-        return self.data(CustomDataRole.ITEMDATA).get_value(field)
-
-    def set(self, field, value):
-        self.data(CustomDataRole.ITEMDATA).set_value(field, value)
-
-    def to_dict(self):
-        return self.data(CustomDataRole.ITEMDATA).to_dict()
-
-    def item_type(self):
-        return self.data(CustomDataRole.ITEMTYPE)
-
     def get_duration_ms(self):
-        return self.data(CustomDataRole.ITEMDATA).get_duration_ms()
+        return self._data.get_duration_ms()
 
     def before_render(self):
         self.set(
@@ -195,126 +384,72 @@ class SongTreeWidgetItem(QStandardItem):
             posixpath.join(self.get("fileOutputDir"), self.get("fileOutputName")),
         )
         self.set("songDuration", str(self.get_duration_ms() / 1000))
-        command_path = resource_path(
-            posixpath.join("commands", "render", self.get("commandName") + ".command")
-        )
-        if not os.path.exists(command_path):
-            appdata_path = QStandardPaths.writableLocation(
-                QStandardPaths.AppDataLocation
-            )
-            command_path = posixpath.join(
-                appdata_path, "commands", "render", self.get("commandName") + ".command"
-            )
-        try:
-            with open(command_path, "r") as f:
-                command = f.read().strip()
-                self.set("commandString", command)
-        except:
-            raise Exception(f"Could not read command from {command_path}")
+        self.set("commandString", read_command("render", self.get("commandName")))
 
     def before_upload(self):
         pass
 
     def get_track_number(self):
-        return self.data(CustomDataRole.ITEMDATA).get_track_number()
+        return self._data.get_track_number()
 
-    @classmethod
-    def from_standard_item(cls, item: QStandardItem):
-        for name, value in cls.__dict__.items():
-            if callable(value) and name != "__init__":
-                bound = value.__get__(item)
-                setattr(item, name, bound)
-        return item
 
+class AlbumTreeWidgetItem(TreeItem):
+    __slots__ = ()
 
-class AlbumTreeWidgetItem(QStandardItem):
-    def __init__(self, dir_path, songs, *args):
-        super().__init__(*args)
-        self.setFlags(
-            Qt.ItemIsSelectable
-            | Qt.ItemIsEnabled
-            | Qt.ItemIsDragEnabled
-            | Qt.ItemIsDropEnabled
-        )
-        self.setData(TreeWidgetType.ALBUM, CustomDataRole.ITEMTYPE)
+    ITEM_TYPE = TreeWidgetType.ALBUM
 
+    def __init__(self, dir_path, songs):
         # order songs by tracknumber if possible
         songs.sort(key=lambda song: song.get_track_number())
 
-        self.setData(
+        super().__init__(
             TreeWidgetItemData(TreeWidgetType.ALBUM, songs, album_dir=dir_path),
-            CustomDataRole.ITEMDATA,
+            Qt.ItemIsSelectable
+            | Qt.ItemIsEnabled
+            | Qt.ItemIsDragEnabled
+            | Qt.ItemIsDropEnabled,
         )
+        self._children = []
 
         for song in songs:
             self.addChild(song)
 
-    def get(self, field):
-        return self.data(CustomDataRole.ITEMDATA).get_value(field)
-
-    def set(self, field, value):
-        self.data(CustomDataRole.ITEMDATA).set_value(field, value)
-
-    def item_type(self):
-        return self.data(CustomDataRole.ITEMTYPE)
-
     def addChild(self, item):
-        self.appendRow(item)
+        self.insertChild(len(self._children), item)
+
+    def insertChild(self, row, item):
+        if self._model is not None:
+            self._model.insert_items(self, row, [item])
+            return
+        item._parent = self
+        self._children.insert(row, item)
 
     def childCount(self):
-        return self.rowCount()
+        return len(self._children)
 
     def getChildren(self):
-        for i in range(self.childCount()):
-            yield SongTreeWidgetItem.from_standard_item(self.child(i))
-
-    @staticmethod
-    def getChildrenFromStandardItem(item: QStandardItem):
-        for i in range(item.rowCount()):
-            yield item.child(i)
-
-    @classmethod
-    def from_standard_item(cls, item: QStandardItem):
-        for name, value in cls.__dict__.items():
-            if callable(value) and name != "__init__":
-                bound = value.__get__(item)
-                setattr(item, name, bound)
-        return item
+        yield from self._children
 
     def get_duration_ms(self):
         return sum(song.get_duration_ms() for song in self.getChildren())
 
     def before_render(self):
-        self.data(CustomDataRole.ITEMDATA).set_value(
-            "albumDuration", str(self.get_duration_ms() / 1000)
-        )
-        self.data(CustomDataRole.ITEMDATA).set_value(
+        self.set("albumDuration", str(self.get_duration_ms() / 1000))
+        self.set(
             "fileOutput",
             posixpath.join(
                 self.get("fileOutputDirAlbum"), self.get("fileOutputNameAlbum")
             ),
         )
-        command_path = resource_path(
-            posixpath.join(
-                "commands", "concat", self.get("concatCommandName") + ".command"
+        if self.get("albumPlaylist") == SETTINGS_VALUES.AlbumPlaylist.SINGLE_PASS:
+            self.set(
+                "albumCommandString", read_command("album", self.get("albumCommandName"))
             )
+            return
+        self.set(
+            "concatCommandString",
+            read_command("concat", self.get("concatCommandName")),
         )
-        if not os.path.exists(command_path):
-            appdata_path = QStandardPaths.writableLocation(
-                QStandardPaths.AppDataLocation
-            )
-            command_path = posixpath.join(
-                appdata_path,
-                "commands",
-                "concat",
-                self.get("concatCommandName") + ".command",
-            )
-        try:
-            with open(command_path, "r") as f:
-                command = f.read().strip()
-                self.set("concatCommandString", command)
-        except:
-            raise Exception(f"Could not read command from {command_path}")
 
         if self.get("albumPlaylist") == SETTINGS_VALUES.AlbumPlaylist.SINGLE:
             # override song audio codec output to 24 bit FLAC
@@ -323,26 +458,8 @@ class AlbumTreeWidgetItem(QStandardItem):
                 song.set("audioCodec", "flac -sample_fmt s32")
 
     def before_upload(self):
-        # generate timestamps
-        data = self.data(CustomDataRole.ITEMDATA)
-        timestamp = 0
-        timestamp_str = ""
-        for song in self.getChildren():
-            format_string = get_setting("timestampFormat")
-            # create h/m/s keys
-            hours, minutes, seconds = (
-                int(timestamp // 3600),
-                int((timestamp // 60) % 60),
-                int(timestamp) % 60,
-            )
-            song.set(r"%H", str(hours))
-            song.set(r"%M", str(minutes))
-            song.set(r"%S", str(seconds))
-            song.set(r"%0H", f"{hours:02}")
-            song.set(r"%0M", f"{minutes:02}")
-            song.set(r"%0S", f"{seconds:02}")
-            song.set("timestamp", format_string)
-            timestamp_str += song.get("timestamp") + "\n"
-            timestamp += song.get_duration_ms() / 1000
-        data.set_value("timestamps", timestamp_str)
-        data.update_fields()
+        songs = [song.data(CustomDataRole.ITEMDATA) for song in self.getChildren()]
+        self._data.set_value(
+            "timestamps", album_timestamps(songs, get_setting("timestampFormat"))
+        )
+        self._data.update_fields()
@@ -1,8 +1,14 @@
+from functools import lru_cache
 from string import Template
 
 from pathvalidate import sanitize_filename
 
 
+@lru_cache(maxsize=4096)
+def filename_safe(value: str):
+    return sanitize_filename(value)
+
+
 class SettingTemplate(Template):
     # template placeholders are of the form
     # ~{key}
@@ -15,30 +21,96 @@ class SettingTemplate(Template):
     # key can be anything without braces
     braceidpattern = r"[^{}]*"
 
-    def safe_substitute(self, /, **kws):
-        mapping = kws
-        # Helper function for .sub()
-        def convert(mo):
+    def safe_substitute(self, mapping=None, /, **kws):
+        if mapping is None:
+            mapping = kws
+        elif kws:
+            mapping = {**mapping, **kws}
+        return compile_template(self.template).substitute(mapping)
+
+
+class Placeholder:
+    """A placeholder of the form ~{key|"literal"|<key>|...}. The first
+    key which is in the mapping gives the value, a "literal" gives itself
+    and a <key> gives the key's value made filename-safe, or INVALID if
+    the key is not in the mapping. If nothing matches the placeholder is
+    left as it is"""
+
+    def __init__(self, text, named):
+        self.text = text
+        # (arg, literal or None, sanitized key or None)
+        self.args = []
+        # keys whose values the placeholder depends on
+        self.keys = set()
+        for arg in named.split("|"):
+            literal = sanitized = None
+            if len(arg) >= 2 and arg[0] == '"' and arg[-1] == '"':
+                literal = arg[1:-1]
+            elif len(arg) >= 2 and arg[0] == "<" and arg[-1] == ">":
+                sanitized = arg[1:-1]
+                self.keys.add(sanitized)
+            self.args.append((arg, literal, sanitized))
+            self.keys.add(arg)
+            if literal is not None or sanitized is not None:
+                # the args after this one are never used
+                break
+
+    def substitute(self, mapping):
+        for arg, literal, sanitized in self.args:
+            if arg in mapping:
+                return str(mapping[arg])
+            elif literal is not None:
+                return literal
+            elif sanitized is not None:
+                if sanitized in mapping:
+                    return filename_safe(str(mapping[sanitized]))
+                return "INVALID"
+        return self.text
+
+
+class CompiledTemplate:
+    """A template split into text and placeholders once, so substituting
+    it does no parsing"""
+
+    def __init__(self, template):
+        # str or Placeholder
+        self.parts = []
+        text = []
+        position = 0
+        for mo in SettingTemplate.pattern.finditer(template):
+            text.append(template[position : mo.start()])
+            position = mo.end()
             named = mo.group("named") or mo.group("braced")
             if named is not None:
-                for arg in named.split("|"):
-                    if arg in mapping:
-                        return str(mapping[arg])
-                    elif len(arg) >= 2 and arg[0] == '"' and arg[-1] == '"':
-                        # string literal
-                        return arg[1:-1]
-                    elif len(arg) >= 2 and arg[0] == "<" and arg[-1] == ">":
-                        # make value filename-safe
-                        arg = arg[1:-1]
-                        if arg in mapping:
-                            return sanitize_filename(str(mapping[arg]))
-                        else:
-                            return "INVALID"
-                return mo.group()
-            if mo.group("escaped") is not None:
-                return self.delimiter
-            if mo.group("invalid") is not None:
-                return mo.group()
-            raise ValueError("Unrecognized named group in pattern", self.pattern)
-
-        return self.pattern.sub(convert, self.template)
+                if text:
+                    self.parts.append("".join(text))
+                    text = []
+                self.parts.append(Placeholder(mo.group(), named))
+            elif mo.group("escaped") is not None:
+                text.append(SettingTemplate.delimiter)
+            else:
+                # invalid placeholders are left as they are
+                text.append(mo.group())
+        text.append(template[position:])
+        if "".join(text):
+            self.parts.append("".join(text))
+        # keys whose values the result depends on
+        self.keys = frozenset(
+            key
+            for part in self.parts
+            if isinstance(part, Placeholder)
+            for key in part.keys
+        )
+
+    def substitute(self, mapping):
+        return "".join(
+            [
+                part if part.__class__ is str else part.substitute(mapping)
+                for part in self.parts
+            ]
+        )
+
+
+@lru_cache(maxsize=4096)
+def compile_template(template: str):
+    return CompiledTemplate(template)
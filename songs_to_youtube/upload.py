@@ -1,18 +1,25 @@
 import glob
 import json
 import logging
+import os
+import threading
 import time
 import traceback
 from http.cookiejar import Cookie, FileCookieJar, MozillaCookieJar
+from queue import Queue
 from typing import List, Tuple
 
+import requests
+
 from PySide6.QtCore import *
 from youtube_up import Metadata as YTMetadata
 from youtube_up import Playlist as YTPlaylist
 from youtube_up import YTUploaderSession
+from youtube_up.uploader import YTUploaderException
 
 from songs_to_youtube.const import *
 from songs_to_youtube.field import SETTINGS_VALUES
+from songs_to_youtube.journal import JobJournal
 from songs_to_youtube.settings import get_setting
 from songs_to_youtube.song_tree_widget_item import *
 
@@ -119,6 +126,207 @@ def get_cookie_jar_for_username(username: str) -> FileCookieJar:
         )
 
 
+class PlaylistRegistry:
+    """Playlists created by the upload sessions of a run. Sessions check it
+    before creating a playlist, so videos uploaded at the same time to a
+    playlist which does not exist yet don't each create their own copy"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # title -> playlist id
+        self.created = {}
+
+
+class UploadSession(YTUploaderSession):
+    """Uploads files in chunks with the resumable upload protocol. The
+    upload URL and the last confirmed offset of each video are kept in the
+    journal, so after a dropped connection, or a restart, the upload
+    continues from the last chunk the server confirmed"""
+
+    CHUNK_SIZE = 16 * 1024 * 1024
+    # attempts per chunk before the upload fails
+    RETRIES = 6
+    MAX_BACKOFF = 60
+    RETRY_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+    # the saved upload URL is no longer valid, the upload has to start over
+    EXPIRED_STATUS_CODES = {404, 410}
+    TIMEOUT = 60
+
+    def __init__(self, cookie_jar, playlists: PlaylistRegistry, journal=None):
+        super().__init__(cookie_jar)
+        self.playlists = playlists
+        self.journal = journal or JobJournal()
+        self.file_path = None
+        # session data of the video being uploaded, and whether its upload
+        # URL was saved by an earlier run
+        self.data = None
+        self.resumed = False
+
+    def upload(self, file_path, metadata, progress_callback=lambda step, percent: None):
+        self.file_path = file_path
+        try:
+            video_id = super().upload(file_path, metadata, progress_callback)
+        finally:
+            self.file_path = None
+            self.data = None
+            self.resumed = False
+        self.journal.forget_upload(file_path)
+        return video_id
+
+    def _get_video_upload_url(self, data):
+        self.data = data
+        saved = self.journal.get_upload(self.file_path)
+        self.resumed = saved is not None
+        if saved is not None:
+            upload_url, data.front_end_upload_id, offset = saved
+            logger.info(f"Resuming upload of {self.file_path} from byte {offset}")
+            return upload_url
+        return self._new_video_upload_url(data)
+
+    def _new_video_upload_url(self, data):
+        upload_url = super()._get_video_upload_url(data)
+        self.journal.save_upload(self.file_path, upload_url, data.front_end_upload_id)
+        return upload_url
+
+    def _query_offset(self, upload_url):
+        """Asks the server how many bytes it has. Returns (offset, response),
+        where response is the final response if the upload is complete"""
+        r = self._session.post(
+            upload_url,
+            headers={"x-goog-upload-command": "query"},
+            timeout=self.TIMEOUT,
+        )
+        r.raise_for_status()
+        if r.headers.get("x-goog-upload-status") == "final":
+            return None, r
+        return int(r.headers.get("x-goog-upload-size-received", 0)), None
+
+    def _is_transient(self, error):
+        if isinstance(error, requests.HTTPError):
+            return error.response.status_code in self.RETRY_STATUS_CODES
+        return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+    def _has_expired(self, error):
+        return (
+            isinstance(error, requests.HTTPError)
+            and error.response is not None
+            and error.response.status_code in self.EXPIRED_STATUS_CODES
+        )
+
+    def _upload_file(
+        self,
+        upload_url,
+        file_path,
+        progress_callback,
+        prev_progress_step,
+        cur_progress_step,
+    ):
+        # the video's upload may have been started before, thumbnails never are
+        resumable = file_path == self.file_path
+        # a saved upload URL may have expired since, it is replaced once
+        resumed = resumable and self.resumed
+        start_prog = self._progress_steps[prev_progress_step]
+        end_prog = self._progress_steps[cur_progress_step]
+        with open(file_path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            # None: ask the server where to continue
+            offset = None if resumable else 0
+            final = None
+            attempt = 0
+            while final is None:
+                try:
+                    if offset is None:
+                        offset, final = self._query_offset(upload_url)
+                        if final is not None:
+                            break
+                    f.seek(offset)
+                    chunk = f.read(self.CHUNK_SIZE)
+                    last = offset + len(chunk) >= size
+                    headers = {
+                        "x-goog-upload-command": "upload, finalize" if last else "upload",
+                        "x-goog-upload-offset": str(offset),
+                    }
+                    r = self._session.post(
+                        upload_url, headers=headers, data=chunk, timeout=self.TIMEOUT
+                    )
+                    r.raise_for_status()
+                except Exception as e:
+                    if resumed and self._has_expired(e):
+                        resumed = False
+                        logger.warning(
+                            f"Upload URL of {file_path} has expired ({e}), "
+                            "starting the upload over"
+                        )
+                        self.journal.forget_upload(file_path)
+                        upload_url = self._new_video_upload_url(self.data)
+                        offset = 0
+                        attempt = 0
+                        continue
+                    attempt += 1
+                    if not self._is_transient(e) or attempt >= self.RETRIES:
+                        if resumable and isinstance(e, requests.HTTPError):
+                            # the upload URL expired or was rejected, start over next time
+                            self.journal.forget_upload(file_path)
+                        raise
+                    backoff = min(self.MAX_BACKOFF, 2**attempt)
+                    logger.warning(
+                        f"Upload of {file_path} interrupted ({e}), "
+                        f"retrying in {backoff} seconds"
+                    )
+                    time.sleep(backoff)
+                    # the server may have kept more or less than the last chunk
+                    offset = None
+                    continue
+                attempt = 0
+                if last:
+                    final = r
+                    offset = size
+                else:
+                    offset += len(chunk)
+                if resumable:
+                    self.journal.set_upload_offset(file_path, offset)
+                progress = start_prog + (end_prog - start_prog) * (offset / size)
+                progress_callback(cur_progress_step, round(progress, 1))
+        try:
+            return final.json()["scottyResourceId"]
+        except (ValueError, KeyError) as e:
+            raise YTUploaderException(
+                f"Upload of {file_path} did not return a resource id"
+            ) from e
+
+    def _get_creator_playlists(self, data):
+        playlists = super()._get_creator_playlists(data)
+        with self.playlists.lock:
+            # playlists we just created may not be listed yet
+            return {**playlists, **self.playlists.created}
+
+    def _create_playlist(self, playlist, data):
+        with self.playlists.lock:
+            if (
+                not playlist.create_if_title_exists
+                and playlist.title in self.playlists.created
+            ):
+                return self.playlists.created[playlist.title]
+            playlist_id = super()._create_playlist(playlist, data)
+            self.playlists.created[playlist.title] = playlist_id
+            return playlist_id
+
+
+def get_locked_cookie_jar(username: str, lock: threading.Lock):
+    """Returns the user's cookie jar, saving it only while
+    holding lock since every upload session saves the same file"""
+    cookie_jar = get_cookie_jar_for_username(username)
+    save = cookie_jar.save
+
+    def locked_save(*args, **kwargs):
+        with lock:
+            save(*args, **kwargs)
+
+    cookie_jar.save = locked_save
+    return cookie_jar
+
+
 class UploadWorker(QObject):
     upload_finished = Signal(str, bool)  # file_path, success
     log_message = Signal(str, int)  # message, loglevel
@@ -136,16 +344,27 @@ class UploadWorker(QObject):
         "finish": "Upload finished",
     }
 
-    def __init__(self, username, jobs):
+    def __init__(self, username, jobs: Queue, playlists=None, cookie_lock=None):
         super().__init__()
+        # (file, metadata) pairs, None once no more jobs will be added.
+        # Several workers can take jobs from the same queue
         self.jobs = jobs
         self.username = username
+        self.playlists = playlists or PlaylistRegistry()
+        self.cookie_lock = cookie_lock or threading.Lock()
+        self.stopped = False
+
+    def stop(self):
+        """Stop after the current upload instead of waiting for more jobs"""
+        self.stopped = True
+        self.jobs.put(None)
 
     def run(self):
         try:
-            cj = get_cookie_jar_for_username(self.username)
-            self.uploader = YTUploaderSession(cj)
-            for file, metadata in self.jobs:
+            cj = get_locked_cookie_jar(self.username, self.cookie_lock)
+            self.uploader = UploadSession(cj, self.playlists)
+            while not self.stopped and (job := self.jobs.get()) is not None:
+                file, metadata = job
 
                 last_step = None
                 def callback(step, progress):
@@ -153,7 +372,9 @@ class UploadWorker(QObject):
                     nonlocal last_step
                     if step != last_step:
                         last_step = step
-                        self.log_message.emit(self.UPLOAD_STEP_MESSAGES[step], logging.INFO)
+                        self.log_message.emit(
+                            f"{file} - {self.UPLOAD_STEP_MESSAGES[step]}", logging.INFO
+                        )
 
                 try:
                     self.log_message.emit(str(metadata), logging.DEBUG)
@@ -182,20 +403,33 @@ class Uploader(QObject):
     # worker name
     worker_done = Signal(str, bool)
 
-    def __init__(self, render_results, *args):
+    def __init__(self, render_results, *args, username=None):
         super().__init__()
+        self.username = username
         self.uploading = False
         self.jobs: List[Tuple[str, YTMetadata]] = []  # file path and metadata
         self.results = {}
         self.render_results = render_results
         self.cancelled = False
-        self.worker = None
-        self.thread = None
+        # worker -> thread it runs on
+        self.workers = {}
+        # threads are kept until they stop, a QThread
+        # must not be destroyed while it is running
+        self.threads = set()
+        # jobs not handed to a worker yet
+        self.queue = Queue()
+        self.started = False
+        self.closed = False
+        self.done = False
 
     def upload_finished(self, file_path, success):
         self.results[file_path] = success
         self.worker_done.emit(file_path, success)
 
+    def pending_count(self):
+        """Number of jobs which have not finished uploading"""
+        return sum(1 for file, _ in self.jobs if file not in self.results)
+
     def on_done_uploading(self, file_path, success):
         if not self.cancelled:
             self.uploading = False
@@ -203,15 +437,29 @@ class Uploader(QObject):
 
     def cancel(self):
         self.cancelled = True
+        self.done = True
+        for worker in self.workers:
+            worker.stop()
         for file, _ in self.jobs:
             if file not in self.results:
                 self.results[file] = False
         self.finished.emit(self.results)
 
+    def add_job(self, file, metadata):
+        self.jobs.append((file, metadata))
+        if self.done:
+            # the worker has stopped, nothing will upload this
+            self.upload_finished(file, False)
+        else:
+            self.queue.put((file, metadata))
+
     def add_upload_album_job(self, album: AlbumTreeWidgetItem):
         if album.childCount() == 0:
             return
-        if album.get("albumPlaylist") == SETTINGS_VALUES.AlbumPlaylist.SINGLE:
+        if album.get("albumPlaylist") in (
+            SETTINGS_VALUES.AlbumPlaylist.SINGLE,
+            SETTINGS_VALUES.AlbumPlaylist.SINGLE_PASS,
+        ):
             if album.get("uploadYouTube") == SETTINGS_VALUES.CheckBox.CHECKED:
                 file = album.get("fileOutput")
                 if file in self.render_results and self.render_results[file]:
@@ -235,7 +483,7 @@ class Uploader(QObject):
                             publish_to_feed=notify_subs,
                         )
                     )
-                    self.jobs.append((file, metadata))
+                    self.add_job(file, metadata)
         elif album.get("albumPlaylist") == SETTINGS_VALUES.AlbumPlaylist.MULTIPLE:
             for song in album.getChildren():
                 self.add_upload_song_job(song)
@@ -273,14 +521,22 @@ class Uploader(QObject):
                 if any(job_file == file for job_file, _ in self.jobs):
                     logger.error(f"Ignoring duplicate job {file}")
                 else:
-                    self.jobs.append((file, metadata))
+                    self.add_job(file, metadata)
 
     def is_uploading(self):
         return self.uploading
 
-    def worker_finished(self):
-        self.worker.deleteLater()
-        self.thread.quit()
+    def worker_finished(self, worker):
+        thread = self.workers.pop(worker)
+        worker.deleteLater()
+        thread.quit()
+        if self.cancelled or len(self.workers) > 0:
+            return
+        self.done = True
+        # jobs the worker never got to
+        for file, _ in self.jobs:
+            if file not in self.results:
+                self.upload_finished(file, False)
         self.finished.emit(self.results)
 
     def log(self, message, level):
@@ -288,26 +544,59 @@ class Uploader(QObject):
             logger.log(level, message)
 
     def upload(self):
-        self.results = {file: False for file, _ in self.jobs}
+        """Uploads the jobs which have been added so far"""
         if len(self.jobs) == 0:
+            self.results = {}
+            self.done = True
             self.finished.emit(self.results)
             return
-        self.thread = QThread()
-        username = get_setting("username")
+        self.start()
+        self.close()
+
+    def close(self):
+        """No more jobs will be added; finished is emitted once the
+        jobs which were added are done"""
+        if self.closed:
+            return
+        self.closed = True
+        if self.started:
+            # one for each worker
+            for _ in self.workers:
+                self.queue.put(None)
+        elif not self.done:
+            self.done = True
+            self.finished.emit(self.results)
+
+    def start(self):
+        """Starts uploadConcurrency workers. Jobs added from now on are
+        uploaded as soon as a worker is free, until close() is called"""
+        if self.started:
+            return
+        username = self.username or get_setting("username")
         if not username:
             raise ValueError(
                 "No user selected to upload to. Add a user at File > Settings > Add new user"
             )
-        self.worker = UploadWorker(username, self.jobs)
-        self.worker.moveToThread(self.thread)
-        self.thread.started.connect(self.worker.run)
-        self.worker.finished.connect(lambda: self.worker_finished())
-        self.thread.finished.connect(lambda: self.thread.deleteLater())
-        self.worker.log_message.connect(self.log)
-        self.worker.on_progress.connect(
-            lambda worker_name, progress: self.worker_progress.emit(
-                worker_name, progress
+        self.started = True
+        # shared by the workers
+        playlists = PlaylistRegistry()
+        cookie_lock = threading.Lock()
+        for _ in range(max(1, int(get_setting("uploadConcurrency")))):
+            thread = QThread()
+            worker = UploadWorker(username, self.queue, playlists, cookie_lock)
+            worker.moveToThread(thread)
+            thread.started.connect(worker.run)
+            worker.finished.connect(lambda worker=worker: self.worker_finished(worker))
+            thread.finished.connect(lambda thread=thread: self.threads.discard(thread))
+            thread.finished.connect(thread.deleteLater)
+            self.threads.add(thread)
+            worker.log_message.connect(self.log)
+            worker.on_progress.connect(
+                lambda worker_name, progress: self.worker_progress.emit(
+                    worker_name, progress
+                )
             )
-        )
-        self.worker.upload_finished.connect(self.upload_finished)
-        self.thread.start()
+            worker.upload_finished.connect(self.upload_finished)
+            self.workers[worker] = thread
+        for thread in self.workers.values():
+            thread.start()
@@ -3,6 +3,9 @@ import os
 import posixpath
 import shutil
 import sys
+import threading
+from collections import OrderedDict
+from stat import S_ISREG
 
 from PySide6.QtCore import *
 from PySide6.QtUiTools import QUiLoader
@@ -64,31 +67,111 @@ if os.name == "nt":
 
 
 def files_in_directory(dir_path: str):
-    """Generates all the files of the given directory"""
-    file = QDirIterator(dir_path, QDir.AllEntries | QDir.NoDotAndDotDot)
-    while file.hasNext():
-        yield file.next()
+    """Generates all the files and subdirectories of the given directory, by name"""
+    with os.scandir(dir_path) as entries:
+        names = sorted(entry.name for entry in entries)
+    for name in names:
+        yield posixpath.join(QDir.fromNativeSeparators(dir_path), name)
 
 
 def files_in_directory_and_subdirectories(dir_path: str):
     """Generates all the files in the given directory and subdirectories"""
-    file = QDirIterator(
-        dir_path,
-        QDir.AllEntries | QDir.NoDotAndDotDot,
-        QDirIterator.Subdirectories | QDirIterator.FollowSymlinks,
+    for root, dirs, names in os.walk(dir_path, followlinks=True):
+        dirs.sort()
+        root = QDir.fromNativeSeparators(root)
+        for name in sorted(dirs + names):
+            yield posixpath.join(root, name)
+
+
+# created on first use, see _get_mime_database
+_mime_database = None
+
+# (lower case extension, mime_prefix, exclude) -> whether files with the
+# extension have the type, or None if that depends on their contents.
+# Least recently used first
+_types_by_extension = OrderedDict()
+
+# (path, modification time) -> name of the MIME type found
+# from the contents of the file, least recently used first
+_mime_types_by_content = OrderedDict()
+
+# held while the above are used, files are classified on many threads
+_mime_lock = threading.Lock()
+
+# entries kept in each of _types_by_extension and _mime_types_by_content
+MAX_MIME_ENTRIES = 4096
+
+_NOT_FOUND = object()
+
+
+def _get_mime_database():
+    global _mime_database
+    with _mime_lock:
+        if _mime_database is None:
+            _mime_database = QMimeDatabase()
+        return _mime_database
+
+
+def _recall(memo, key):
+    """Returns the value remembered for key, or _NOT_FOUND"""
+    with _mime_lock:
+        if key not in memo:
+            return _NOT_FOUND
+        memo.move_to_end(key)
+        return memo[key]
+
+
+def _remember(memo, key, value):
+    with _mime_lock:
+        memo[key] = value
+        memo.move_to_end(key)
+        while len(memo) > MAX_MIME_ENTRIES:
+            memo.popitem(last=False)
+
+
+def mime_type_matches(name: str, mime_prefix: str, exclude=()):
+    return name.startswith(mime_prefix) and name not in exclude
+
+
+def extension_is_type(ext: str, mime_prefix: str, exclude=()):
+    """Returns whether files with the extension have the type, if every
+    MIME type which uses the extension gives the same answer, otherwise None"""
+    key = (ext.lower(), mime_prefix, tuple(exclude))
+    if (answer := _recall(_types_by_extension, key)) is not _NOT_FOUND:
+        return answer
+    types = (
+        _get_mime_database().mimeTypesForFileName("file" + key[0]) if ext else []
     )
-    while file.hasNext():
-        yield file.next()
+    answers = {
+        mime_type_matches(mime_type.name(), mime_prefix, exclude) for mime_type in types
+    }
+    answer = answers.pop() if len(answers) == 1 else None
+    _remember(_types_by_extension, key, answer)
+    return answer
 
 
 def file_is_type(file_path: str, mime_prefix: str, exclude=[]):
-    info = QFileInfo(file_path)
-    if not info.isReadable():
-        logger.info("File {} is not readable".format(info.filePath()))
+    """Returns true if the given file is readable and its MIME type starts
+    with mime_prefix and is not in exclude. The extension decides if it
+    can, otherwise the contents are read, once for as long as the file is
+    not modified"""
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        stat = None
+    if stat is None or not os.access(file_path, os.R_OK):
+        logger.info("File {} is not readable".format(file_path))
+        return False
+    if not S_ISREG(stat.st_mode):
         return False
-    db = QMimeDatabase()
-    mime_type = db.mimeTypeForFile(info)
-    return mime_type.name().startswith(mime_prefix) and mime_type.name() not in exclude
+    ext = os.path.splitext(file_path)[1]
+    if (answer := extension_is_type(ext, mime_prefix, exclude)) is not None:
+        return answer
+    key = (file_path, stat.st_mtime_ns)
+    if (name := _recall(_mime_types_by_content, key)) is _NOT_FOUND:
+        name = _get_mime_database().mimeTypeForFile(file_path).name()
+        _remember(_mime_types_by_content, key, name)
+    return mime_type_matches(name, mime_prefix, exclude)
 
 
 def file_is_audio(file_path: str):
@@ -0,0 +1,39 @@
+import logging
+import os
+import wave
+
+import pytest
+from PySide6.QtCore import QCoreApplication, QStandardPaths
+
+from songs_to_youtube.const import *
+from songs_to_youtube.log import addLoggingLevel
+
+
+@pytest.fixture(scope="session", autouse=True)
+def app():
+    # keep the journal, caches and settings out of the user's directories
+    QStandardPaths.setTestModeEnabled(True)
+    if not hasattr(logging, "SUCCESS"):
+        addLoggingLevel("SUCCESS", 60, "success")
+    app = QCoreApplication.instance() or QCoreApplication([])
+    app.setOrganizationName(ORGANIZATION)
+    app.setApplicationName(APPLICATION)
+    return app
+
+
+def write_wav(path, frames=800):
+    """Writes a short silent audio file"""
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(8000)
+        f.writeframes(b"\0\0" * frames)
+    return path
+
+
+@pytest.fixture
+def album_dir(tmp_path):
+    """A directory with two songs"""
+    for name in ("01.wav", "02.wav"):
+        write_wav(os.path.join(tmp_path, name))
+    return tmp_path.as_posix()
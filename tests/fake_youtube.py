@@ -0,0 +1,297 @@
+"""A local stand-in for YouTube, for exercising songs_to_youtube/upload.py
+without touching the real site.
+
+It implements every endpoint YTUploaderSession uses: the upload page which
+the session data is read from, the resumable upload protocol used by
+upload.youtube.com (start, query, upload and finalize commands), and the
+Studio API calls which create the video, playlists and captions and set
+the metadata. Latency, bandwidth and failures can be injected: requests
+can be delayed, upload data read at a limited rate, connections dropped
+part way through a chunk and requests answered with 503.
+
+    server = FakeYouTube(latency=0.05, bandwidth=10 * 1024 * 1024, drop_rate=0.1)
+    server.start()
+    install(session, server)  # send a requests.Session's traffic to it
+"""
+import itertools
+import json
+import random
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from requests.adapters import HTTPAdapter
+
+UPLOAD_HOST = "upload.youtube.com"
+STUDIO_API = "studio.youtube.com/youtubei/v1"
+CHANNEL_ID = "UCfakechannel"
+CHUNK_GRANULARITY = 256 * 1024
+# upload data is read in pieces of this size when bandwidth is limited
+READ_SIZE = 64 * 1024
+
+UPLOAD_PAGE = (
+    '<html><script>ytcfg.set({"INNERTUBE_API_KEY":"fake-api-key",'
+    '"SESSION_INDEX":"0","DELEGATED_SESSION_ID":"fake-session"});</script></html>'
+)
+
+
+class Upload:
+    def __init__(self, upload_id):
+        self.upload_id = upload_id
+        self.data = bytearray()
+        self.final = False
+
+
+class FakeYouTube(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self, port=0, latency=0.0, bandwidth=None, drop_rate=0.0, error_rate=0.0, seed=None
+    ):
+        super().__init__(("127.0.0.1", port), FakeYouTubeHandler)
+        # seconds added to every request
+        self.latency = latency
+        # bytes per second upload data is read at per connection, None for no limit
+        self.bandwidth = bandwidth
+        # chance that a chunk is cut off part way and the connection dropped
+        self.drop_rate = drop_rate
+        # chance that a request is answered with 503 Service Unavailable
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        # upload id -> Upload
+        self.uploads = {}
+        # video id -> createvideo request
+        self.videos = {}
+        # title -> playlist id
+        self.playlists = {}
+        # (method, host and path) -> number of requests
+        self.requests = {}
+        self.dropped = 0
+        self.errors = 0
+        # bytes of upload data received, including resent ones
+        self.received = 0
+        self.thread = None
+
+    @property
+    def address(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def should_drop(self):
+        with self.lock:
+            drop = self.random.random() < self.drop_rate
+            self.dropped += drop
+            return drop
+
+    def should_fail(self):
+        with self.lock:
+            fail = self.random.random() < self.error_rate
+            self.errors += fail
+            return fail
+
+    def count_request(self, method, path):
+        with self.lock:
+            self.requests[(method, path)] = self.requests.get((method, path), 0) + 1
+
+    def new_id(self, prefix):
+        with self.lock:
+            return f"{prefix}{next(self.ids)}"
+
+    def new_upload(self):
+        with self.lock:
+            upload = Upload(str(next(self.ids)))
+            self.uploads[upload.upload_id] = upload
+            return upload
+
+
+class FakeYouTubeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: FakeYouTube
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        if self.server.bandwidth is None:
+            return self.rfile.read(length) if length else b""
+        body = bytearray()
+        start = time.perf_counter()
+        while len(body) < length:
+            body += self.rfile.read(min(READ_SIZE, length - len(body)))
+            # sleep until the data read so far fits the bandwidth
+            ahead = len(body) / self.server.bandwidth - (time.perf_counter() - start)
+            if ahead > 0:
+                time.sleep(ahead)
+        return bytes(body)
+
+    def read_json(self):
+        body = self.read_body()
+        return json.loads(body) if body else {}
+
+    def send(self, status, body=b"", headers=None):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def parse_request_url(self):
+        # the original host is kept in the path by ToFakeYouTubeAdapter
+        url = urllib.parse.urlsplit(self.path.lstrip("/"))
+        self.server.count_request(self.command, url.path)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        return url, urllib.parse.parse_qs(url.query)
+
+    def fail(self):
+        """Answers with 503 if a failure is injected"""
+        if not self.server.should_fail():
+            return False
+        self.read_body()
+        self.send(503)
+        return True
+
+    def do_GET(self):
+        url, _ = self.parse_request_url()
+        if self.fail():
+            return
+        if url.path in ("youtube.com/upload", "www.youtube.com/upload"):
+            self.send(
+                303,
+                headers={
+                    "Location": f"https://studio.youtube.com/channel/{CHANNEL_ID}/videos/upload"
+                },
+            )
+        elif url.path.startswith(f"studio.youtube.com/channel/{CHANNEL_ID}"):
+            self.send(
+                200, UPLOAD_PAGE.encode("utf-8"), {"Content-Type": "text/html"}
+            )
+        else:
+            self.send(404)
+
+    def do_POST(self):
+        url, query = self.parse_request_url()
+        if self.fail():
+            return
+        command = self.headers.get("x-goog-upload-command", "")
+        if url.path.startswith(f"{STUDIO_API}/"):
+            self.handle_studio_api(url.path[len(STUDIO_API) + 1 :])
+        elif url.path.startswith(f"{UPLOAD_HOST}/upload/") and "upload_id" in query:
+            self.handle_upload(query["upload_id"][0], command)
+        elif url.path.startswith(f"{UPLOAD_HOST}/upload/") and command == "start":
+            self.read_body()
+            upload = self.server.new_upload()
+            self.send(
+                200,
+                headers={
+                    "x-goog-upload-status": "active",
+                    "x-goog-upload-url": f"https://{url.path}?upload_id={upload.upload_id}",
+                    "x-goog-upload-chunk-granularity": str(CHUNK_GRANULARITY),
+                },
+            )
+        else:
+            self.read_body()
+            self.send(404)
+
+    def handle_studio_api(self, method):
+        request = self.read_json()
+        if method == "upload/createvideo":
+            video_id = self.server.new_id("video")
+            with self.server.lock:
+                self.server.videos[video_id] = request
+            self.send(200, {"videoId": video_id})
+        elif method == "creator/list_creator_playlists":
+            with self.server.lock:
+                playlists = [
+                    {"title": title, "playlistId": playlist_id}
+                    for title, playlist_id in self.server.playlists.items()
+                ]
+            self.send(200, {"playlists": playlists})
+        elif method == "playlist/create":
+            playlist_id = self.server.new_id("playlist")
+            with self.server.lock:
+                self.server.playlists[request.get("title", playlist_id)] = playlist_id
+            self.send(200, {"playlistId": playlist_id})
+        elif method in ("video_manager/metadata_update", "globalization/update_captions"):
+            self.send(200, {})
+        else:
+            self.send(404)
+
+    def handle_upload(self, upload_id, command):
+        body = self.read_body()
+        with self.server.lock:
+            self.server.received += len(body)
+        upload = self.server.uploads.get(upload_id)
+        if upload is None:
+            self.send(404)
+            return
+        if command == "query":
+            self.send_status(upload)
+            return
+        commands = {part.strip() for part in command.split(",")}
+        offset = int(self.headers.get("x-goog-upload-offset", -1))
+        if upload.final or offset != len(upload.data):
+            self.send(400, headers={"x-goog-upload-status": "active"})
+            return
+        if self.server.should_drop():
+            # keep part of the chunk, like a server which
+            # received some of it before the connection broke
+            upload.data += body[: len(body) // 2]
+            self.close_connection = True
+            self.connection.shutdown(2)
+            return
+        upload.data += body
+        if "finalize" in commands:
+            upload.final = True
+        self.send_status(upload)
+
+    def send_status(self, upload: Upload):
+        headers = {
+            "x-goog-upload-status": "final" if upload.final else "active",
+            "x-goog-upload-size-received": str(len(upload.data)),
+        }
+        body = {"scottyResourceId": f"scotty-{upload.upload_id}"} if upload.final else b""
+        self.send(200, body, headers)
+
+
+class ToFakeYouTubeAdapter(HTTPAdapter):
+    """Sends requests for any host to the fake server, keeping
+    the original host in the path so the server can route it"""
+
+    def __init__(self, address, **kwargs):
+        super().__init__(**kwargs)
+        self.address = address
+
+    def send(self, request, **kwargs):
+        original_url = request.url
+        url = urllib.parse.urlsplit(request.url)
+        request.url = f"{self.address}/{url.netloc}{url.path}" + (
+            f"?{url.query}" if url.query else ""
+        )
+        response = super().send(request, **kwargs)
+        # YTUploaderSession reads the channel id from the URL
+        response.url = request.url = original_url
+        return response
+
+
+def install(session: requests.Session, server: FakeYouTube):
+    adapter = ToFakeYouTubeAdapter(server.address)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
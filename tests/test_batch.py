@@ -0,0 +1,43 @@
+import json
+
+import pytest
+
+from songs_to_youtube.batch import load_manifest
+
+
+def write_manifest(tmp_path, entries):
+    path = tmp_path / "manifest.json"
+    path.write_text(json.dumps(entries), encoding="utf-8")
+    return path.as_posix()
+
+
+def test_load_manifest(tmp_path):
+    path = write_manifest(
+        tmp_path,
+        [
+            "album",
+            {"path": "song.flac", "type": "song", "settings": {"videoWidth": "1280"}},
+            {"path": str(tmp_path / "other")},
+        ],
+    )
+    assert list(load_manifest(path)) == [
+        (str(tmp_path / "album"), None, {}),
+        (str(tmp_path / "song.flac"), "song", {"videoWidth": "1280"}),
+        (str(tmp_path / "other"), None, {}),
+    ]
+
+
+@pytest.mark.parametrize(
+    "entries, message",
+    [
+        ({"path": "album"}, "must contain a list"),
+        ([1], "Entry 0 .* must be a path or an object"),
+        (["album", {"type": "album"}], "Entry 1 .* must have a path"),
+        ([{"path": "album", "type": "playlist"}], 'must be "album" or "song"'),
+        ([{"path": "album", "settings": []}], "settings of entry 0 .* an object"),
+    ],
+)
+def test_invalid_manifest(tmp_path, entries, message):
+    path = write_manifest(tmp_path, entries)
+    with pytest.raises(ValueError, match=message):
+        list(load_manifest(path))
@@ -0,0 +1,112 @@
+import os
+
+import pytest
+
+from songs_to_youtube.batch import create_album_items, create_song_item
+from songs_to_youtube.journal import BATCH_RUN, GUI_RUN, JobJournal
+
+
+@pytest.fixture
+def journal_path(tmp_path):
+    return (tmp_path / "journal.sqlite3").as_posix()
+
+
+def song_item(album_dir, name="01.wav"):
+    item = create_song_item(os.path.join(album_dir, name).replace(os.sep, "/"), {})
+    item.before_render()
+    return item
+
+
+def album_item(album_dir, settings=None):
+    (item,) = create_album_items(album_dir, settings or {})
+    # as the pipeline does before recording an album
+    item.before_render()
+    for song in item.getChildren():
+        song.before_render()
+    return item
+
+
+def test_unfinished_items_are_restored(album_dir, journal_path):
+    journal = JobJournal(journal_path)
+    assert not journal.has_unfinished()
+    first, second = song_item(album_dir, "01.wav"), song_item(album_dir, "02.wav")
+    journal.record_item(first, upload=False)
+    journal.record_item(second, upload=False)
+    assert journal.has_unfinished()
+
+    open(first.get("fileOutput"), "wb").close()
+    journal.set_rendered(first.get("fileOutput"), True)
+    assert journal.is_rendered(first.get("fileOutput"))
+    assert not journal.is_rendered(second.get("fileOutput"))
+
+    # the journal is reopened after the app was restarted
+    items = JobJournal(journal_path).load_items()
+    assert [item.get("song_path") for item in items] == [second.get("song_path")]
+    items[0].before_render()
+    assert items[0].get("fileOutput") == second.get("fileOutput")
+
+
+def test_rendered_output_which_is_gone_is_not_rendered(album_dir, journal_path):
+    journal = JobJournal(journal_path)
+    song = song_item(album_dir)
+    journal.record_item(song, upload=False)
+    journal.set_rendered(song.get("fileOutput"), True)
+    assert not journal.is_rendered(song.get("fileOutput"))
+
+
+def test_rendered_item_is_restored_until_uploaded(album_dir, journal_path):
+    journal = JobJournal(journal_path)
+    song = song_item(album_dir)
+    journal.record_item(song, upload=True)
+    journal.set_rendered(song.get("fileOutput"), True)
+    assert len(journal.load_items()) == 1
+    journal.set_uploaded(song.get("fileOutput"), True)
+    assert journal.load_items() == []
+
+
+def test_album_is_restored_with_its_songs(album_dir, journal_path):
+    journal = JobJournal(journal_path)
+    album = album_item(album_dir)
+    journal.record_item(album, upload=False)
+    (restored,) = journal.load_items()
+    restored.before_render()
+    for song in restored.getChildren():
+        song.before_render()
+    assert restored.get("fileOutput") == album.get("fileOutput")
+    assert [song.get("fileOutput") for song in restored.getChildren()] == [
+        song.get("fileOutput") for song in album.getChildren()
+    ]
+
+
+def test_recording_again_keeps_status(album_dir, journal_path):
+    journal = JobJournal(journal_path)
+    song = song_item(album_dir)
+    journal.record_item(song, upload=True)
+    journal.set_rendered(song.get("fileOutput"), True)
+    journal.set_uploaded(song.get("fileOutput"), True)
+    journal.record_item(song, upload=True)
+    assert journal.load_items() == []
+
+
+def test_runs_are_kept_apart(album_dir, journal_path):
+    gui = JobJournal(journal_path, run=GUI_RUN)
+    batch = JobJournal(journal_path, run=BATCH_RUN)
+    gui.record_item(song_item(album_dir, "01.wav"), upload=False)
+    batch.record_item(song_item(album_dir, "02.wav"), upload=False)
+    assert [item.get("song_file") for item in gui.load_items()] == ["01.wav"]
+    assert [item.get("song_file") for item in batch.load_items()] == ["02.wav"]
+
+    batch.clear()
+    assert not batch.has_unfinished()
+    assert gui.has_unfinished()
+
+
+def test_upload_is_forgotten_when_file_changes(tmp_path, journal_path):
+    journal = JobJournal(journal_path)
+    video = tmp_path / "video.mkv"
+    video.write_bytes(b"video")
+    journal.save_upload(video.as_posix(), "https://upload", "id")
+    journal.set_upload_offset(video.as_posix(), 3)
+    assert journal.get_upload(video.as_posix()) == ("https://upload", "id", 3)
+    video.write_bytes(b"another video")
+    assert journal.get_upload(video.as_posix()) is None
@@ -0,0 +1,39 @@
+from mutagen.easyid3 import EasyID3
+from mutagen.id3 import ID3, RVA2, TALB, TIT2, TPE1, TRCK, TXXX
+from mutagen.mp4 import MP4Tags
+
+from songs_to_youtube.metadata import easy_items
+
+
+def test_easy_items_of_id3_tags_match_easy_id3(tmp_path):
+    path = (tmp_path / "tags.id3").as_posix()
+    tags = ID3()
+    tags.add(TIT2(text=["Title"]))
+    tags.add(TPE1(text=["Artist"]))
+    tags.add(TALB(text=["Album"]))
+    tags.add(TRCK(text=["3/10"]))
+    tags.add(TXXX(desc="MusicBrainz Album Id", text=["album-id"]))
+    tags.add(RVA2(desc="track", channel=1, gain=-3.5, peak=1.0))
+    tags.save(path)
+
+    items = easy_items(ID3(path))
+    assert items == dict(EasyID3(path))
+    assert items["title"] == ["Title"]
+    assert items["musicbrainz_albumid"] == ["album-id"]
+    assert items["replaygain_track_gain"] == ["-3.500000 dB"]
+
+
+def test_easy_items_of_mp4_tags():
+    tags = MP4Tags()
+    tags["\xa9nam"] = ["Title"]
+    tags["\xa9ART"] = ["Artist"]
+    tags["\xa9day"] = ["2020"]
+    tags["trkn"] = [(3, 10)]
+    tags["purl"] = ["https://example.com"]
+    assert easy_items(tags) == {
+        "title": ["Title"],
+        "artist": ["Artist"],
+        "date": ["2020"],
+        "tracknumber": ["3/10"],
+        "url": ["https://example.com"],
+    }
@@ -0,0 +1,165 @@
+import os
+
+import pytest
+
+from songs_to_youtube.batch import create_song_item
+from songs_to_youtube.cache import DiskCache
+from songs_to_youtube.render import RenderSongWorker
+from songs_to_youtube.render_cache import (
+    command_value_names,
+    render_key,
+    restore_render,
+    store_render,
+)
+
+COMMAND = (
+    "ffmpeg -i {song_path} -i {coverArt} -s {videoWidth}x{videoHeight} {fileOutput}"
+)
+
+
+@pytest.fixture
+def values(album_dir, tmp_path):
+    cover_art = tmp_path / "cover.png"
+    cover_art.write_bytes(b"cover art")
+    return {
+        "song_path": os.path.join(album_dir, "01.wav"),
+        "song_dir": album_dir,
+        "song_file": "01.wav",
+        "coverArt": cover_art.as_posix(),
+        "fileOutput": "/videos/song.mkv",
+        "threads": "4",
+        "videoWidth": "1920",
+        "videoHeight": "1080",
+        "backgroundColor": "black",
+        "title": "Title",
+    }
+
+
+def test_command_value_names():
+    assert command_value_names("{a} {b.c} {d[0]} {{e}}") == {"a", "b", "d"}
+    assert {"background", "videoWidth", "backgroundColor"} <= command_value_names(
+        "{background[blurred]}"
+    )
+
+
+def test_same_render_same_key(values):
+    assert render_key(values, COMMAND) == render_key(dict(values), COMMAND)
+
+
+def test_unused_and_ignored_values_do_not_change_key(values):
+    key = render_key(values, COMMAND)
+    changed = {
+        "title": "Other title",
+        "backgroundColor": "white",
+        "threads": "8",
+        "fileOutput": "/elsewhere/other name.mkv",
+    }
+    for name, value in changed.items():
+        assert render_key({**values, name: value}, COMMAND) == key, name
+
+
+def test_moved_inputs_keep_key(values, tmp_path):
+    key = render_key(values, COMMAND)
+    moved = tmp_path / "moved.wav"
+    os.rename(values["song_path"], moved)
+    assert render_key({**values, "song_path": moved.as_posix()}, COMMAND) == key
+
+
+def test_render_inputs_change_key(values):
+    key = render_key(values, COMMAND)
+    assert render_key({**values, "videoWidth": "1280"}, COMMAND) != key
+    assert render_key({**values, "fileOutput": "/videos/song.mp4"}, COMMAND) != key
+    assert render_key(values, COMMAND + " -r 1") != key
+    with open(values["coverArt"], "ab") as f:
+        f.write(b" changed")
+    assert render_key(values, COMMAND) != key
+
+
+def test_background_values_are_part_of_key(values):
+    command = "ffmpeg -i {song_path} {background[blurred]} {fileOutput}"
+    key = render_key(values, command)
+    assert render_key({**values, "backgroundColor": "white"}, command) != key
+
+
+def new_cache(tmp_path, max_size):
+    directory = tmp_path / "renders"
+    directory.mkdir(exist_ok=True)
+    return DiskCache(directory.as_posix(), max_size)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return new_cache(tmp_path, 1024 * 1024)
+
+
+def render(path, data):
+    """Stands in for ffmpeg writing the output"""
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_miss(cache, values, tmp_path):
+    output = (tmp_path / "out.mkv").as_posix()
+    assert not restore_render(cache, render_key(values, COMMAND), output)
+    assert not os.path.exists(output)
+
+
+def test_hit_restores_stored_render(cache, values, tmp_path):
+    key = render_key(values, COMMAND)
+    first = (tmp_path / "first.mkv").as_posix()
+    render(first, b"video")
+    store_render(cache, key, first)
+    # the output is kept where it was rendered
+    assert read(first) == b"video"
+
+    second = (tmp_path / "other" / "second.mkv").as_posix()
+    assert restore_render(cache, key, second)
+    assert read(second) == b"video"
+    # restoring over an existing output replaces it
+    third = (tmp_path / "third.mkv").as_posix()
+    render(third, b"old video")
+    assert restore_render(cache, key, third)
+    assert read(third) == b"video"
+
+
+def test_changed_render_misses(cache, values, tmp_path):
+    output = (tmp_path / "out.mkv").as_posix()
+    render(output, b"video")
+    store_render(cache, render_key(values, COMMAND), output)
+    changed_values = render_key({**values, "videoWidth": "1280"}, COMMAND)
+    changed_command = render_key(values, COMMAND + " -r 1")
+    assert not restore_render(cache, changed_values, output)
+    assert not restore_render(cache, changed_command, output)
+
+
+def test_least_recently_used_render_is_evicted(tmp_path, values):
+    cache = new_cache(tmp_path, 10)
+    keys = [render_key({**values, "videoWidth": str(i)}, COMMAND) for i in range(3)]
+    outputs = [(tmp_path / f"{i}.mkv").as_posix() for i in range(3)]
+    for key, output in zip(keys[:2], outputs):
+        render(output, b"video")
+        store_render(cache, key, output)
+    # the first render was used last
+    assert restore_render(cache, keys[0], outputs[0])
+    render(outputs[2], b"video")
+    store_render(cache, keys[2], outputs[2])
+
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None and cache.get(keys[2]) is not None
+    assert cache.size() <= 10
+    # outputs are not removed with the cached renders
+    assert read(outputs[1]) == b"video"
+
+
+def test_render_is_not_cached_without_cover_art(album_dir, values):
+    song = create_song_item(os.path.join(album_dir, "01.wav").replace(os.sep, "/"))
+    song.before_render()
+    worker = RenderSongWorker(song, auto_delete=True)
+    assert worker.cache_key(values, COMMAND) == render_key(values, COMMAND)
+    missing = {**values, "coverArt": os.path.join(album_dir, "missing.png")}
+    assert worker.cache_key(missing, COMMAND) is None
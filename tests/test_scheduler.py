@@ -0,0 +1,120 @@
+import pytest
+
+from songs_to_youtube.scheduler import JobScheduler
+
+
+def pop_all(scheduler):
+    workers = []
+    while (worker := scheduler.pop_ready()) is not None:
+        workers.append(worker)
+    return workers
+
+
+def test_longest_critical_path_first():
+    scheduler = JobScheduler()
+    scheduler.add("single", "single", cost=5)
+    scheduler.add("song1", "song1", cost=2)
+    scheduler.add("song2", "song2", cost=3)
+    # the album is rendered once both of its songs are
+    scheduler.add("album", "album", cost=10, depends_on=("song1", "song2"))
+    assert pop_all(scheduler) == ["song2", "song1", "single"]
+    scheduler.finish("song2", True)
+    assert not scheduler.has_ready()
+    scheduler.finish("song1", True)
+    assert pop_all(scheduler) == ["album"]
+
+
+def test_ties_keep_the_order_jobs_were_added_in():
+    scheduler = JobScheduler()
+    for name in ("a", "b", "c"):
+        scheduler.add(name, name, cost=1)
+    assert pop_all(scheduler) == ["a", "b", "c"]
+
+
+def test_dependency_which_is_done_already():
+    scheduler = JobScheduler()
+    scheduler.add("song", "song", cost=1)
+    scheduler.pop_ready()
+    scheduler.finish("song", True)
+    scheduler.add("album", "album", depends_on=("song",))
+    assert pop_all(scheduler) == ["album"]
+
+
+def test_failed_job_drops_its_dependents():
+    scheduler = JobScheduler()
+    scheduler.add("song", "song")
+    scheduler.add("album", "album", depends_on=("song",))
+    scheduler.add("upload", "upload", depends_on=("album",))
+    scheduler.add("other", "other")
+    pop_all(scheduler)
+    assert scheduler.finish("song", False) == ["album", "upload"]
+    assert not scheduler.has_ready()
+    # dropped jobs are done, finishing them again does nothing
+    assert scheduler.finish("album", True) == []
+
+
+def test_add_after_failed_dependency():
+    scheduler = JobScheduler()
+    scheduler.add("song", "song")
+    pop_all(scheduler)
+    scheduler.finish("song", False)
+    assert scheduler.add("album", "album", depends_on=("song",))
+    assert scheduler.has_failed("album")
+    assert not scheduler.has_ready()
+    # and so do the jobs which need it
+    scheduler.add("upload", "upload", depends_on=("album",))
+    assert scheduler.has_failed("upload")
+    assert scheduler.pop_ready() is None
+
+
+def test_add_after_dropped_dependency():
+    scheduler = JobScheduler()
+    scheduler.add("song", "song")
+    scheduler.add("album", "album", depends_on=("song",))
+    pop_all(scheduler)
+    scheduler.finish("song", False)
+    scheduler.add("upload", "upload", depends_on=("album",))
+    assert scheduler.has_failed("upload")
+
+
+def test_add_after_finished_dependency():
+    scheduler = JobScheduler()
+    scheduler.add("song", "song")
+    pop_all(scheduler)
+    scheduler.finish("song", True)
+    scheduler.add("album", "album", depends_on=("song",))
+    assert not scheduler.has_failed("album")
+    assert pop_all(scheduler) == ["album"]
+
+
+def test_unknown_dependency():
+    scheduler = JobScheduler()
+    with pytest.raises(ValueError, match="not added: song"):
+        scheduler.add("album", "album", depends_on=("song",))
+    assert "album" not in scheduler.jobs
+
+
+def test_duplicate_job_is_not_added():
+    scheduler = JobScheduler()
+    assert scheduler.add("song", "first", cost=1)
+    assert not scheduler.add("song", "second", cost=100)
+    assert pop_all(scheduler) == ["first"]
+
+
+def test_clear():
+    scheduler = JobScheduler()
+    scheduler.add("song", "song")
+    scheduler.clear()
+    assert scheduler.pop_ready() is None
+    assert scheduler.add("song", "song")
+
+
+def test_rank_includes_jobs_added_later():
+    scheduler = JobScheduler()
+    scheduler.add("song", "song", cost=1)
+    scheduler.add("single", "single", cost=5)
+    # songs are added before the album which depends on them
+    scheduler.add("album", "album", cost=10, depends_on=("song",))
+    assert scheduler.has_ready()
+    assert pop_all(scheduler) == ["song", "single"]
+    assert not scheduler.has_ready()
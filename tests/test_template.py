@@ -0,0 +1,115 @@
+import pytest
+from pathvalidate import sanitize_filename
+from PySide6.QtCore import QSettings
+
+from songs_to_youtube.template import SettingTemplate, compile_template
+from songs_to_youtube.utils import resource_path
+
+EDGE_CASES = [
+    "",
+    "no placeholders",
+    "~~{escaped} ~",
+    "~{missing}",
+    '~{missing|"literal"}',
+    "~{<missing>|title}",
+    "~{missing|<title>}",
+    '~{"title"}',
+    "~none ~None ~{}",
+    "~{title}~{artist}~~~{album}",
+    '~{a|b|c|d|""}',
+]
+
+# tags and fields like those of a song item
+MAPPING = {
+    "song_dir": "/music/Artist/Album",
+    "song_file": "01 - Song: Title?.flac",
+    "song_path": "/music/Artist/Album/01 - Song: Title?.flac",
+    "album_dir": "/music/Artist/Album",
+    "title": "Song: Title?",
+    "artist": "Artist",
+    "album": "Album",
+    "albumartist": "Artist",
+    "date": "2020",
+    "comment": "A comment",
+    "song.album": "Album",
+    "song.albumartist": "Artist",
+    "song.date": "2020",
+    "timestamps": "00:00:00 Song",
+    "videoTitle": "Artist - Song: Title?",
+}
+
+
+def regex_safe_substitute(template, mapping):
+    """How templates were substituted before they were compiled"""
+
+    def convert(mo):
+        named = mo.group("named") or mo.group("braced")
+        if named is not None:
+            for arg in named.split("|"):
+                if arg in mapping:
+                    return str(mapping[arg])
+                elif len(arg) >= 2 and arg[0] == '"' and arg[-1] == '"':
+                    return arg[1:-1]
+                elif len(arg) >= 2 and arg[0] == "<" and arg[-1] == ">":
+                    arg = arg[1:-1]
+                    if arg in mapping:
+                        return sanitize_filename(str(mapping[arg]))
+                    else:
+                        return "INVALID"
+            return mo.group()
+        if mo.group("escaped") is not None:
+            return SettingTemplate.delimiter
+        return mo.group()
+
+    return SettingTemplate.pattern.sub(convert, template)
+
+
+def default_templates():
+    defaults = QSettings(resource_path("config/default.ini"), QSettings.IniFormat)
+    return {
+        key: defaults.value(key)
+        for key in defaults.allKeys()
+        if "~" in str(defaults.value(key))
+    }
+
+
+@pytest.mark.parametrize("template", EDGE_CASES)
+def test_edge_cases_match_regex_substitution(template):
+    expected = regex_safe_substitute(template, MAPPING)
+    assert compile_template(template).substitute(MAPPING) == expected
+
+
+def test_default_templates_match_regex_substitution():
+    templates = default_templates()
+    assert len(templates) > 0
+    for key, template in templates.items():
+        expected = regex_safe_substitute(template, MAPPING)
+        assert compile_template(template).substitute(MAPPING) == expected, key
+
+
+def test_placeholders():
+    mapping = {"title": "Song: Title?", "artist": "Artist"}
+    substitute = compile_template
+    assert substitute("~{title}").substitute(mapping) == "Song: Title?"
+    assert substitute("~{missing|artist}").substitute(mapping) == "Artist"
+    assert substitute('~{missing|"x"|title}').substitute(mapping) == "x"
+    assert substitute("~{<title>}").substitute(mapping) == "Song Title"
+    assert substitute("~{<missing>}").substitute(mapping) == "INVALID"
+    assert substitute("~{missing}").substitute(mapping) == "~{missing}"
+    assert substitute("~~{title} ~").substitute(mapping) == "~{title} ~"
+
+
+def test_keys():
+    assert compile_template("~{a|<b>|c} ~~{d} ~{e}").keys == {"a", "<b>", "b", "e"}
+
+
+def test_template_is_compiled_once():
+    assert compile_template("~{title}") is compile_template("~{title}")
+
+
+def test_safe_substitute():
+    template = SettingTemplate("~{title} - ~{artist}")
+    mapping = {"title": "Title", "artist": "Artist"}
+    assert template.safe_substitute(mapping) == "Title - Artist"
+    assert template.safe_substitute(mapping, artist="Other") == "Title - Other"
+    assert template.safe_substitute(title="Title") == "Title - ~{artist}"
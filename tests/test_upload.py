@@ -0,0 +1,141 @@
+import os
+from http.cookiejar import Cookie, MozillaCookieJar
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+from songs_to_youtube.journal import JobJournal
+from songs_to_youtube.upload import PlaylistRegistry, UploadSession
+from tests.fake_youtube import FakeYouTube, install
+
+CHUNK_SIZE = 256 * 1024
+
+
+class Stopped(Exception):
+    pass
+
+
+@pytest.fixture
+def server():
+    server = FakeYouTube(seed=0).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def journal(tmp_path):
+    journal = JobJournal((tmp_path / "journal.sqlite3").as_posix())
+    yield journal
+    journal.connection.close()
+
+
+@pytest.fixture
+def video(tmp_path):
+    path = (tmp_path / "video.mkv").as_posix()
+    with open(path, "wb") as f:
+        f.write(os.urandom(8 * CHUNK_SIZE))
+    return path
+
+
+@pytest.fixture
+def cookies_path(tmp_path):
+    path = (tmp_path / "cookies.txt").as_posix()
+    cookie_jar = MozillaCookieJar(path)
+    cookie_jar.set_cookie(
+        Cookie(
+            0, "SAPISID", "fake", None, False, ".youtube.com", True, True,
+            "/", True, True, None, False, None, None, {},
+        )
+    )
+    cookie_jar.save(ignore_discard=True, ignore_expires=True)
+    return path
+
+
+@pytest.fixture
+def new_session(server, journal, cookies_path):
+    def new_session():
+        session = UploadSession(
+            MozillaCookieJar(cookies_path), PlaylistRegistry(), journal
+        )
+        session.CHUNK_SIZE = CHUNK_SIZE
+        # the server is local, don't wait between retries
+        session.MAX_BACKOFF = 0
+        install(session._session, server)
+        return session
+
+    return new_session
+
+
+def upload(session, file_path, stop_at=None):
+    """Uploads the video like YTUploaderSession.upload does, raising
+    Stopped once the upload is stop_at percent done"""
+
+    def progress_callback(step, percent):
+        if stop_at is not None and percent >= stop_at:
+            raise Stopped()
+
+    session.file_path = file_path
+    url = session._get_video_upload_url(SimpleNamespace(authuser="0"))
+    return session._upload_file(
+        url, file_path, progress_callback, "get_upload_url", "upload_video"
+    )
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_upload(server, new_session, video):
+    assert upload(new_session(), video) == "scotty-1"
+    (uploaded,) = server.uploads.values()
+    assert uploaded.final and uploaded.data == read(video)
+    assert server.received == len(uploaded.data)
+
+
+def test_upload_survives_dropped_connections(server, new_session, video):
+    server.drop_rate = 0.3
+    upload(new_session(), video)
+    assert server.dropped > 0
+    (uploaded,) = server.uploads.values()
+    assert uploaded.data == read(video)
+
+
+def test_upload_resumes_after_restart(server, journal, new_session, video):
+    # the video upload is 20% to 70% of the progress
+    with pytest.raises(Stopped):
+        upload(new_session(), video, stop_at=45)
+    upload_url, _, offset = journal.get_upload(video)
+    assert 0 < offset < len(read(video))
+
+    upload(new_session(), video)
+    (uploaded,) = server.uploads.values()
+    assert uploaded.data == read(video)
+    # only the chunk which was being sent when it stopped is sent again
+    assert server.received <= len(uploaded.data) + CHUNK_SIZE
+
+
+def test_upload_starts_over_when_url_expired(server, journal, new_session, video):
+    with pytest.raises(Stopped):
+        upload(new_session(), video, stop_at=45)
+    expired_url = journal.get_upload(video)[0]
+    # the server forgot the upload, queries of its URL get 404
+    server.uploads.clear()
+
+    upload(new_session(), video)
+    (uploaded,) = server.uploads.values()
+    assert uploaded.data == read(video)
+    assert journal.get_upload(video)[0] != expired_url
+
+
+def test_new_upload_url_is_not_replaced(server, new_session, video):
+    session = new_session()
+    session.file_path = video
+    url = session._get_video_upload_url(SimpleNamespace(authuser="0"))
+    server.uploads.clear()
+    # only upload URLs saved by an earlier session can have expired
+    with pytest.raises(requests.HTTPError):
+        session._upload_file(
+            url, video, lambda step, percent: None, "get_upload_url", "upload_video"
+        )